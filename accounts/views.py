@@ -9,11 +9,11 @@ from rest_framework.views import APIView
 from kavenegar import KavenegarAPI, APIException, HTTPException
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import RefreshToken
-import redis
+from config.redis_client import get_redis
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
-r = redis.from_url(settings.REDIS_URL)
+r = get_redis()
 
 OTP_TTL_SECONDS = 180  # 3 دقیقه
 RATE_LIMIT_KEY = "otp:lim:"  # otp:lim:<phone>
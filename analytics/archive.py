@@ -0,0 +1,145 @@
+"""
+Retention for the append-only hot tables.
+
+``archive(kind)`` moves rows past their horizon out of the database in id
+order, ``ARCHIVE_BATCH_SIZE`` at a time. Each batch is serialised with
+Django's ``jsonl`` serializer, gzipped and written to MinIO as
+``archive/<kind>/<YYYY>/<MM>/<first_id>-<last_id>.jsonl.gz``; only then are
+the rows deleted, in the same transaction that records the ArchiveBatch. A
+crash between the upload and the delete leaves an object that the next run
+overwrites under the same name.
+
+* ``messages``: ChatMessages older than ``CHAT_ARCHIVE_AFTER_DAYS`` that the
+  thread's newest MemorySummary already covers, so prompts lose nothing.
+* ``usage``: UsageRecords older than ``USAGE_ARCHIVE_AFTER_DAYS``.
+  Transactions stay where they are: they are the wallet ledger that
+  ``reconcile_ledger`` sums.
+
+``restore`` loads a batch back (optionally one thread only), skipping rows
+whose thread or user is gone.
+"""
+import gzip
+import io
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import serializers
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+from analytics import metrics
+from analytics.models import ArchiveBatch
+from billing.models import UsageRecord
+from chat import storage
+from chat.models import ChatMessage, ChatThread, MemorySummary
+
+logger = logging.getLogger(__name__)
+
+
+def _messages(cutoff):
+    covered = MemorySummary.objects.filter(thread=OuterRef("thread_id")).order_by("-id").values("up_to_message_id")
+    return (
+        ChatMessage.objects.filter(created_at__lt=cutoff)
+        .annotate(covered_up_to=Subquery(covered[:1]))
+        .filter(id__lte=F("covered_up_to"))
+    )
+
+
+def _usage(cutoff):
+    return UsageRecord.objects.filter(created_at__lt=cutoff)
+
+
+def _usage_stats(rows) -> dict:
+    # همان شمارشی که reconcile_ledger روی جدول انجام می‌دهد
+    keyed = sum(1 for r in rows if r.idempotency_key and not r.idempotency_key.startswith("summary:"))
+    return {"ledger_keys": keyed}
+
+
+KINDS = {
+    "messages": (ChatMessage, _messages, "CHAT_ARCHIVE_AFTER_DAYS", lambda rows: {}),
+    "usage": (UsageRecord, _usage, "USAGE_ARCHIVE_AFTER_DAYS", _usage_stats),
+}
+
+
+def cutoff(kind: str, now=None):
+    """Rows created before this are archived; None when the kind's horizon is 0 (disabled)."""
+    days = getattr(settings, KINDS[kind][2])
+    if days <= 0:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def candidates(kind: str, now=None):
+    limit = cutoff(kind, now)
+    model, query = KINDS[kind][:2]
+    return query(limit) if limit is not None else model.objects.none()
+
+
+def _write_batch(kind: str, rows) -> ArchiveBatch:
+    model, _, _, stats = KINDS[kind]
+    data = gzip.compress(serializers.serialize("jsonl", rows).encode())
+    oldest, newest = min(r.created_at for r in rows), max(r.created_at for r in rows)
+    name = f"archive/{kind}/{oldest:%Y/%m}/{rows[0].id}-{rows[-1].id}.jsonl.gz"
+    storage.put_file(name, io.BytesIO(data), len(data), content_type="application/gzip")
+    with transaction.atomic():
+        batch, _ = ArchiveBatch.objects.update_or_create(
+            object_name=name,
+            defaults=dict(kind=kind, first_id=rows[0].id, last_id=rows[-1].id, rows=len(rows),
+                          oldest=oldest, newest=newest, stats=stats(rows)),
+        )
+        model.objects.filter(id__in=[r.id for r in rows]).delete()
+    metrics.incr("archive.rows", len(rows), kind=kind)
+    metrics.incr("archive.bytes", len(data), kind=kind)
+    return batch
+
+
+def archive(kind: str, max_batches: int | None = None, now=None) -> int:
+    """Archive up to ``max_batches`` (default ``ARCHIVE_MAX_BATCHES``) batches of ``kind``; returns rows moved."""
+    qs = candidates(kind, now).order_by("id")
+    max_batches = settings.ARCHIVE_MAX_BATCHES if max_batches is None else max_batches
+    after, moved = 0, 0
+    for _ in range(max_batches):
+        rows = list(qs.filter(id__gt=after)[: settings.ARCHIVE_BATCH_SIZE])
+        if not rows:
+            break
+        _write_batch(kind, rows)
+        after = rows[-1].id
+        moved += len(rows)
+    if moved:
+        logger.info("archived %s %s rows", moved, kind)
+    return moved
+
+
+def restore(object_name: str, thread_id: int | None = None) -> int:
+    """
+    Put an archived batch back into its table; returns rows restored.
+
+    A full restore forgets the batch and its object. A ``thread_id`` restore
+    keeps them, since the rest of the batch is still only in the archive.
+    """
+    batch = ArchiveBatch.objects.get(object_name=object_name)
+    text = gzip.decompress(storage.read(object_name)).decode()
+    items = list(serializers.deserialize("jsonl", text))
+    if batch.kind == "messages":
+        if thread_id is not None:
+            items = [d for d in items if d.object.thread_id == thread_id]
+        alive = set(ChatThread.objects.filter(id__in={d.object.thread_id for d in items}).values_list("id", flat=True))
+        items = [d for d in items if d.object.thread_id in alive]
+    else:
+        alive = set(get_user_model().objects.filter(
+            id__in={d.object.user_id for d in items}).values_list("id", flat=True))
+        taken = set(UsageRecord.objects.filter(
+            idempotency_key__in=[d.object.idempotency_key for d in items if d.object.idempotency_key]
+        ).values_list("idempotency_key", flat=True))
+        items = [d for d in items if d.object.user_id in alive and d.object.idempotency_key not in taken]
+
+    with transaction.atomic():
+        for d in items:
+            d.save()  # raw save: keeps the original id and created_at
+        if thread_id is None:
+            batch.delete()
+    if thread_id is None:
+        storage.remove(object_name)
+    metrics.incr("archive.restored", len(items), kind=batch.kind)
+    return len(items)
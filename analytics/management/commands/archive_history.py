@@ -0,0 +1,37 @@
+# analytics/management/commands/archive_history.py
+from django.core.management.base import BaseCommand, CommandError
+from analytics import archive
+from analytics.models import ArchiveBatch
+
+
+class Command(BaseCommand):
+    help = "Move old chat messages and usage records to MinIO archives, or restore an archive batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kind", choices=sorted(archive.KINDS), help="Only this kind (default: all).")
+        parser.add_argument("--max-batches", type=int, default=None)
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived.")
+        parser.add_argument("--list", action="store_true", help="List archive batches.")
+        parser.add_argument("--restore", metavar="OBJECT_NAME", help="Load this archive object back.")
+        parser.add_argument("--thread", type=int, help="With --restore: only this thread's messages.")
+
+    def handle(self, *args, **opts):
+        if opts["restore"]:
+            try:
+                restored = archive.restore(opts["restore"], thread_id=opts["thread"])
+            except ArchiveBatch.DoesNotExist:
+                raise CommandError(f"no archive batch {opts['restore']}")
+            self.stdout.write(self.style.SUCCESS(f"restored {restored} rows"))
+            return
+
+        kinds = [opts["kind"]] if opts["kind"] else list(archive.KINDS)
+        if opts["list"]:
+            for b in ArchiveBatch.objects.filter(kind__in=kinds).order_by("kind", "first_id"):
+                self.stdout.write(f"{b.object_name} rows={b.rows} oldest={b.oldest:%Y-%m-%d} newest={b.newest:%Y-%m-%d}")
+            return
+        for kind in kinds:
+            if opts["dry_run"]:
+                self.stdout.write(f"{kind}: {archive.candidates(kind).count()} rows past the horizon")
+            else:
+                moved = archive.archive(kind, max_batches=opts["max_batches"])
+                self.stdout.write(f"{kind}: archived {moved} rows")
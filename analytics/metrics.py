@@ -0,0 +1,73 @@
+"""
+Process-local counters and latency summaries.
+
+Every gunicorn/uvicorn/Celery process keeps its own registry; ``snapshot()``
+is what ``/metrics`` returns, so scrape each process (or ship the JSON
+from the audit log pipeline) and aggregate downstream.
+"""
+import threading
+from collections import defaultdict, deque
+
+WINDOW = 2048  # نمونه‌های اخیر هر summary برای p50/p95/p99
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_summaries = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def incr(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def observe(name: str, value: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = {"count": 0, "sum": 0.0, "recent": deque(maxlen=WINDOW)}
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["recent"].append(value)
+
+
+def quantile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def counter_value(name: str, **labels) -> float:
+    return _counters.get(_key(name, labels), 0)
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        summaries = []
+        for (name, labels), s in sorted(_summaries.items()):
+            recent = list(s["recent"])
+            summaries.append({
+                "name": name,
+                "labels": dict(labels),
+                "count": s["count"],
+                "sum": s["sum"],
+                "p50": quantile(recent, 0.50),
+                "p95": quantile(recent, 0.95),
+                "p99": quantile(recent, 0.99),
+            })
+    return {"counters": counters, "summaries": summaries}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
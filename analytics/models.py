@@ -0,0 +1,22 @@
+from django.db import models
+
+
+ARCHIVE_KINDS = (("messages", "messages"), ("usage", "usage"))
+
+
+class ArchiveBatch(models.Model):
+    """One gzipped JSONL object in MinIO holding rows moved out of a hot table (analytics.archive)."""
+
+    kind = models.CharField(max_length=16, choices=ARCHIVE_KINDS)
+    object_name = models.CharField(max_length=255, unique=True)
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    rows = models.IntegerField()
+    oldest = models.DateTimeField()
+    newest = models.DateTimeField()
+    # برای usage: تعداد رکوردهای کلیددار ledger، تا reconcile_ledger آن‌ها را هم بشمارد
+    stats = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["kind", "first_id"], name="analytics_archive_kind_idx")]
@@ -0,0 +1,75 @@
+"""
+Rolling thread summaries through a cheap catalog model.
+
+Each call folds the previous summary with only the messages after its
+``up_to_message_id``, so the summary stays short and its cost tracks new
+activity. Token spend is recorded as ``UsageRecord`` rows of a system user
+(no wallet debit). If the model is missing or the call fails, a plain
+truncation of the same inputs is used instead.
+"""
+import logging
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from analytics import metrics
+from billing import catalog
+from chat import openai_client
+
+logger = logging.getLogger(__name__)
+
+INSTRUCTIONS = (
+    "You maintain the memory of a conversation between a child and a friendly assistant. "
+    "Update the summary with the new messages: keep names, preferences, ongoing topics and "
+    "promises; drop greetings and small talk. Reply with the updated summary only, in the "
+    "conversation's language, at most {words} words."
+)
+FALLBACK_CHARS = 800
+
+
+def system_user():
+    user, _ = get_user_model().objects.get_or_create(
+        username=settings.SUMMARY_SYSTEM_USERNAME, defaults={"is_active": False}
+    )
+    return user
+
+
+def model():
+    return catalog.get_enabled(settings.SUMMARY_MODEL_ALIAS)
+
+
+def _transcript(messages) -> str:
+    return "\n".join(f"{m.role}: {m.content[:500]}" for m in messages)
+
+
+def build_prompt(previous: str, messages):
+    return [
+        {"role": "system", "content": INSTRUCTIONS.format(words=settings.SUMMARY_MAX_WORDS)},
+        {
+            "role": "user",
+            "content": f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{_transcript(messages)}",
+        },
+    ]
+
+
+def fallback(previous: str, messages) -> str:
+    txt = "\n".join(f"{m.role[:1]}: {m.content[:100]}" for m in messages)
+    return "\n".join(p for p in (previous, txt) if p)[-FALLBACK_CHARS:]
+
+
+def summarize(cat, previous: str, messages):
+    """Return ``(summary, in_tokens, out_tokens)``; tokens are 0 when the fallback was used."""
+    if cat is None:
+        metrics.incr("summary.fallback", reason="no_model")
+        return fallback(previous, messages), 0, 0
+    try:
+        resp, usage = openai_client.chat_completion(cat.model_name, build_prompt(previous, messages))
+        in_tokens, out_tokens, _ = openai_client.split_usage(usage)
+        text = (resp.choices[0].message.content or "").strip()
+    except Exception:
+        logger.warning("summary call to %s failed; truncating instead", cat.alias, exc_info=True)
+        metrics.incr("summary.fallback", reason="error")
+        return fallback(previous, messages), 0, 0
+    if not text:
+        metrics.incr("summary.fallback", reason="empty")
+        return fallback(previous, messages), in_tokens, out_tokens
+    metrics.incr("summary.tokens", in_tokens + out_tokens, model=cat.alias)
+    return text, in_tokens, out_tokens
@@ -1,13 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from analytics import archive, summarizer
+from billing.models import UsageRecord
+from billing.pricing import cost_usd
+from chat import context_cache
 from chat.models import ChatThread, ChatMessage, MemorySummary
 
+# زمان شروع آخرین اجرای summariser منهای یک حاشیه؛ فقط threadهایی که بعد از آن فعال بوده‌اند بررسی می‌شوند
+WATERMARK_KEY = "analytics:summarize:watermark"
+LOCK_KEY = "analytics:summarize:lock:{}"
+
+
+def _latest_summary(thread_ref="pk"):
+    return MemorySummary.objects.filter(thread=OuterRef(thread_ref)).order_by("-id")
+
+
+def pending_threads(since=None):
+    """Threads whose newest message is past the newest summary's ``up_to_message_id``."""
+    qs = ChatThread.objects.all()
+    if since is not None:
+        qs = qs.filter(last_activity__gte=since)
+    return qs.annotate(
+        last_message_id=Subquery(
+            ChatMessage.objects.filter(thread=OuterRef("pk")).order_by("-id").values("id")[:1]
+        ),
+        summarized_up_to=Coalesce(Subquery(_latest_summary().values("up_to_message_id")[:1]), 0),
+    ).filter(last_message_id__gt=F("summarized_up_to"))
+
 
 @shared_task
 def summarize_active_threads():
-    for t in ChatThread.objects.all():
-        msgs = ChatMessage.objects.filter(thread=t).order_by("-id")[:30]
-        if not msgs:
-            continue
-        txt = "\n".join(f"{m.role[:1]}: {m.content[:100]}" for m in msgs[::-1])
-        MemorySummary.objects.create(thread=t, summary=f"Condensed: {txt[:800]}")
+    """
+    Fan out summarisation of threads with new messages in keyset chunks.
+
+    Cost follows activity since the previous run rather than every thread ever
+    created; a missing watermark (first run, cache flush) falls back to a full scan.
+    The watermark trails the run's start by ``SUMMARY_WATERMARK_OVERLAP_SECONDS``,
+    so threads touched by transactions that committed late, or whose chunk
+    failed, are looked at again; summaries are keyed by ``up_to_message_id``,
+    so rereading a summarised thread costs one query and no model call.
+    """
+    started = timezone.now()
+    since = cache.get(WATERMARK_KEY)
+    chunk_size = settings.SUMMARY_CHUNK_SIZE
+    last_id, chunks = 0, 0
+    while True:
+        ids = list(
+            pending_threads(since).filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        summarize_threads.delay(ids)
+        chunks += 1
+        last_id = ids[-1]
+    cache.set(WATERMARK_KEY, started - timedelta(seconds=settings.SUMMARY_WATERMARK_OVERLAP_SECONDS), None)
+    return chunks
+
+
+@shared_task
+def summarize_threads(thread_ids):
+    """
+    Fold new messages into each thread's summary; threads with nothing new are skipped.
+
+    Each thread is claimed in the cache for ``SUMMARY_LOCK_SECONDS`` first, so
+    a redelivered or overlapping run skips it instead of paying for the same
+    summary again. DB reads happen up front, the model calls run on a bounded
+    thread pool (``SUMMARY_CONCURRENCY``), then summaries and usage rows are
+    bulk-inserted; ``(thread, up_to_message_id)`` is unique, so a summary that
+    slips past an expired claim is dropped.
+    """
+    claimed = [tid for tid in thread_ids if cache.add(LOCK_KEY.format(tid), 1, settings.SUMMARY_LOCK_SECONDS)]
+    try:
+        return _summarize(claimed) if claimed else 0
+    finally:
+        cache.delete_many([LOCK_KEY.format(tid) for tid in claimed])
+
+
+def _summarize(thread_ids):
+    threads = ChatThread.objects.filter(id__in=thread_ids).annotate(
+        summarized_up_to=Coalesce(Subquery(_latest_summary().values("up_to_message_id")[:1]), 0),
+        previous=Subquery(_latest_summary().values("summary")[:1]),
+    )
+    work = []
+    for t in threads:
+        msgs = list(
+            ChatMessage.objects.filter(thread=t, id__gt=t.summarized_up_to)
+            .only("id", "role", "content")
+            .order_by("-id")[: settings.SUMMARY_MAX_NEW_MESSAGES]
+        )
+        if msgs:
+            work.append((t, msgs[::-1]))
+    if not work:
+        return 0
 
+    cat = summarizer.model()
+    with ThreadPoolExecutor(max_workers=settings.SUMMARY_CONCURRENCY) as pool:
+        results = list(pool.map(lambda item: summarizer.summarize(cat, item[0].previous or "", item[1]), work))
+
+    system_id = summarizer.system_user().id if cat is not None else None
+    summaries, usages = [], []
+    for (t, msgs), (text, in_tokens, out_tokens) in zip(work, results):
+        up_to = msgs[-1].id
+        summaries.append(MemorySummary(thread=t, summary=text, up_to_message_id=up_to))
+        if in_tokens or out_tokens:
+            usages.append(UsageRecord(
+                user_id=system_id, model_alias=cat.alias,
+                input_tokens=in_tokens, output_tokens=out_tokens,
+                cost_usd=cost_usd(cat.alias, in_tokens, out_tokens, cat=cat),
+                # اجرای دوبارهٔ همان chunk هزینه را دوبار ثبت نمی‌کند
+                idempotency_key=f"summary:{t.id}:{up_to}",
+            ))
+    with transaction.atomic():
+        MemorySummary.objects.bulk_create(summaries, ignore_conflicts=True)
+        UsageRecord.objects.bulk_create(usages, ignore_conflicts=True)
+    for summary in summaries:
+        context_cache.set_summary(summary.thread_id, summary.summary)
+    return len(summaries)
+
+
+@shared_task
+def archive_history():
+    """Nightly retention pass over every archive kind (see analytics.archive)."""
+    return {kind: archive.archive(kind) for kind in archive.KINDS}
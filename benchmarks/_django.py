@@ -0,0 +1,35 @@
+import os
+import sys
+from pathlib import Path
+
+
+def setup_django():
+    """Boot Django against a throwaway migrated test database (sqlite unless configured otherwise)."""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    os.environ.setdefault("USE_SQLITE_FOR_TESTS", "1")
+
+    import django
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    setup_test_environment()
+
+    from django.db import connection
+
+    connection.creation.create_test_db(verbosity=0)
+
+
+def seed_chat_user(username="bench", balance=10**12, alias="robot-bench"):
+    from decimal import Decimal
+    from django.contrib.auth import get_user_model
+    from billing.models import ModelCatalog, Wallet
+
+    ModelCatalog.objects.get_or_create(
+        alias=alias,
+        defaults=dict(model_name="gpt-bench", input_per_million_usd=Decimal("0.15"),
+                      output_per_million_usd=Decimal("0.60")),
+    )
+    user = get_user_model().objects.create_user(username=username)
+    Wallet.objects.filter(user=user).update(balance_tokens=balance)
+    return user
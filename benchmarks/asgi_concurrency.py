@@ -0,0 +1,65 @@
+"""
+How many chat sends can one ASGI process keep in flight?
+
+Fires ``--requests`` concurrent POSTs at ``/api/chat/send/async`` through the
+ASGI handler (in-process, no network between client and app) while the
+upstream is a local FakeOpenAI that holds every completion for ``--latency``
+seconds. With the async pipeline the peak in-flight count at the fake
+upstream approaches ``--requests``; a sync worker would top out at one.
+
+    python -m benchmarks.asgi_concurrency --requests 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks._django import setup_django, seed_chat_user
+from benchmarks.fake_openai import FakeOpenAI
+
+
+async def run(n_requests: int, latency: float, path: str):
+    from django.conf import settings
+    from django.test import AsyncClient
+
+    # سقف pool اتصال‌ها خودش سقف هم‌زمانی است؛ برای این اندازه‌گیری بازش می‌کنیم
+    settings.OPENAI_MAX_CONNECTIONS = max(settings.OPENAI_MAX_CONNECTIONS, n_requests)
+
+    fake = await FakeOpenAI(latency=latency).start()
+    os.environ["OPENAI_API_BASE"] = fake.base_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+
+    from asgiref.sync import sync_to_async
+
+    user = await sync_to_async(seed_chat_user)()
+    client = AsyncClient()
+    await client.aforce_login(user)
+
+    async def one(i):
+        res = await client.post(path, {"model_alias": "robot-bench", "prompt": f"question {i}"},
+                                content_type="application/json")
+        return res.status_code
+
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(one(i) for i in range(n_requests)))
+    elapsed = time.perf_counter() - started
+    await fake.stop()
+
+    ok = sum(1 for s in statuses if s == 200)
+    print(f"requests={n_requests} ok={ok} upstream_latency={latency}s")
+    print(f"peak in-flight upstream calls (one process): {fake.peak_in_flight}")
+    print(f"wall={elapsed:.2f}s throughput={n_requests / elapsed:.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--path", default="/api/chat/send/async")
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(run(args.requests, args.latency, args.path))
+
+
+if __name__ == "__main__":
+    main()
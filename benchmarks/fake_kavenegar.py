@@ -0,0 +1,37 @@
+"""
+Stand-in for ``kavenegar.KavenegarAPI`` used by the replay benchmark.
+
+The SDK always posts to ``https://api.kavenegar.com``, so instead of a local
+HTTP server this replaces the class itself: ``verify_lookup`` sleeps for
+``latency`` seconds (a float or a callable) and remembers the last code sent
+to each receptor, so a replayed ``verify-otp`` can use it.
+"""
+import threading
+import time
+
+
+class FakeKavenegar:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.codes = {}
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, apikey=None, *args, **kwargs):
+        # جای سازندهٔ KavenegarAPI(apikey) می‌نشیند
+        return self
+
+    def install(self):
+        from accounts import views
+
+        views.KavenegarAPI = self
+        return self
+
+    def verify_lookup(self, params):
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.codes[params["receptor"]] = params["token"]
+            self.sent += 1
+        return [{"messageid": self.sent, "status": 5, "receptor": params["receptor"]}]
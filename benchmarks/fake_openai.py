@@ -0,0 +1,137 @@
+"""
+Deterministic stand-in for the OpenAI HTTP API, used by the benchmarks.
+
+Speaks just enough HTTP/1.1 (keep-alive included) for the ``openai`` SDK:
+``POST /v1/chat/completions`` with and without ``stream``. Every response is
+delayed by ``latency`` seconds so in-flight concurrency can be observed;
+setting ``status`` to an error code (e.g. 500) makes it fail every request.
+"""
+import asyncio
+import json
+import threading
+import time
+
+
+class FakeOpenAI:
+    def __init__(self, latency: float = 0.2, reply: str = "The sky is blue because of Rayleigh scattering.",
+                 status: int = 200):
+        self.latency = latency
+        self.reply = reply
+        self.status = status
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.served = 0
+        self.connections = 0
+        self.port = None
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """Run the server on its own loop in a daemon thread (for sync callers)."""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    def _delay(self) -> float:
+        return self.latency() if callable(self.latency) else self.latency
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+                payload = json.loads(body or b"{}")
+
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                try:
+                    await asyncio.sleep(self._delay())
+                    if self.status != 200:
+                        self._write_json(writer, {"error": {"message": "fake failure", "type": "server_error"}},
+                                         status=self.status)
+                    elif payload.get("stream"):
+                        await self._write_stream(writer, payload)
+                    else:
+                        self._write_json(writer, self._completion(payload))
+                    await writer.drain()
+                finally:
+                    self.in_flight -= 1
+                    self.served += 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _usage(self, payload):
+        prompt = sum(len(m.get("content") or "") for m in payload.get("messages", [])) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": len(self.reply.split()),
+                "total_tokens": prompt + len(self.reply.split())}
+
+    def _completion(self, payload):
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.reply}}],
+            "usage": self._usage(payload),
+        }
+
+    def _write_json(self, writer, data, status: int = 200):
+        body = json.dumps(data).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n".encode()
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+
+    async def _write_stream(self, writer, payload):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": payload.get("model", "fake")}
+        events = [
+            {**base, "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+            for word in self.reply.split()
+        ]
+        events.append({**base, "choices": [], "usage": self._usage(payload)})
+        for event in events:
+            self._write_chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+            await writer.drain()
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+
+    @staticmethod
+    def _write_chunk(writer, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
@@ -0,0 +1,155 @@
+"""
+In-memory stand-in for the S3 API subset the ``minio`` client uses for uploads.
+
+Speaks HTTP/1.1 with keep-alive: bucket HEAD/PUT, ``GET ?location``, object
+PUT/HEAD/GET/DELETE and the three multipart calls (initiate, upload part,
+complete). Bodies are read and counted but only kept with ``keep_bodies=True``
+(single PUTs only; objects always HEAD back with their size and content
+type); signatures are not checked. ``latency`` is seconds per request or a
+callable returning them (e.g. a sampled distribution).
+"""
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+_XML = '<?xml version="1.0" encoding="UTF-8"?>\n'
+_NS = 'xmlns="http://s3.amazonaws.com/doc/2006-03-01/"'
+
+
+class FakeS3:
+    def __init__(self, latency: float = 0.0, keep_bodies: bool = False):
+        self.latency = latency
+        self.keep_bodies = keep_bodies
+        self.bodies = {}
+        self.buckets = set()
+        self.objects = {}  # key -> size
+        self.content_types = {}
+        self.connections = 0
+        self.bytes_received = 0
+        self.calls = Counter()
+        self.port = None
+        self._uploads = {}
+        self._server = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def start_in_thread(self):
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                size, data = await self._drain_body(reader, headers, self.keep_bodies)
+                self.bytes_received += size
+                if self.latency:
+                    await asyncio.sleep(self.latency() if callable(self.latency) else self.latency)
+                status, extra, body = self._route(method, target, size, headers, data)
+                if "Content-Length" not in extra:
+                    extra = f"Content-Length: {len(body)}\r\n{extra}"
+                writer.write(f"HTTP/1.1 {status}\r\n{extra}\r\n".encode() + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _drain_body(reader, headers, keep: bool):
+        remaining = int(headers.get("content-length", 0) or 0)
+        size = remaining
+        kept = bytearray() if keep else None
+        while remaining:
+            chunk = await reader.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(chunk)
+            if keep:
+                kept += chunk
+        return size, kept
+
+    def _route(self, method, target, size, headers, data=None):
+        url = urlsplit(target)
+        query = parse_qs(url.query, keep_blank_values=True)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        etag = f'ETag: "{hashlib.md5(target.encode()).hexdigest()}"\r\n'
+        self.calls[(method, "object" if key else "bucket", tuple(sorted(query)))] += 1
+
+        if not key:
+            if method == "HEAD":
+                return ("200 OK", "", b"") if bucket in self.buckets else ("404 Not Found", "", b"")
+            if method == "PUT":
+                self.buckets.add(bucket)
+                return "200 OK", "", b""
+            if method == "GET" and "location" in query:
+                return "200 OK", "Content-Type: application/xml\r\n", \
+                    f"{_XML}<LocationConstraint {_NS}></LocationConstraint>".encode()
+        elif bucket not in self.buckets:
+            body = f"{_XML}<Error><Code>NoSuchBucket</Code><Message>no bucket</Message>" \
+                   f"<BucketName>{bucket}</BucketName></Error>".encode()
+            return "404 Not Found", "Content-Type: application/xml\r\n", body
+        elif method == "POST" and "uploads" in query:
+            upload_id = hashlib.md5(f"{key}{len(self._uploads)}".encode()).hexdigest()
+            self._uploads[upload_id] = 0
+            return "200 OK", "Content-Type: application/xml\r\n", (
+                f"{_XML}<InitiateMultipartUploadResult {_NS}><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            ).encode()
+        elif method == "PUT" and "uploadId" in query:
+            self._uploads[query["uploadId"][0]] += size
+            return "200 OK", etag, b""
+        elif method == "POST" and "uploadId" in query:
+            self.objects[key] = self._uploads.pop(query["uploadId"][0], 0)
+            return "200 OK", "Content-Type: application/xml\r\n", (
+                f"{_XML}<CompleteMultipartUploadResult {_NS}><Location>/{bucket}/{key}</Location>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>\"done\"</ETag></CompleteMultipartUploadResult>"
+            ).encode()
+        elif method == "PUT":
+            self.objects[key] = size
+            self.content_types[key] = headers.get("content-type", "application/octet-stream")
+            if data is not None:
+                self.bodies[key] = bytes(data)
+            return "200 OK", etag, b""
+        elif method == "GET" and key in self.bodies:
+            return "200 OK", f"Content-Type: {self.content_types[key]}\r\n{etag}", self.bodies[key]
+        elif method == "HEAD":
+            if key not in self.objects:
+                return "404 Not Found", "", b""
+            return "200 OK", f"Content-Length: {self.objects[key]}\r\n" \
+                f"Content-Type: {self.content_types.get(key, 'application/octet-stream')}\r\n{etag}", b""
+        elif method == "DELETE":
+            self.objects.pop(key, None)
+            self.bodies.pop(key, None)
+            return "204 No Content", "", b""
+        return "400 Bad Request", "", b""
@@ -0,0 +1,78 @@
+"""
+Deep-page cost of OFFSET vs keyset pagination over ChatMessage.
+
+Seeds ``--messages`` rows (default 1M) into ``--threads`` threads of the
+test database, then times one page at increasing depths of the busiest
+thread, both as ``qs[offset:offset + limit]`` (the naive listing) and as
+``chat.history.page_messages`` with a cursor:
+
+    python -m benchmarks.history_pagination
+    python -m benchmarks.history_pagination --messages 200000 --limit 100
+"""
+import argparse
+import time
+
+from benchmarks._django import seed_chat_user, setup_django
+
+
+def seed(messages, threads, batch=20000):
+    from chat.models import ChatMessage, ChatThread
+
+    user = seed_chat_user()
+    thread_ids = [t.id for t in ChatThread.objects.bulk_create(
+        ChatThread(user=user, model_alias="robot-bench") for _ in range(threads))]
+    big = thread_ids[0]  # half of all messages land in one long thread
+    body = "lorem ipsum dolor sit amet " * 20
+    for start in range(0, messages, batch):
+        ChatMessage.objects.bulk_create(
+            ChatMessage(
+                thread_id=big if i % 2 else thread_ids[i % threads],
+                role="user" if i % 4 < 2 else "assistant",
+                content=body,
+                meta={"usage": {"prompt_tokens": 100, "completion_tokens": 50}},
+            )
+            for i in range(start, min(start + batch, messages))
+        )
+    return big
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    setup_django()
+
+    from chat import history
+    from chat.models import ChatMessage
+
+    t0 = time.perf_counter()
+    thread_id = seed(args.messages, args.threads)
+    print(f"seeded messages={args.messages} threads={args.threads} seconds={time.perf_counter() - t0:.1f}")
+
+    ids = list(ChatMessage.objects.filter(thread_id=thread_id).order_by("-id").values_list("id", flat=True))
+    depth = 1
+    while depth < len(ids):
+        offset_ms = timed(lambda: list(
+            ChatMessage.objects.filter(thread_id=thread_id).order_by("-id")[depth:depth + args.limit]
+        ), args.repeat)
+        cursor = history.encode_cursor(ids[depth - 1])
+        keyset_ms = timed(lambda: history.page_messages(thread_id, cursor, args.limit), args.repeat)
+        print(f"depth={depth} offset_ms={offset_ms:.2f} keyset_ms={keyset_ms:.2f} "
+              f"speedup={offset_ms / keyset_ms:.1f}")
+        depth *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Upload normalisation throughput (chat.imaging.normalize) in images/s per core.
+
+Generates synthetic phone-style JPEGs (noise plus gradients, EXIF with an
+orientation tag) and normalises them in a process pool, once with JPEG draft
+mode and once decoding at full resolution:
+
+    python -m benchmarks.image_normalize --images 64 --workers 4 --size 4032x3024
+    python -m benchmarks.image_normalize --format JPEG --workers 1
+"""
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks._django import setup_django
+
+
+def make_photo(width, height, seed) -> bytes:
+    from PIL import Image
+
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    exif = Image.Exif()
+    exif[0x010F] = "BenchPhone"
+    exif[0x0112] = 6
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def _normalize(args):
+    from chat import imaging
+
+    data, draft = args
+    t0 = time.perf_counter()
+    out = imaging.normalize(data, draft=draft)
+    return time.perf_counter() - t0, len(data), len(out.display) + len(out.thumbnail)
+
+
+def run(photos, images, workers, draft):
+    jobs = [(photos[i % len(photos)], draft) for i in range(images)]
+    # forked workers inherit the configured Django settings
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_normalize, jobs[:workers]))  # warm the workers
+        t0 = time.perf_counter()
+        results = list(pool.map(_normalize, jobs))
+        wall = time.perf_counter() - t0
+    cpu = sum(r[0] for r in results)
+    return {
+        "images": images,
+        "wall_s": wall,
+        "images_per_s": images / wall,
+        "images_per_s_per_core": images / wall / workers,
+        "ms_per_image": cpu / images * 1000,
+        "in_MB": sum(r[1] for r in results) / images / 1e6,
+        "out_KB": sum(r[2] for r in results) / images / 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--size", default="4032x3024", help="source WIDTHxHEIGHT")
+    parser.add_argument("--format", default="WEBP", choices=("WEBP", "JPEG"))
+    parser.add_argument("--distinct", type=int, default=4, help="different source photos to cycle through")
+    args = parser.parse_args()
+    setup_django()
+
+    from django.conf import settings
+
+    settings.IMAGE_NORMALIZE_FORMAT = args.format
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    photos = [make_photo(width, height, seed) for seed in range(args.distinct)]
+    for label, draft in (("full_decode", False), ("draft", True)):
+        result = run(photos, args.images, args.workers, draft)
+        print(f"{label:12s} workers={args.workers} " + " ".join(
+            f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
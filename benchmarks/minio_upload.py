@@ -0,0 +1,112 @@
+"""
+Image upload throughput: client per request vs the shared chat.storage client.
+
+``per_request`` replays the old ImageUploadView path: build a ``Minio``
+client, ``bucket_exists`` and then ``put_object`` for every upload.
+``shared`` calls ``chat.storage.put_file``, which reuses one pooled client
+and checks the bucket once. Runs against a local FakeS3 unless ``--endpoint``
+points at a real MinIO (credentials from ``--access-key``/``--secret-key``):
+
+    python -m benchmarks.minio_upload --uploads 200 --size 262144 --threads 8
+    python -m benchmarks.minio_upload --endpoint http://localhost:9000 --size 33554432 --uploads 20
+"""
+import argparse
+import io
+import statistics
+import threading
+import time
+
+from benchmarks._django import setup_django
+from benchmarks.fake_s3 import FakeS3
+
+
+def per_request_upload(name, data, size):
+    from django.conf import settings
+    from minio import Minio
+
+    client = Minio(
+        settings.MINIO_ENDPOINT.replace("http://", "").replace("https://", ""),
+        access_key=settings.MINIO_ACCESS_KEY,
+        secret_key=settings.MINIO_SECRET_KEY,
+        secure=settings.MINIO_ENDPOINT.startswith("https://"),
+    )
+    if not client.bucket_exists(settings.MINIO_BUCKET):
+        client.make_bucket(settings.MINIO_BUCKET)
+    client.put_object(settings.MINIO_BUCKET, name, data, length=size, content_type="image/png")
+
+
+def shared_upload(name, data, size):
+    from chat import storage
+
+    storage.put_file(name, data, size, content_type="image/png")
+
+
+def run(strategy, label, uploads, size, threads):
+    payload = bytes(range(256)) * (size // 256) + b"\0" * (size % 256)
+    latencies = []
+    lock = threading.Lock()
+    gate = threading.Barrier(threads)
+
+    def worker(tid):
+        gate.wait()
+        local = []
+        for i in range(tid, uploads, threads):
+            t0 = time.perf_counter()
+            strategy(f"bench/{label}/{i}.png", io.BytesIO(payload), size)
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "uploads": len(latencies),
+        "wall_s": wall,
+        "uploads_per_s": len(latencies) / wall,
+        "MB_per_s": len(latencies) * size / wall / 1e6,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--size", type=int, default=256 * 1024, help="bytes per upload")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--part-size", type=int, default=None, help="MINIO_PART_SIZE override")
+    parser.add_argument("--endpoint", default="", help="real MinIO, e.g. http://localhost:9000")
+    parser.add_argument("--access-key", default="minioadmin")
+    parser.add_argument("--secret-key", default="minioadmin")
+    parser.add_argument("--bucket", default="bench")
+    args = parser.parse_args()
+    setup_django()
+
+    from django.conf import settings
+
+    fake = None if args.endpoint else FakeS3().start_in_thread()
+    settings.MINIO_ENDPOINT = args.endpoint or fake.endpoint
+    settings.MINIO_ACCESS_KEY = args.access_key
+    settings.MINIO_SECRET_KEY = args.secret_key
+    settings.MINIO_BUCKET = args.bucket
+    settings.MINIO_MAX_CONNECTIONS = max(settings.MINIO_MAX_CONNECTIONS, args.threads)
+    if args.part_size:
+        settings.MINIO_PART_SIZE = args.part_size
+
+    for label, strategy in (("per_request", per_request_upload), ("shared", shared_upload)):
+        before = fake.connections if fake else 0
+        result = run(strategy, label, args.uploads, args.size, args.threads)
+        if fake:
+            result["connections"] = fake.connections - before
+        print(f"{label:12s} " + " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}"
+                                        for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+End-to-end latency and throughput of replayed API traffic.
+
+Replays a JSONL request log through the Django test client (in process:
+real URL routing, middleware, auth, DB, billing and ledger) while OpenAI,
+MinIO and Kavenegar are local stand-ins whose latencies are sampled from
+seeded distributions. For each route it reports p50/p95/p99 latency,
+requests/s, DB queries per request and, with ``--trace-alloc``, the peak
+Python allocation per request. ``--json`` writes the same numbers plus the
+git commit, and ``--compare`` diffs a run against an earlier file (exit
+status 1 on regressions), so two commits can be compared:
+
+    python -m benchmarks.replay --requests 500 --json before.json
+    python -m benchmarks.replay --requests 500 --json after.json --compare before.json
+    python -m benchmarks.replay --log benchmarks/replay_sample.jsonl --openai-latency lognormal:0.4,0.5
+
+Each log line is one request::
+
+    {"user": "kid1", "method": "POST", "path": "/api/chat/send", "thread": "kid1-a",
+     "body": {"model_alias": "robot-bench", "prompt": "why is the sky blue?"}}
+
+``user`` is logged in (seeded with a large wallet on first use). ``thread``
+names a conversation: the thread_id of its first reply is filled into later
+entries with the same name. ``files`` maps form fields to generated images
+(``{"width", "height", "format"}``) and sends the body as multipart.
+``"{otp}"`` in a body stands for the last code the SMS stand-in sent to its
+``phone_number`` (OTP endpoints also need Redis at ``REDIS_URL``). Without
+``--log`` a mixed log is synthesised from ``--seed`` (save it with
+``--write-log``). Latencies: ``0.2``, ``uniform:0.1,0.5``, ``exp:0.3`` or
+``lognormal:<median>,<sigma>``. Celery tasks run inline.
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+
+from benchmarks._django import setup_django, seed_chat_user
+from benchmarks.fake_kavenegar import FakeKavenegar
+from benchmarks.fake_openai import FakeOpenAI
+from benchmarks.fake_s3 import FakeS3
+
+ALIAS = "robot-bench"
+ROOT = Path(__file__).resolve().parent.parent
+_ID = re.compile(r"/\d+(?=/|$)")
+_THREAD_ID = re.compile(r'"thread_id":\s*"?(\d+)')
+
+
+def latency(spec: str, seed: int):
+    """A callable sampling seconds from ``spec``; each stand-in gets its own seeded generator."""
+    kind, _, params = spec.partition(":") if ":" in spec else ("const", "", spec)
+    try:
+        values = [float(v) for v in params.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bad latency spec {spec!r}")
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    samplers = {
+        "const": lambda: values[0],
+        "uniform": lambda: rng.uniform(values[0], values[1]),
+        "exp": lambda: rng.expovariate(1 / values[0]) if values[0] else 0.0,
+        "lognormal": lambda: rng.lognormvariate(math.log(values[0]), values[1]) if values[0] else 0.0,
+    }
+    if kind not in samplers:
+        raise argparse.ArgumentTypeError(f"bad latency spec {spec!r}")
+
+    def sample():
+        with lock:
+            return samplers[kind]()
+
+    return sample
+
+
+def synthesize(n: int, users: int, seed: int) -> list:
+    """A deterministic mix of chat sends (plain and SSE), wallet polls, uploads, history, bulk sends and top-ups."""
+    rng = random.Random(seed)
+    log = []
+    for i in range(n):
+        user = f"kid{rng.randrange(users)}"
+        thread = f"{user}-{rng.randrange(3)}"
+        roll = rng.random()
+        if roll < 0.40:
+            log.append({"user": user, "method": "POST", "path": "/api/chat/send", "thread": thread,
+                        "body": {"model_alias": ALIAS, "prompt": f"question {i}: why do stars twinkle?"}})
+        elif roll < 0.50:
+            log.append({"user": user, "method": "POST", "path": "/api/chat/send", "thread": thread,
+                        "body": {"model_alias": ALIAS, "prompt": f"tell me story {i}", "stream": True}})
+        elif roll < 0.75:
+            log.append({"user": user, "method": "GET", "path": "/api/billing/wallet/"})
+        elif roll < 0.82:
+            log.append({"user": user, "method": "POST", "path": "/api/chat/image",
+                        "body": {"model_alias": ALIAS, "prompt": "what is in this picture?"},
+                        "files": {"image": {"width": 640, "height": 480, "format": "png", "seed": i % 8}}})
+        elif roll < 0.90:
+            log.append({"user": user, "method": "GET", "path": "/api/chat/threads"})
+        elif roll < 0.96:
+            log.append({"user": user, "method": "POST", "path": "/api/chat/send/bulk",
+                        "body": {"model_alias": ALIAS, "items": [{"prompt": f"class question {i}"}] * 5}})
+        else:
+            log.append({"user": user, "method": "POST", "path": "/api/billing/purchase/dev-million/"})
+    return log
+
+
+@lru_cache(maxsize=64)
+def _image(width: int, height: int, fmt: str, seed: int) -> bytes:
+    from PIL import Image
+
+    img = Image.frombytes("RGB", (width, height), random.Random(seed).randbytes(width * height * 3))
+    out = io.BytesIO()
+    img.save(out, format=fmt.upper().replace("JPG", "JPEG"))
+    return out.getvalue()
+
+
+class Replay:
+    def __init__(self, sms: FakeKavenegar, trace_alloc: bool):
+        self.sms = sms
+        self.trace_alloc = trace_alloc
+        self.users = {}
+        self.threads = {}
+        self.samples = defaultdict(list)  # route -> [(seconds, status, queries, alloc_bytes)]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def seed_users(self, log):
+        for name in dict.fromkeys(entry["user"] for entry in log if entry.get("user")):
+            self.users[name] = seed_chat_user(username=name)
+
+    def _client(self, user_name):
+        from django.test import Client
+
+        clients = self._local.__dict__.setdefault("clients", {})
+        client = clients.get(user_name)
+        if client is None:
+            # a failing view counts as a 500 instead of aborting the run
+            client = clients[user_name] = Client(raise_request_exception=False)
+            if user_name:
+                client.force_login(self.users[user_name])
+        return client
+
+    def _body(self, entry) -> dict:
+        body = dict(entry.get("body") or {})
+        for key, value in body.items():
+            if value == "{otp}":
+                body[key] = self.sms.codes.get(body.get("phone_number"), "")
+        label = entry.get("thread")
+        if label and label in self.threads:
+            body["thread_id"] = self.threads[label]
+        return body
+
+    def _request(self, client, entry):
+        method = entry.get("method", "GET").lower()
+        path = entry["path"]
+        body = self._body(entry)
+        headers = {f"HTTP_{k.upper().replace('-', '_')}": v for k, v in (entry.get("headers") or {}).items()}
+        if entry.get("files"):
+            for field, spec in entry["files"].items():
+                fmt = spec.get("format", "png")
+                f = io.BytesIO(_image(spec.get("width", 640), spec.get("height", 480), fmt, spec.get("seed", 0)))
+                f.name = f"{field}.{fmt}"
+                body[field] = f
+            return getattr(client, method)(path, body, **headers)
+        if method == "get":
+            return client.get(path, body, **headers)
+        return getattr(client, method)(path, body, content_type="application/json", **headers)
+
+    def run_one(self, entry, record: bool = True):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        client = self._client(entry.get("user"))
+        with CaptureQueriesContext(connection) as ctx:
+            if self.trace_alloc:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            res = self._request(client, entry)
+            content = b"".join(res.streaming_content) if getattr(res, "streaming", False) else res.content
+            seconds = time.perf_counter() - started
+            alloc = tracemalloc.get_traced_memory()[1] - base if self.trace_alloc else 0
+        label = entry.get("thread")
+        if label and label not in self.threads:
+            found = _THREAD_ID.search(content.decode("utf-8", "replace"))
+            if found:
+                with self._lock:
+                    self.threads.setdefault(label, int(found.group(1)))
+        if record:
+            route = entry.get("name") or f"{entry.get('method', 'GET').upper()} {_ID.sub('/<id>', entry['path'])}"
+            with self._lock:
+                self.samples[route].append((seconds, res.status_code, len(ctx.captured_queries), alloc))
+
+    def run(self, log, concurrency: int, warmup: int) -> float:
+        for entry in log[:warmup]:
+            self.run_one(entry, record=False)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.run_one, log[warmup:]))
+        return time.perf_counter() - started
+
+
+def summarize(rows, wall: float) -> dict:
+    from analytics.metrics import quantile
+
+    seconds = [r[0] for r in rows]
+    queries = [r[2] for r in rows]
+    out = {
+        "count": len(rows),
+        "rps": len(rows) / wall if wall else 0.0,
+        "p50_ms": quantile(seconds, 0.50) * 1000,
+        "p95_ms": quantile(seconds, 0.95) * 1000,
+        "p99_ms": quantile(seconds, 0.99) * 1000,
+        "mean_ms": sum(seconds) / len(seconds) * 1000,
+        "queries_mean": sum(queries) / len(queries),
+        "queries_max": max(queries),
+        "errors": sum(1 for r in rows if r[1] >= 500),
+        "statuses": dict(sorted(Counter(str(r[1]) for r in rows).items())),
+    }
+    allocs = [r[3] for r in rows]
+    if any(allocs):
+        out["alloc_p50_kb"] = quantile(allocs, 0.50) / 1024
+        out["alloc_p95_kb"] = quantile(allocs, 0.95) / 1024
+    return out
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> list:
+    """Print per-route changes against ``baseline``; returns the routes that got slower or chattier."""
+    regressed = []
+    print(f"compare against {baseline['meta'].get('commit') or '?'}")
+    for route, now in current["routes"].items():
+        was = baseline["routes"].get(route)
+        if not was:
+            continue
+        change = (now["p95_ms"] - was["p95_ms"]) / was["p95_ms"] if was["p95_ms"] else 0.0
+        print(f"{route:40s} p95_ms={was['p95_ms']:.2f}->{now['p95_ms']:.2f} ({change:+.1%}) "
+              f"rps={was['rps']:.1f}->{now['rps']:.1f} queries={was['queries_mean']:.1f}->{now['queries_mean']:.1f}")
+        if change > max_regression or now["queries_mean"] > was["queries_mean"] + 0.5:
+            regressed.append(route)
+    return regressed
+
+
+def _line(name: str, stats: dict) -> str:
+    fields = " ".join(
+        f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items() if k != "statuses"
+    )
+    statuses = ",".join(f"{code}:{n}" for code, n in stats["statuses"].items())
+    return f"{name:40s} {fields} statuses={statuses}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--log", help="JSONL request log; synthesised when omitted")
+    parser.add_argument("--write-log", help="save the (synthesised) log here and continue")
+    parser.add_argument("--requests", type=int, default=300, help="entries to synthesise")
+    parser.add_argument("--users", type=int, default=20, help="distinct users in a synthesised log")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the log this many times")
+    parser.add_argument("--warmup", type=int, default=20, help="leading entries run but not measured")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="client threads (use PostgreSQL, USE_SQLITE_FOR_TESTS=0, above 1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--openai-latency", default="lognormal:0.05,0.4")
+    parser.add_argument("--s3-latency", default="uniform:0.002,0.01")
+    parser.add_argument("--sms-latency", default="exp:0.05")
+    parser.add_argument("--trace-alloc", action="store_true", help="peak Python allocation per request (slower)")
+    parser.add_argument("--json", help="write machine-readable results here")
+    parser.add_argument("--compare", help="earlier --json output to diff against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="allowed p95 increase for --compare")
+    args = parser.parse_args()
+
+    if args.log:
+        with open(args.log) as f:
+            log = [json.loads(line) for line in f if line.strip()]
+    else:
+        log = synthesize(args.requests, args.users, args.seed)
+    if args.write_log:
+        with open(args.write_log, "w") as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in log)
+    log = log * args.repeat
+    warmup = min(args.warmup, len(log) // 2)
+
+    openai = FakeOpenAI(latency=latency(args.openai_latency, args.seed)).start_in_thread()
+    s3 = FakeS3(latency=latency(args.s3_latency, args.seed + 1), keep_bodies=True).start_in_thread()
+    os.environ["OPENAI_API_BASE"] = openai.base_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+    setup_django()
+
+    from django.conf import settings
+    from django.db import connection
+    from config.celery import app
+
+    if args.concurrency > 1 and connection.vendor == "sqlite":
+        # جدول‌های sqlite درون‌حافظه‌ای بین threadها قفل می‌شوند
+        parser.error("--concurrency above 1 needs PostgreSQL (USE_SQLITE_FOR_TESTS=0)")
+    settings.MINIO_ENDPOINT = s3.endpoint
+    settings.MINIO_ACCESS_KEY = settings.MINIO_SECRET_KEY = "bench"
+    settings.MINIO_BUCKET = "bench"
+    settings.MINIO_REGION = "us-east-1"
+    settings.OPENAI_MAX_CONNECTIONS = max(settings.OPENAI_MAX_CONNECTIONS, args.concurrency * 5)
+    settings.MINIO_MAX_CONNECTIONS = max(settings.MINIO_MAX_CONNECTIONS, args.concurrency)
+    # تصویرها همان‌جا نرمال می‌شوند؛ worker و broker جداگانه‌ای در کار نیست
+    app.conf.task_always_eager = True
+    # خطاهای 500 در خروجی شمرده می‌شوند؛ traceback هر کدام فقط خروجی را شلوغ می‌کند
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    sms = FakeKavenegar(latency=latency(args.sms_latency, args.seed + 2)).install()
+
+    replay = Replay(sms, args.trace_alloc)
+    replay.seed_users(log)
+    if args.trace_alloc:
+        tracemalloc.start()
+    wall = replay.run(log, args.concurrency, warmup)
+    if args.trace_alloc:
+        tracemalloc.stop()
+
+    routes = {route: summarize(rows, wall) for route, rows in sorted(replay.samples.items())}
+    overall = summarize([row for rows in replay.samples.values() for row in rows], wall)
+    for route, stats in routes.items():
+        print(_line(route, stats))
+    print(_line("overall", overall))
+    print(f"upstream openai_calls={openai.served} openai_peak_in_flight={openai.peak_in_flight} "
+          f"s3_requests={sum(s3.calls.values())} sms_sent={sms.sent} wall_s={wall:.2f}")
+
+    result = {
+        "meta": {
+            "commit": _git("rev-parse", "--short", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "args": vars(args),
+            "measured_requests": overall["count"],
+            "wall_s": wall,
+        },
+        "overall": overall,
+        "routes": routes,
+        "upstream": {"openai_calls": openai.served, "s3_requests": sum(s3.calls.values()), "sms_sent": sms.sent},
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(result, json.load(f), args.max_regression)
+        if regressed:
+            print(f"regressed: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Renewal throughput at ``--subscribers`` (default 1M) due subscriptions.
+
+Seeds users, wallets and subscriptions that are all due, then times
+``billing.renewals.run()`` against the naive loop (read the wallet, add,
+save, create a Transaction, save the subscription, one row at a time) on a
+``--naive-sample`` of them:
+
+    python -m benchmarks.subscription_renewals
+    python -m benchmarks.subscription_renewals --subscribers 200000 --chunk 5000
+"""
+import argparse
+import time
+from datetime import timedelta
+
+from benchmarks._django import setup_django
+
+
+def seed(n, batch=50_000):
+    from django.contrib.auth import get_user_model
+    from django.db import connection, transaction
+    from django.utils import timezone
+    from billing.models import Subscription, Wallet
+
+    ops = connection.ops
+    now = ops.adapt_datetimefield_value(timezone.now())
+    due = ops.adapt_datetimefield_value(timezone.now() - timedelta(hours=1))
+    users, wallets, subs = (m._meta.db_table for m in (get_user_model(), Wallet, Subscription))
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {users}")
+        base = cur.fetchone()[0]
+    for start in range(0, n, batch):
+        ids = range(base + start + 1, base + min(start + batch, n) + 1)
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.executemany(
+                f"INSERT INTO {users} (id, password, is_superuser, username, first_name, last_name, email, "
+                f"is_staff, is_active, date_joined) VALUES (%s, '', false, %s, '', '', '', false, true, %s)",
+                [(i, f"sub{i}", now) for i in ids],
+            )
+            cur.executemany(f"INSERT INTO {wallets} (user_id, balance_tokens) VALUES (%s, 0)", [(i,) for i in ids])
+            cur.executemany(
+                f"INSERT INTO {subs} (user_id, tokens_per_month, active, renew_day, next_renewal_at, last_period) "
+                f"VALUES (%s, 1000000, true, 1, %s, '')",
+                [(i, due) for i in ids],
+            )
+
+
+def naive(sample):
+    from django.utils import timezone
+    from billing import renewals
+    from billing.models import Subscription, Transaction, Wallet
+
+    now = timezone.now()
+    for sub in Subscription.objects.filter(active=True, next_renewal_at__lte=now).order_by("id")[:sample]:
+        wallet = Wallet.objects.get(user_id=sub.user_id)
+        wallet.balance_tokens += sub.tokens_per_month
+        wallet.save()
+        Transaction.objects.create(user_id=sub.user_id, delta_tokens=sub.tokens_per_month, reason="subscription")
+        sub.next_renewal_at = renewals.next_after(sub.next_renewal_at, sub.renew_day)
+        sub.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, default=1_000_000)
+    parser.add_argument("--naive-sample", type=int, default=20_000)
+    parser.add_argument("--chunk", type=int, default=None, help="SUBSCRIPTION_RENEWAL_CHUNK override")
+    args = parser.parse_args()
+    setup_django()
+
+    from django.conf import settings
+    from billing import renewals
+    from billing.models import Transaction, Wallet
+
+    if args.chunk:
+        settings.SUBSCRIPTION_RENEWAL_CHUNK = args.chunk
+    t0 = time.perf_counter()
+    seed(args.subscribers)
+    print(f"seeded subscribers={args.subscribers} seconds={time.perf_counter() - t0:.1f}")
+
+    t0 = time.perf_counter()
+    naive(args.naive_sample)
+    wall = time.perf_counter() - t0
+    rate = args.naive_sample / wall
+    print(f"naive   renewed={args.naive_sample} seconds={wall:.1f} per_s={rate:.0f} "
+          f"projected_all_s={args.subscribers / rate:.0f}")
+
+    t0 = time.perf_counter()
+    handled = renewals.run()
+    wall = time.perf_counter() - t0
+    print(f"engine  renewed={handled} seconds={wall:.1f} per_s={handled / wall:.0f} "
+          f"chunk={settings.SUBSCRIPTION_RENEWAL_CHUNK}")
+
+    t0 = time.perf_counter()
+    again = renewals.run()
+    print(f"rerun   renewed={again} seconds={time.perf_counter() - t0:.2f}")
+    credited = Transaction.objects.filter(reason="subscription").count()
+    funded = Wallet.objects.filter(balance_tokens__gt=0).count()
+    print(f"check   transactions={credited} funded_wallets={funded}")
+
+
+if __name__ == "__main__":
+    main()
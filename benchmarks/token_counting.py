@@ -0,0 +1,49 @@
+"""
+Microbenchmark: local token counting of long Persian/English mixed text.
+
+Reports cold (first call: encoder load) and warm per-call latency for
+``chat.tokens.count_tokens`` at several text sizes, plus which backend
+(tiktoken encoding or the character estimate) was used.
+
+    python -m benchmarks.token_counting --sizes 1000 10000 100000
+"""
+import argparse
+import time
+import timeit
+
+from benchmarks._django import setup_django
+
+SAMPLE = (
+    "سلام! امروز در کلاس علوم دربارهٔ رنگین‌کمان یاد گرفتیم. "
+    "Rainbows happen when sunlight is refracted, reflected and dispersed in water droplets. "
+    "۱۲۳ + 456 = ۵۷۹؟ "
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--model", default="gpt-4.1-mini")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    setup_django()
+
+    from chat import tokens
+
+    t0 = time.perf_counter()
+    tokens.count_tokens("warm-up", args.model)
+    cold_ms = (time.perf_counter() - t0) * 1000
+    backend = "tiktoken:" + tokens.encoding_name(args.model) if tokens._encoder(
+        tokens.encoding_name(args.model)) else "estimate"
+    print(f"backend={backend} cold_first_call_ms={cold_ms:.2f}")
+
+    for size in args.sizes:
+        text = (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+        count = tokens.count_tokens(text, args.model)
+        per_call = min(timeit.repeat(lambda: tokens.count_tokens(text, args.model), number=1, repeat=args.repeat))
+        print(f"chars={size:>8} tokens={count:>7} best_ms={per_call * 1000:8.3f} "
+              f"chars_per_s={size / per_call:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
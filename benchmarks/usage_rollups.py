@@ -0,0 +1,114 @@
+"""
+Spend report latency: raw UsageRecord aggregates vs billing.rollups buckets.
+
+Seeds ``--rows`` usage records (default 10M) spread over ``--days`` days,
+``--users`` users and ``--models`` aliases, folds them into rollups with
+``rollups.advance()`` (timed, i.e. the backfill) and then times the same
+questions both ways:
+
+    python -m benchmarks.usage_rollups
+    python -m benchmarks.usage_rollups --rows 1000000 --repeat 3
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from benchmarks._django import setup_django
+
+
+def seed(rows, users, models, days, batch=100_000):
+    from django.contrib.auth import get_user_model
+    from django.db import connection, transaction
+    from django.utils import timezone
+    from billing.models import UsageRecord
+
+    User = get_user_model()
+    User.objects.bulk_create(User(username=f"u{i}") for i in range(users))
+    user_ids = list(User.objects.values_list("id", flat=True))
+    aliases = [f"robot-{i}" for i in range(models)]
+    start = timezone.now() - timedelta(days=days)
+    span = days * 86400
+    rng = random.Random(7)
+    ops = connection.ops
+    table = UsageRecord._meta.db_table
+    sql = (f"INSERT INTO {table} (user_id, model_alias, input_tokens, output_tokens, cached_input_tokens, "
+           f"cost_usd, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s)")
+    for offset in range(0, rows, batch):
+        params = []
+        # id order follows time order, as it does in production
+        for i in range(offset, min(offset + batch, rows)):
+            at = start + timedelta(seconds=span * i / rows)
+            tokens = rng.randint(50, 2000)
+            params.append((
+                rng.choice(user_ids), rng.choice(aliases), tokens, tokens // 3, 0,
+                ops.adapt_decimalfield_value(tokens / 1e5, 10, 4), ops.adapt_datetimefield_value(at),
+            ))
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.executemany(sql, params)
+    return user_ids, aliases
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--models", type=int, default=10)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    setup_django()
+
+    from django.conf import settings
+    from django.db.models import Count, Sum
+    from django.db.models.functions import TruncDay
+    from django.utils import timezone
+    from billing import rollups
+    from billing.models import UsageRecord
+
+    t0 = time.perf_counter()
+    user_ids, aliases = seed(args.rows, args.users, args.models, args.days)
+    print(f"seeded rows={args.rows} seconds={time.perf_counter() - t0:.1f}")
+
+    settings.USAGE_ROLLUP_LAG_SECONDS = 0
+    t0 = time.perf_counter()
+    rollups.advance()
+    print(f"backfill rows={args.rows} seconds={time.perf_counter() - t0:.1f}")
+
+    now = timezone.now()
+    week, month = now - timedelta(days=7), now - timedelta(days=30)
+    user, alias = user_ids[0], aliases[0]
+    questions = {
+        "model_cost_week": (
+            lambda: UsageRecord.objects.filter(model_alias=alias, created_at__gte=week, created_at__lt=now)
+            .aggregate(Sum("cost_usd"), Count("id")),
+            lambda: rollups.report("day", week, now, model_alias=alias),
+        ),
+        "user_spend_month": (
+            lambda: list(UsageRecord.objects.filter(user_id=user, created_at__gte=month, created_at__lt=now)
+                         .values("model_alias").annotate(Sum("cost_usd"))),
+            lambda: rollups.report("day", month, now, user_id=user),
+        ),
+        "daily_all_models_month": (
+            lambda: list(UsageRecord.objects.filter(created_at__gte=month, created_at__lt=now)
+                         .annotate(day=TruncDay("created_at")).values("day", "model_alias")
+                         .annotate(Sum("cost_usd")).order_by()),
+            lambda: rollups.report("day", month, now),
+        ),
+    }
+    for name, (raw, rolled) in questions.items():
+        raw_ms, rollup_ms = timed(raw, args.repeat), timed(rolled, args.repeat)
+        print(f"{name:24s} raw_ms={raw_ms:.2f} rollup_ms={rollup_ms:.2f} speedup={raw_ms / rollup_ms:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+N concurrent debits against one wallet: row lock vs conditional UPDATE.
+
+``locked`` replays the old path (``select_for_update().get_or_create`` +
+``save()``); ``conditional`` uses ``billing.debit.debit`` (one UPDATE with a
+``balance_tokens >= n`` guard). Row locks only exist on PostgreSQL, so run
+against it for meaningful numbers:
+
+    USE_SQLITE_FOR_TESTS=0 python -m benchmarks.wallet_contention --threads 32 --debits 200
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from benchmarks._django import setup_django
+
+
+def locked_debit(user, tokens):
+    from django.db import transaction
+    from billing.models import Wallet
+
+    with transaction.atomic():
+        w, _ = Wallet.objects.select_for_update().get_or_create(user=user)
+        if w.balance_tokens < tokens:
+            raise ValueError("INSUFFICIENT_WALLET")
+        w.balance_tokens -= tokens
+        w.save(update_fields=["balance_tokens"])
+
+
+def conditional_debit(user, tokens):
+    from billing import debit
+
+    debit.debit(user.id, tokens)
+
+
+def run(strategy, user, threads, debits, tokens):
+    from django.db import connection, OperationalError
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(threads)
+
+    def worker():
+        start_gate.wait()
+        local = []
+        for _ in range(debits):
+            t0 = time.perf_counter()
+            for _attempt in range(50):  # sqlite: "database is locked" → retry
+                try:
+                    strategy(user, tokens)
+                    local.append(time.perf_counter() - t0)
+                    break
+                except OperationalError:
+                    time.sleep(0.001)
+            else:
+                errors.append("gave up")
+        with lock:
+            latencies.extend(local)
+        connection.close()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "debits": len(latencies),
+        "wall_s": wall,
+        "debits_per_s": len(latencies) / wall,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--debits", type=int, default=100, help="debits per thread")
+    parser.add_argument("--tokens", type=int, default=300)
+    args = parser.parse_args()
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from billing.models import Wallet
+
+    for name, strategy in (("locked", locked_debit), ("conditional", conditional_debit)):
+        user = get_user_model().objects.create_user(username=f"contention-{name}")
+        start_balance = args.threads * args.debits * args.tokens
+        Wallet.objects.filter(user=user).update(balance_tokens=start_balance)
+        result = run(strategy, user, args.threads, args.debits, args.tokens)
+        final = Wallet.objects.get(user=user).balance_tokens
+        lost = final - (start_balance - result["debits"] * args.tokens)
+        print(f"{name:12s} " + " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}"
+                                        for k, v in result.items()) + f" lost_updates={lost}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Wallet, Transaction, Subscription, ModelCatalog, UsageRecord
+from .models import Wallet, Transaction, Subscription, ModelCatalog, UsageRecord, UsageRollup
 
 
 @admin.register(Wallet)
@@ -28,14 +28,41 @@ class ModelCatalogAdmin(admin.ModelAdmin):
         "model_name",
         "input_per_million_usd",
         "output_per_million_usd",
+        "context_budget_tokens",
+        "response_cache_enabled",
         "enabled",
     )
-    list_filter = ("enabled", "provider")
+    list_filter = ("enabled", "response_cache_enabled", "provider")
     search_fields = ("alias", "friendly_name", "model_name")
 
 
+class CatalogAliasFilter(admin.SimpleListFilter):
+    # گزینه‌ها از کاتالوگ می‌آیند، نه SELECT DISTINCT روی کل جدول مصرف
+    title = "model alias"
+    parameter_name = "model_alias"
+
+    def lookups(self, request, model_admin):
+        return [(a, a) for a in ModelCatalog.objects.order_by("alias").values_list("alias", flat=True)]
+
+    def queryset(self, request, queryset):
+        return queryset.filter(model_alias=self.value()) if self.value() else queryset
+
+
 @admin.register(UsageRecord)
 class UsageRecordAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "model_alias", "input_tokens", "output_tokens", "cost_usd", "created_at")
-    list_filter = ("model_alias",)
+    list_display = (
+        "id", "user", "model_alias", "input_tokens", "cached_input_tokens", "output_tokens", "cost_usd", "created_at",
+    )
+    list_filter = (CatalogAliasFilter,)
+    list_select_related = ("user",)
+    # شمارش کل جدول برای هر صفحه لازم نیست
+    show_full_result_count = False
+
+
+@admin.register(UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    list_display = ("bucket", "granularity", "user", "model_alias", "requests", "cost_usd")
+    list_filter = ("granularity", CatalogAliasFilter)
+    list_select_related = ("user",)
+    date_hierarchy = "bucket"
 
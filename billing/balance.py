@@ -0,0 +1,149 @@
+"""
+Cached wallet balances for ``GET /api/billing/wallet/``.
+
+Clients poll the balance after every message, so reads come from the shared
+cache (Redis in production) and never touch the DB while it is warm. Each
+user has a version counter (``wallet:ver:<id>``, no expiry) and an entry
+``wallet:balance:<id>`` holding ``(version, balance, changed_at)``. Writers
+bump the version after commit and then store the balance they read back
+(write-through); an entry whose version is not the current one is ignored
+and rebuilt from the DB, so a slow writer or reader can never leave an older
+balance behind a newer version. Bulk writers (renewals) only bump versions.
+
+The version and balance form the ETag, ``changed_at`` the Last-Modified, so
+an unchanged poll is answered 304 from two cache reads. ``stream`` and
+``wait_for_change`` push changes to SSE and long-poll clients by watching
+the version key; both wait on the event loop, so they are only used under
+the ASGI app (``chat.streaming.can_hold``). Under WSGI ``snapshot`` answers
+SSE clients with the current balance and a reconnect delay instead.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from chat.streaming import sse
+from .models import Wallet
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "wallet:ver:{}"
+BALANCE_KEY = "wallet:balance:{}"
+
+
+@dataclass(frozen=True)
+class Balance:
+    balance_tokens: int
+    version: int
+    changed_at: int  # unix seconds
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}-{self.balance_tokens}"'
+
+    def payload(self) -> dict:
+        return {"balance_tokens": self.balance_tokens}
+
+
+def _read_db(user_id: int) -> int:
+    # کیف پول با ساخت کاربر ساخته می‌شود؛ نبودنش یعنی موجودی صفر، بدون نوشتن
+    return Wallet.objects.filter(user_id=user_id).values_list("balance_tokens", flat=True).first() or 0
+
+
+def _bump(user_id: int) -> int:
+    key = VERSION_KEY.format(user_id)
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key)
+
+
+def _store(user_id: int, version: int, balance_tokens: int, changed_at: int):
+    cache.set(BALANCE_KEY.format(user_id), (version, balance_tokens, changed_at), timeout=settings.WALLET_BALANCE_CACHE_TTL)
+
+
+def get(user_id: int) -> Balance:
+    """Current balance; one cache round trip while warm, one indexed read on a miss."""
+    try:
+        got = cache.get_many([VERSION_KEY.format(user_id), BALANCE_KEY.format(user_id)])
+        version = got.get(VERSION_KEY.format(user_id))
+        entry = got.get(BALANCE_KEY.format(user_id))
+        if version is None:
+            version = _bump(user_id)
+        elif entry is not None and entry[0] == version:
+            return Balance(entry[1], version, entry[2])
+    except Exception:  # Redis در دسترس نیست؛ مستقیم از دیتابیس
+        logger.warning("wallet balance cache unavailable; reading from DB", exc_info=True)
+        return Balance(_read_db(user_id), 0, int(time.time()))
+    balance = Balance(_read_db(user_id), version, int(time.time()))
+    try:
+        _store(user_id, version, balance.balance_tokens, balance.changed_at)
+    except Exception:
+        logger.warning("wallet balance cache write failed", exc_info=True)
+    return balance
+
+
+def refresh(user_id: int):
+    """Write-through after a debit or credit has committed: new version, then the balance read back."""
+    try:
+        version = _bump(user_id)
+        _store(user_id, version, _read_db(user_id), int(time.time()))
+    except Exception:
+        logger.warning("wallet balance refresh failed", exc_info=True)
+
+
+def invalidate(*user_ids):
+    """Bump versions only; the next read rebuilds the entry (for bulk credits)."""
+    for user_id in user_ids:
+        try:
+            _bump(user_id)
+        except Exception:
+            logger.warning("wallet balance invalidation failed", exc_info=True)
+            return
+
+
+def changed(user_id: int):
+    """Schedule ``refresh`` for when the current transaction commits (immediately outside one)."""
+    transaction.on_commit(lambda: refresh(user_id))
+
+
+def version(user_id: int):
+    try:
+        return cache.get(VERSION_KEY.format(user_id))
+    except Exception:
+        return None
+
+
+async def wait_for_change(user_id: int, etag: str | None, timeout: float) -> Balance:
+    """Long-poll: wait until the balance's ETag differs from ``etag`` or ``timeout`` seconds pass."""
+    deadline = time.monotonic() + timeout
+    current = await sync_to_async(get)(user_id)
+    while current.etag == etag and time.monotonic() < deadline:
+        seen = current.version
+        while await sync_to_async(version)(user_id) == seen and time.monotonic() < deadline:
+            await asyncio.sleep(settings.WALLET_STREAM_POLL_SECONDS)
+        current = await sync_to_async(get)(user_id)
+    return current
+
+
+async def stream(user_id: int):
+    """SSE ``balance`` frames on every change until WALLET_STREAM_SECONDS pass."""
+    deadline = time.monotonic() + settings.WALLET_STREAM_SECONDS
+    last = None
+    while True:
+        current = await sync_to_async(get)(user_id)
+        if current.etag != last:
+            yield sse("balance", current.payload())
+            last = current.etag
+        if time.monotonic() > deadline:
+            return
+        seen = current.version
+        while await sync_to_async(version)(user_id) == seen and time.monotonic() <= deadline:
+            await asyncio.sleep(settings.WALLET_STREAM_POLL_SECONDS)
+
+
+def snapshot(user_id: int):
+    """One SSE ``balance`` frame; EventSource reconnects after WALLET_STREAM_RETRY_SECONDS (WSGI fallback)."""
+    yield f"retry: {int(settings.WALLET_STREAM_RETRY_SECONDS * 1000)}\n\n"
+    yield sse("balance", get(user_id).payload())
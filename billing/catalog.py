@@ -0,0 +1,75 @@
+"""
+In-process cache of enabled ModelCatalog rows.
+
+Each process holds the whole (small) enabled catalog in memory. A version
+number in the shared cache (Redis in production) is bumped whenever a row is
+saved or deleted, including by ``seed_models``; processes compare it at most
+every ``CATALOG_CACHE_CHECK_SECONDS`` and reload the table when it moved.
+Returned instances are shared between requests: treat them as read-only.
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import ModelCatalog
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "billing:catalog:version"
+
+_lock = threading.Lock()
+_state = {"version": None, "checked_at": 0.0, "by_alias": {}, "rows": []}
+
+
+def _shared_version():
+    try:
+        return cache.get(VERSION_KEY, 0)
+    except Exception:  # Redis در دسترس نیست؛ با بارگذاری دوباره از دیتابیس ادامه می‌دهیم
+        logger.warning("catalog version check failed; reloading from DB", exc_info=True)
+        return None
+
+
+def _is_fresh():
+    return _state["version"] is not None and \
+        time.monotonic() - _state["checked_at"] < settings.CATALOG_CACHE_CHECK_SECONDS
+
+
+def _snapshot():
+    if _is_fresh():
+        return _state
+    with _lock:
+        if not _is_fresh():
+            version = _shared_version()
+            if version is None or version != _state["version"]:
+                rows = list(ModelCatalog.objects.filter(enabled=True).order_by("id"))
+                _state["rows"] = rows
+                _state["by_alias"] = {row.alias: row for row in rows}
+                _state["version"] = version
+            _state["checked_at"] = time.monotonic()
+    return _state
+
+
+def get_enabled(alias: str):
+    """Enabled catalog row for ``alias`` or None; no query while the cache is warm."""
+    return _snapshot()["by_alias"].get(alias)
+
+
+def list_enabled() -> list:
+    return _snapshot()["rows"]
+
+
+def invalidate_local():
+    with _lock:
+        _state["version"] = None
+        _state["checked_at"] = 0.0
+
+
+def bump_version():
+    """Tell every process to reload on its next check (call after commit)."""
+    try:
+        cache.add(VERSION_KEY, 0, timeout=None)
+        cache.incr(VERSION_KEY)
+    except Exception:
+        logger.warning("catalog version bump failed", exc_info=True)
+    invalidate_local()
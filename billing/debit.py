@@ -0,0 +1,150 @@
+"""
+Wallet debits without row locks.
+
+``debit()`` is a single conditional ``UPDATE ... SET balance_tokens =
+balance_tokens - n WHERE balance_tokens >= reserved_tokens + n``: concurrent
+chats from one family account never wait on each other and the balance can't
+go negative. ``reserve()`` sets tokens aside the same way for work billed much
+later (offline chat batches); debits and pre-auth only spend what is left
+above ``Wallet.reserved_tokens`` until ``unreserve()`` gives it back.
+
+With ``WALLET_PREAUTH=redis`` a Redis mirror of the spendable balance
+(``wallet:avail:<user_id>``) lets a send reserve its estimated cost before
+the LLM call and settle the difference afterwards, so empty wallets are
+rejected before we pay OpenAI. The mirror is seeded from the DB on miss,
+expires after ``WALLET_PREAUTH_TTL`` and is dropped on every credit and
+reservation change; the DB
+update above stays the source of truth. Settling only adjusts a mirror that
+still exists: a send that outlived the TTL must not recreate the key holding
+just its own difference (the next reservation reseeds it from the DB).
+``WALLET_PREAUTH=db`` makes pre-authorisation a plain balance check and
+``off`` skips it.
+
+Both ``debit()`` and ``credit()`` refresh the cached balance served to
+polling clients once the transaction commits (see ``billing.balance``).
+"""
+import logging
+from dataclasses import dataclass
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from config.redis_client import get_redis
+from . import balance
+from .models import Wallet
+
+logger = logging.getLogger(__name__)
+
+AVAIL_KEY = "wallet:avail:{}"
+
+# 1 = رزرو شد، 0 = موجودی کافی نیست، -1 = کلید نیست (باید از دیتابیس seed شود)
+_RESERVE = """
+local avail = redis.call('GET', KEYS[1])
+if not avail then return -1 end
+if tonumber(avail) < tonumber(ARGV[1]) then return 0 end
+redis.call('DECRBY', KEYS[1], ARGV[1])
+return 1
+"""
+
+# تفاوت رزرو و هزینهٔ واقعی فقط روی کلید موجود اعمال می‌شود؛ INCRBY خالی کلید بی‌انقضا می‌سازد
+_SETTLE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('INCRBY', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+@dataclass
+class Hold:
+    user_id: int
+    tokens: int
+    reserved: bool = False
+
+
+def debit(user_id: int, tokens: int):
+    updated = Wallet.objects.filter(user_id=user_id, balance_tokens__gte=F("reserved_tokens") + tokens).update(
+        balance_tokens=F("balance_tokens") - tokens
+    )
+    if not updated:
+        raise ValueError("INSUFFICIENT_WALLET")
+    balance.changed(user_id)
+
+
+def credit(user_id: int, tokens: int):
+    updated = Wallet.objects.filter(user_id=user_id).update(balance_tokens=F("balance_tokens") + tokens)
+    if not updated:
+        Wallet.objects.create(user_id=user_id, balance_tokens=tokens)
+    invalidate(user_id)
+    balance.changed(user_id)
+
+
+def reserve(user_id: int, tokens: int) -> bool:
+    """Set ``tokens`` aside from the spendable balance; False when it doesn't cover them."""
+    updated = Wallet.objects.filter(user_id=user_id, balance_tokens__gte=F("reserved_tokens") + tokens).update(
+        reserved_tokens=F("reserved_tokens") + tokens
+    )
+    if updated:
+        invalidate(user_id)
+    return bool(updated)
+
+
+def unreserve(user_id: int, tokens: int):
+    if not tokens:
+        return
+    Wallet.objects.filter(user_id=user_id).update(reserved_tokens=Greatest(F("reserved_tokens") - tokens, 0))
+    invalidate(user_id)
+
+
+def invalidate(*user_ids):
+    if settings.WALLET_PREAUTH != "redis" or not user_ids:
+        return
+    try:
+        get_redis().delete(*(AVAIL_KEY.format(uid) for uid in user_ids))
+    except Exception:
+        logger.warning("wallet pre-auth invalidation failed", exc_info=True)
+
+
+def _has_balance(user_id: int, tokens: int) -> bool:
+    return Wallet.objects.filter(user_id=user_id, balance_tokens__gte=F("reserved_tokens") + tokens).exists()
+
+
+def preauthorize(user_id: int, estimate: int) -> Hold:
+    """Reserve ``estimate`` tokens; raises INSUFFICIENT_WALLET before any upstream spend."""
+    if settings.WALLET_PREAUTH == "off":
+        return Hold(user_id, estimate)
+    if settings.WALLET_PREAUTH != "redis":
+        if not _has_balance(user_id, estimate):
+            raise ValueError("INSUFFICIENT_WALLET")
+        return Hold(user_id, estimate)
+
+    key = AVAIL_KEY.format(user_id)
+    try:
+        r = get_redis()
+        result = r.eval(_RESERVE, 1, key, estimate)
+        if result == -1:
+            balance = Wallet.objects.filter(user_id=user_id).values_list(
+                F("balance_tokens") - F("reserved_tokens"), flat=True
+            ).first() or 0
+            r.set(key, balance, nx=True, ex=settings.WALLET_PREAUTH_TTL)
+            result = r.eval(_RESERVE, 1, key, estimate)
+    except Exception:
+        logger.warning("wallet pre-auth unavailable; falling back to DB check", exc_info=True)
+        if not _has_balance(user_id, estimate):
+            raise ValueError("INSUFFICIENT_WALLET")
+        return Hold(user_id, estimate)
+    if result != 1:
+        raise ValueError("INSUFFICIENT_WALLET")
+    return Hold(user_id, estimate, reserved=True)
+
+
+def settle(hold: Hold | None, actual: int):
+    """Give back (or take more of) the reservation once the real cost is known."""
+    if hold is None or not hold.reserved:
+        return
+    try:
+        get_redis().eval(_SETTLE, 1, AVAIL_KEY.format(hold.user_id), hold.tokens - actual)
+    except Exception:
+        logger.warning("wallet pre-auth settle failed", exc_info=True)
+
+
+def release(hold: Hold | None):
+    settle(hold, 0)
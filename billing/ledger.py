@@ -0,0 +1,177 @@
+"""
+Write-behind usage ledger.
+
+``charge_wallet_for_usage`` keeps the wallet decrement in the request
+transaction but hands the Transaction/UsageRecord pair to ``record()``.
+With ``BILLING_LEDGER_MODE=stream`` the entry is written to one narrow
+``LedgerOutbox`` row inside that transaction, so it commits or rolls back
+with the debit, and is appended after commit to a Redis stream. ``flush()``
+— run by the ``billing.tasks.flush_usage_ledger`` Celery task — bulk-inserts
+batches from the stream through a consumer group and deletes their outbox
+rows in the same transaction. Outbox rows older than
+``BILLING_LEDGER_OUTBOX_GRACE_SECONDS`` (the process died between commit and
+publish, or Redis lost the entry) are applied from the table instead.
+Delivery is at-least-once; the unique ``idempotency_key`` on both tables
+plus ``ignore_conflicts`` makes re-delivered entries no-ops, so each charge
+lands exactly once. Any other mode (the default ``sync``) writes the rows
+inline.
+"""
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from config.redis_client import get_redis
+from .models import LedgerOutbox, Transaction, UsageRecord
+
+logger = logging.getLogger(__name__)
+
+STREAM = "billing:ledger"
+GROUP = "ledger-writers"
+USAGE_REASONS = ("usage", "cache_hit", "batch")
+CLAIM_IDLE_MS = 60_000  # پیام‌های مصرف‌کننده‌ای که مرده، بعد از این مدت دوباره برداشته می‌شوند
+
+
+def new_key() -> str:
+    return uuid.uuid4().hex
+
+
+def _entry(user_id, model_alias, used_tokens, in_tokens, out_tokens, usd, key, reason="usage", cached_tokens=0):
+    return {
+        "key": key,
+        "user_id": user_id,
+        "model_alias": model_alias,
+        "delta_tokens": -used_tokens,
+        "reason": reason,
+        "input_tokens": in_tokens,
+        "output_tokens": out_tokens,
+        "cached_tokens": cached_tokens,
+        "usd": str(usd),
+    }
+
+
+def _rows(entries):
+    txs, usages = [], []
+    for e in entries:
+        txs.append(Transaction(
+            user_id=e["user_id"], delta_tokens=e["delta_tokens"], reason=e["reason"],
+            meta={"model_alias": e["model_alias"], "usd": e["usd"]}, idempotency_key=e["key"],
+        ))
+        usages.append(UsageRecord(
+            user_id=e["user_id"], model_alias=e["model_alias"], input_tokens=e["input_tokens"],
+            output_tokens=e["output_tokens"], cached_input_tokens=e.get("cached_tokens", 0),
+            cost_usd=Decimal(e["usd"]), idempotency_key=e["key"],
+        ))
+    return txs, usages
+
+
+def apply(entries, *, dequeue=False):
+    """Insert ledger rows for ``entries``; already-applied keys are skipped. ``dequeue`` drops their outbox rows."""
+    txs, usages = _rows(entries)
+    with transaction.atomic():
+        Transaction.objects.bulk_create(txs, ignore_conflicts=True)
+        UsageRecord.objects.bulk_create(usages, ignore_conflicts=True)
+        if dequeue:
+            LedgerOutbox.objects.filter(idempotency_key__in=[e["key"] for e in entries]).delete()
+
+
+def _enqueue(entries):
+    # در همان تراکنش کسر از کیف پول؛ با آن commit یا rollback می‌شود
+    LedgerOutbox.objects.bulk_create([LedgerOutbox(idempotency_key=e["key"], entry=e) for e in entries])
+    transaction.on_commit(lambda: [_publish(e) for e in entries])
+
+
+def _publish(entry):
+    try:
+        get_redis().xadd(STREAM, {"data": json.dumps(entry)})
+    except Exception:
+        # Redis نبود: ردیف‌ها را همین‌جا می‌نویسیم تا منتظر flush نماند
+        logger.exception("ledger publish failed; writing %s inline", entry["key"])
+        apply([entry], dequeue=True)
+
+
+def record(user_id, model_alias, used_tokens, in_tokens, out_tokens, usd, *, key=None, reason="usage",
+           cached_tokens=0):
+    entry = _entry(
+        user_id, model_alias, used_tokens, in_tokens, out_tokens, usd, key or new_key(), reason, cached_tokens
+    )
+    if settings.BILLING_LEDGER_MODE == "stream":
+        _enqueue([entry])
+    else:
+        apply([entry])
+    return entry["key"]
+
+
+def record_many(user_id, charges) -> list:
+    """``record`` for several charges of one user (dicts of ``record``'s arguments); one insert per table in sync mode."""
+    entries = [
+        _entry(
+            user_id, c["model_alias"], c["used_tokens"], c["in_tokens"], c["out_tokens"], c["usd"],
+            c.get("key") or new_key(), c.get("reason", "usage"), c.get("cached_tokens", 0),
+        )
+        for c in charges
+    ]
+    if not entries:
+        return []
+    if settings.BILLING_LEDGER_MODE == "stream":
+        _enqueue(entries)
+    else:
+        apply(entries)
+    return [entry["key"] for entry in entries]
+
+
+def _ensure_group(r):
+    try:
+        r.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+    except Exception as e:  # BUSYGROUP: گروه از قبل هست
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _decode(fields):
+    raw = fields.get(b"data") or fields.get("data")
+    return json.loads(raw)
+
+
+def recover(batch_size: int = 500) -> int:
+    """Apply outbox rows that the stream never delivered within the grace period; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=settings.BILLING_LEDGER_OUTBOX_GRACE_SECONDS)
+    entries = list(
+        LedgerOutbox.objects.filter(created_at__lt=cutoff).order_by("id").values_list("entry", flat=True)[:batch_size]
+    )
+    if entries:
+        logger.warning("applying %s ledger entries from the outbox", len(entries))
+        apply(entries, dequeue=True)
+    return len(entries)
+
+
+def flush(batch_size: int = 500, consumer: str | None = None) -> int:
+    """Drain one batch from the stream into the DB; returns number of entries applied."""
+    r = get_redis()
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    _ensure_group(r)
+
+    # اول پیام‌های معوقِ مصرف‌کننده‌های ازکارافتاده، بعد پیام‌های تازه
+    _, claimed, *_ = r.xautoclaim(STREAM, GROUP, consumer, CLAIM_IDLE_MS, "0-0", count=batch_size)
+    messages = list(claimed)
+    if len(messages) < batch_size:
+        for _, batch in r.xreadgroup(GROUP, consumer, {STREAM: ">"}, count=batch_size - len(messages)) or []:
+            messages.extend(batch)
+    if not messages:
+        return 0
+
+    apply([_decode(fields) for _, fields in messages], dequeue=True)
+    ids = [message_id for message_id, _ in messages]
+    r.xack(STREAM, GROUP, *ids)
+    r.xdel(STREAM, *ids)  # stream فقط رویدادهای هنوز اعمال‌نشده را نگه می‌دارد
+    return len(messages)
+
+
+def pending_entries():
+    """Entries of committed charges not yet applied (used by reconciliation)."""
+    return LedgerOutbox.objects.values_list("entry", flat=True).iterator()
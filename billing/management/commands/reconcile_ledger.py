@@ -0,0 +1,58 @@
+# billing/management/commands/reconcile_ledger.py
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum, Count
+from analytics.models import ArchiveBatch
+from billing import ledger
+from billing.models import Wallet, Transaction, UsageRecord
+
+
+class Command(BaseCommand):
+    help = "Check that every wallet balance equals its ledger (Transactions + queued outbox entries)."
+
+    def handle(self, *args, **opts):
+        # همهٔ خواندن‌ها در یک snapshot؛ flush که وسط کار برسد drift کاذب نمی‌سازد
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            self._reconcile()
+
+    def _reconcile(self):
+        queued = defaultdict(int)
+        queued_keys = set()
+        for e in ledger.pending_entries():
+            queued[e["user_id"]] += e["delta_tokens"]
+            queued_keys.add(e["key"])
+
+        ledger_sums = dict(
+            Transaction.objects.values("user_id").annotate(total=Sum("delta_tokens")).values_list("user_id", "total")
+        )
+        mismatches = 0
+        for user_id, balance in Wallet.objects.values_list("user_id", "balance_tokens").iterator():
+            expected = (ledger_sums.get(user_id) or 0) + queued[user_id]
+            if balance != expected:
+                mismatches += 1
+                self.stdout.write(f"user={user_id} balance={balance} ledger={expected} diff={balance - expected}")
+
+        # هر Transaction مصرف باید UsageRecord هم‌کلید داشته باشد (مصرف خلاصه‌ساز Transaction ندارد)
+        tx_keys = Transaction.objects.filter(
+            reason__in=ledger.USAGE_REASONS, idempotency_key__isnull=False
+        ).aggregate(n=Count("id"))["n"]
+        usage_keys = UsageRecord.objects.filter(idempotency_key__isnull=False).exclude(
+            idempotency_key__startswith="summary:"
+        ).aggregate(n=Count("id"))["n"]
+        # رکوردهای بایگانی‌شده (analytics.archive) دیگر در جدول نیستند
+        usage_keys += sum(
+            stats.get("ledger_keys", 0)
+            for stats in ArchiveBatch.objects.filter(kind="usage").values_list("stats", flat=True)
+        )
+        if tx_keys != usage_keys:
+            mismatches += 1
+            self.stdout.write(f"usage transactions={tx_keys} usage records={usage_keys}")
+
+        self.stdout.write(f"queued outbox entries: {len(queued_keys)}")
+        if mismatches:
+            raise CommandError(f"{mismatches} ledger mismatch(es)")
+        self.stdout.write(self.style.SUCCESS("Ledger matches wallet balances."))
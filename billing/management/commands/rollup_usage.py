@@ -0,0 +1,19 @@
+# billing/management/commands/rollup_usage.py
+from django.core.management.base import BaseCommand
+from billing import rollups
+from billing.models import RollupWatermark
+
+
+class Command(BaseCommand):
+    help = "Backfill the hourly/daily usage rollups up to the latest settled UsageRecord."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help="Drop all rollups and refold from the first UsageRecord (archived records are not included).",
+        )
+
+    def handle(self, *args, **opts):
+        folded = rollups.rebuild() if opts["rebuild"] else rollups.advance()
+        mark = RollupWatermark.objects.filter(name=rollups.WATERMARK).values_list("last_id", flat=True).first()
+        self.stdout.write(self.style.SUCCESS(f"folded {folded} usage records; watermark at id {mark or 0}"))
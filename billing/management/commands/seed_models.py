@@ -1,5 +1,6 @@
 # billing/management/commands/seed_models.py
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from decimal import Decimal
 from billing.models import ModelCatalog
 
@@ -26,6 +27,8 @@ IMAGES = [
 class Command(BaseCommand):
     help = "Seed ModelCatalog with pricing (text/image)."
 
+    # یک commit برای کل seed؛ سیگنال‌های post_save نسخهٔ cache کاتالوگ را بعد از commit بالا می‌برند
+    @transaction.atomic
     def handle(self, *args, **kwargs):
         for a, fr, prov, name, pin, pout, pc in TEXT:
             ModelCatalog.objects.update_or_create(
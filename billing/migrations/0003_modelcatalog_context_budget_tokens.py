@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_transaction_idempotency_key_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modelcatalog',
+            name='context_budget_tokens',
+            field=models.PositiveIntegerField(default=8000),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0003_modelcatalog_context_budget_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modelcatalog',
+            name='response_cache_enabled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_modelcatalog_response_cache_enabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagerecord',
+            name='cached_input_tokens',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_ledger_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='reserved_tokens',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -5,6 +5,8 @@ from django.conf import settings
 class Wallet(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     balance_tokens = models.BigIntegerField(default=0)
+    # رزرو batchهای آفلاین باز (chat.bulk)؛ debit و pre-auth فقط مازاد بر آن را خرج می‌کنند
+    reserved_tokens = models.BigIntegerField(default=0)
 
 
 class Transaction(models.Model):
@@ -12,6 +14,8 @@ class Transaction(models.Model):
     delta_tokens = models.BigIntegerField()
     reason = models.CharField(max_length=64)
     meta = models.JSONField(default=dict, blank=True)
+    # کلید یکتای هر رویداد ledger تا درج دوباره (retry/redelivery) تکراری نشود
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
 
@@ -20,9 +24,23 @@ class Subscription(models.Model):
     tokens_per_month = models.BigIntegerField(default=1_000_000)
     active = models.BooleanField(default=True)
     renew_day = models.PositiveSmallIntegerField(default=1)
+    # زمان شارژ بعدی (billing.renewals)؛ null یعنی هنوز زمان‌بندی نشده
+    next_renewal_at = models.DateTimeField(null=True, blank=True)
+    # آخرین دورهٔ شارژشده، مثل "2026-10"
+    last_period = models.CharField(max_length=7, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["next_renewal_at", "id"],
+                condition=models.Q(active=True),
+                name="billing_sub_due_idx",
+            ),
+        ]
 
 
 PRICING_MODES = (("text", "text"), ("image", "image"))
+DEFAULT_CONTEXT_BUDGET_TOKENS = 8000
 
 
 class ModelCatalog(models.Model):
@@ -39,6 +57,10 @@ class ModelCatalog(models.Model):
     # قیمت‌های تصویر (USD per request):
     per_image_input_usd = models.DecimalField(max_digits=10, decimal_places=3, null=True, blank=True)
     per_image_output_usd = models.DecimalField(max_digits=10, decimal_places=3, null=True, blank=True)
+    # سقف توکن‌های prompt (خلاصه + تاریخچه + پیام کاربر) که برای این مدل ارسال می‌شود
+    context_budget_tokens = models.PositiveIntegerField(default=DEFAULT_CONTEXT_BUDGET_TOKENS)
+    # پاسخ سؤال‌های تکراری از chat.response_cache داده شود
+    response_cache_enabled = models.BooleanField(default=False)
     enabled = models.BooleanField(default=True)
 
 
@@ -47,6 +69,63 @@ class UsageRecord(models.Model):
     model_alias = models.CharField(max_length=64)
     input_tokens = models.IntegerField(default=0)
     output_tokens = models.IntegerField(default=0)
+    # بخشی از input_tokens که از prompt cache خود provider آمده
+    cached_input_tokens = models.IntegerField(default=0)
     cost_usd = models.DecimalField(max_digits=10, decimal_places=4, default=0)
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="billing_usage_user_time_idx"),
+            models.Index(fields=["model_alias", "created_at"], name="billing_usage_model_time_idx"),
+        ]
+
+
+class LedgerOutbox(models.Model):
+    """Ledger entry of a committed charge not yet applied (BILLING_LEDGER_MODE=stream, see billing.ledger)."""
+
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    entry = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+ROLLUP_GRANULARITIES = (("hour", "hour"), ("day", "day"))
+
+
+class UsageRollup(models.Model):
+    """UsageRecord totals per user (or all users), model and hour/day bucket, kept current by billing.rollups."""
+
+    granularity = models.CharField(max_length=4, choices=ROLLUP_GRANULARITIES)
+    bucket = models.DateTimeField()
+    # null = جمع همهٔ کاربران برای آن مدل و bucket
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE)
+    model_alias = models.CharField(max_length=64)
+    requests = models.BigIntegerField(default=0)
+    input_tokens = models.BigIntegerField(default=0)
+    cached_input_tokens = models.BigIntegerField(default=0)
+    output_tokens = models.BigIntegerField(default=0)
+    cost_usd = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "granularity", "bucket", "model_alias"], name="billing_rollup_unique"
+            ),
+            models.UniqueConstraint(
+                fields=["granularity", "model_alias", "bucket"],
+                condition=models.Q(user__isnull=True),
+                name="billing_rollup_totals_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["granularity", "bucket", "model_alias"], name="billing_rollup_bucket_idx"),
+        ]
+
+
+class RollupWatermark(models.Model):
+    # آخرین UsageRecord.id که در rollupها جمع شده است
+    name = models.CharField(max_length=32, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
@@ -1,10 +1,28 @@
 # billing/pricing.py
+import math
 from decimal import Decimal
+from django.conf import settings
 from django.db import transaction
-from .models import Wallet, ModelCatalog, UsageRecord, Transaction
+from .models import ModelCatalog
+from . import catalog, debit, ledger
 
-def _usd_cost_text(cat, in_tokens: int, out_tokens: int):
-    usd = (Decimal(in_tokens)/Decimal(1_000_000))*cat.input_per_million_usd + \
+# توکن‌هایی که هر درخواست تصویر از کیف پول کم می‌کند (عدد ثابت نمادین)
+IMAGE_TOKENS = 1000
+
+def _resolve(model_alias: str, cat=None):
+    if cat is not None:
+        return cat
+    cat = catalog.get_enabled(model_alias)
+    if cat is None:
+        raise ModelCatalog.DoesNotExist(model_alias)
+    return cat
+
+def _usd_cost_text(cat, in_tokens: int, out_tokens: int, cached_tokens: int = 0):
+    # توکن‌های ورودیِ cache‌شدهٔ provider با نرخ cached (اگر تعریف شده باشد)
+    cached = min(cached_tokens, in_tokens)
+    cached_rate = cat.cached_per_million_usd if cat.cached_per_million_usd is not None else cat.input_per_million_usd
+    usd = (Decimal(in_tokens - cached)/Decimal(1_000_000))*cat.input_per_million_usd + \
+          (Decimal(cached)/Decimal(1_000_000))*cached_rate + \
           (Decimal(out_tokens)/Decimal(1_000_000))*cat.output_per_million_usd
     return usd.quantize(Decimal("0.0001"))
 
@@ -13,26 +31,77 @@ def _usd_cost_image(cat, in_reqs: int, out_reqs: int):
     _out = (cat.per_image_output_usd or Decimal(0)) * Decimal(out_reqs)
     return (_in + _out).quantize(Decimal("0.0001"))
 
-def cost_usd(model_alias: str, in_tokens: int, out_tokens: int, *, image_counts=None):
-    cat = ModelCatalog.objects.get(alias=model_alias, enabled=True)
+def cost_usd(model_alias: str, in_tokens: int, out_tokens: int, *, image_counts=None, cat=None, cached_tokens=0):
+    cat = _resolve(model_alias, cat)
     if cat.pricing_mode == "text":
-        return _usd_cost_text(cat, in_tokens, out_tokens)
+        return _usd_cost_text(cat, in_tokens, out_tokens, cached_tokens)
     # image mode
     image_counts = image_counts or {"in":1, "out":0}
     return _usd_cost_image(cat, image_counts["in"], image_counts["out"])
 
+def _charge(cat, model_alias, in_tokens, out_tokens, *, image_counts=None, cache_hit=False, cached_tokens=0,
+            batch=False):
+    """``(usd, used_tokens)`` one exchange costs us and the wallet."""
+    usd = cost_usd(model_alias, in_tokens, out_tokens, image_counts=image_counts, cat=cat,
+                   cached_tokens=cached_tokens)
+    used_tokens = (in_tokens + out_tokens) if cat.pricing_mode=="text" else IMAGE_TOKENS
+    if cache_hit:
+        # پاسخ از response cache آمده: هزینه‌ای به provider نداده‌ایم و کاربر نرخ تخفیفی می‌پردازد
+        used_tokens = math.ceil(used_tokens * Decimal(settings.RESPONSE_CACHE_BILLING_RATE))
+        usd = Decimal("0.0000")
+    elif batch:
+        # Batch API provider نیم‌بها است؛ کاربر هم نرخ batch می‌پردازد
+        used_tokens = math.ceil(used_tokens * Decimal(settings.CHAT_BATCH_BILLING_RATE))
+        usd = (usd * Decimal(settings.OPENAI_BATCH_COST_RATE)).quantize(Decimal("0.0001"))
+    return usd, used_tokens
+
+def exchange_tokens(ex, *, batch=False) -> int:
+    """Wallet tokens ``charge_wallet_for_exchanges`` takes for one exchange dict."""
+    cat = ex["cat"]
+    return _charge(cat, cat.alias, ex["in_tokens"], ex["out_tokens"], cache_hit=ex.get("cache_hit", False),
+                   cached_tokens=ex.get("cached_tokens", 0), batch=batch)[1]
+
 @transaction.atomic
-def charge_wallet_for_usage(user, model_alias: str, in_tokens: int, out_tokens: int, *, image_counts=None):
-    cat = ModelCatalog.objects.get(alias=model_alias, enabled=True)
-    usd = cost_usd(model_alias, in_tokens, out_tokens, image_counts=image_counts)
-    used_tokens = (in_tokens + out_tokens) if cat.pricing_mode=="text" else 1000  # برای تصویر یک عدد ثابت نمادین
-    w, _ = Wallet.objects.select_for_update().get_or_create(user=user)
-    if w.balance_tokens < used_tokens:
-        raise ValueError("INSUFFICIENT_WALLET")
-    w.balance_tokens -= used_tokens
-    w.save(update_fields=["balance_tokens"])
-    Transaction.objects.create(user=user, delta_tokens=-used_tokens, reason="usage",
-                               meta={"model_alias":model_alias, "usd":str(usd)})
-    UsageRecord.objects.create(user=user, model_alias=model_alias,
-                               input_tokens=in_tokens, output_tokens=out_tokens, cost_usd=usd)
-    return usd, used_tokens
\ No newline at end of file
+def charge_wallet_for_usage(user, model_alias: str, in_tokens: int, out_tokens: int, *,
+                            image_counts=None, cat=None, hold=None, cache_hit=False, cached_tokens=0):
+    cat = _resolve(model_alias, cat)
+    usd, used_tokens = _charge(cat, model_alias, in_tokens, out_tokens, image_counts=image_counts,
+                               cache_hit=cache_hit, cached_tokens=cached_tokens)
+    # یک UPDATE شرطی، بدون select_for_update؛ اگر موجودی کم باشد INSUFFICIENT_WALLET
+    debit.debit(user.id, used_tokens)
+    # ردیف‌های Transaction/UsageRecord از مسیر ledger (درجا یا write-behind) نوشته می‌شوند
+    ledger.record(user.id, model_alias, used_tokens, in_tokens, out_tokens, usd,
+                  reason="cache_hit" if cache_hit else "usage", cached_tokens=cached_tokens)
+    if hold is not None:
+        transaction.on_commit(lambda: debit.settle(hold, used_tokens))
+    return usd, used_tokens
+
+@transaction.atomic
+def charge_wallet_for_exchanges(user, exchanges, *, hold=None, batch=False):
+    """
+    Bill several text exchanges with one wallet debit.
+
+    ``exchanges`` are dicts with ``cat``, ``in_tokens``, ``out_tokens`` and
+    optionally ``cached_tokens``/``cache_hit``. Each still gets its own ledger
+    entry so usage stays per model; ``batch`` bills Batch API results at
+    ``CHAT_BATCH_BILLING_RATE``. Raises INSUFFICIENT_WALLET for the whole lot.
+    Returns ``(usd, used_tokens)`` per exchange, in order.
+    """
+    charges, entries = [], []
+    for ex in exchanges:
+        cat, cache_hit = ex["cat"], ex.get("cache_hit", False)
+        usd, used_tokens = _charge(cat, cat.alias, ex["in_tokens"], ex["out_tokens"], cache_hit=cache_hit,
+                                   cached_tokens=ex.get("cached_tokens", 0), batch=batch)
+        charges.append((usd, used_tokens))
+        entries.append(dict(
+            model_alias=cat.alias, used_tokens=used_tokens, in_tokens=ex["in_tokens"], out_tokens=ex["out_tokens"],
+            usd=usd, reason="cache_hit" if cache_hit else "batch" if batch else "usage",
+            cached_tokens=ex.get("cached_tokens", 0),
+        ))
+    total = sum(used for _, used in charges)
+    if total:
+        debit.debit(user.id, total)
+    ledger.record_many(user.id, entries)
+    if hold is not None:
+        transaction.on_commit(lambda: debit.settle(hold, total))
+    return charges
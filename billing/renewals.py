@@ -0,0 +1,151 @@
+"""
+Monthly subscription credits.
+
+``run()`` (Celery beat, ``billing.tasks.renew_subscriptions``) takes active
+subscriptions whose ``next_renewal_at`` has passed, in chunks of
+``SUBSCRIPTION_RENEWAL_CHUNK`` read off a partial index. Each chunk is one
+transaction of a fixed number of statements, however many rows it holds:
+
+* one ``bulk_create`` of ``subscription`` Transactions keyed
+  ``renewal:<subscription_id>:<YYYY-MM>``; keys that already exist are
+  skipped, so a retried chunk or a redelivered task credits nothing twice;
+* one ``UPDATE wallet ... FROM (VALUES ...)`` adding the new credits per user;
+* one ``UPDATE subscription ... FROM (VALUES ...)`` moving each subscription
+  to its next period.
+
+Due rows are locked with ``SKIP LOCKED`` so several workers can share a
+backlog. A subscription that missed periods (e.g. beat was down) is credited
+once per missed period. ``renew_day`` is clamped to the length of the month
+and renewals happen at local midnight (``TIME_ZONE``).
+"""
+import calendar
+from datetime import date, datetime, time
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from analytics import metrics
+from . import balance, debit
+from .models import Subscription, Transaction, Wallet
+
+REASON = "subscription"
+
+
+def due_on(year: int, month: int, renew_day: int) -> datetime:
+    day = min(max(renew_day, 1), calendar.monthrange(year, month)[1])
+    return timezone.make_aware(datetime.combine(date(year, month, day), time.min))
+
+
+def next_after(moment: datetime, renew_day: int) -> datetime:
+    """The first renewal strictly after ``moment``."""
+    local = timezone.localtime(moment)
+    candidate = due_on(local.year, local.month, renew_day)
+    if candidate > moment:
+        return candidate
+    year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+    return due_on(year, month, renew_day)
+
+
+def period(due: datetime) -> str:
+    return f"{timezone.localtime(due):%Y-%m}"
+
+
+def idempotency_key(subscription_id: int, period_key: str) -> str:
+    return f"renewal:{subscription_id}:{period_key}"
+
+
+def schedule_new(now=None) -> int:
+    """Give unscheduled active subscriptions their first ``next_renewal_at``."""
+    now = now or timezone.now()
+    scheduled = 0
+    while True:
+        subs = list(Subscription.objects.filter(active=True, next_renewal_at=None).only("id", "renew_day")[:5000])
+        if not subs:
+            return scheduled
+        for s in subs:
+            s.next_renewal_at = next_after(now, s.renew_day)
+        Subscription.objects.bulk_update(subs, ["next_renewal_at"], batch_size=1000)
+        scheduled += len(subs)
+
+
+def _values(rows) -> tuple[str, list]:
+    placeholders = ", ".join(["(" + ", ".join(["%s"] * len(rows[0])) + ")"] * len(rows))
+    return f"(VALUES {placeholders})", [v for row in rows for v in row]
+
+
+def _credit_wallets(credits: dict):
+    wallet = Wallet._meta.db_table
+    values, params = _values(list(credits.items()))
+    with connection.cursor() as cur:
+        cur.execute(
+            f"UPDATE {wallet} SET balance_tokens = {wallet}.balance_tokens + v.column2 "
+            f"FROM {values} AS v WHERE {wallet}.user_id = v.column1",
+            params,
+        )
+
+
+def _advance(moves):
+    table = Subscription._meta.db_table
+    adapt = connection.ops.adapt_datetimefield_value
+    values, params = _values([(sub_id, adapt(due), period_key) for sub_id, due, period_key in moves])
+    with connection.cursor() as cur:
+        cur.execute(
+            f"UPDATE {table} SET next_renewal_at = v.column2, last_period = v.column3 "
+            f"FROM {values} AS v WHERE {table}.id = v.column1",
+            params,
+        )
+
+
+def _invalidate(user_ids):
+    debit.invalidate(*user_ids)
+    # فقط نسخه بالا می‌رود؛ موجودی هر کاربر در اولین poll از دیتابیس خوانده می‌شود
+    balance.invalidate(*user_ids)
+
+
+def renew_chunk(now=None) -> int:
+    """Credit one chunk of due subscriptions; returns how many were handled (0 = nothing due)."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = (
+            Subscription.objects.select_for_update(skip_locked=True)
+            .filter(active=True, next_renewal_at__lte=now)
+            .order_by("next_renewal_at", "id")
+            .values_list("id", "user_id", "tokens_per_month", "renew_day", "next_renewal_at")
+        )
+        due = list(due[: settings.SUBSCRIPTION_RENEWAL_CHUNK])
+        if not due:
+            return 0
+        keys = {row[0]: idempotency_key(row[0], period(row[4])) for row in due}
+        done = set(Transaction.objects.filter(idempotency_key__in=keys.values()).values_list("idempotency_key", flat=True))
+
+        credits, txs = {}, []
+        for sub_id, user_id, tokens, _, _ in due:
+            if keys[sub_id] in done or tokens <= 0:
+                continue
+            credits[user_id] = credits.get(user_id, 0) + tokens
+            txs.append(Transaction(
+                user_id=user_id, delta_tokens=tokens, reason=REASON, idempotency_key=keys[sub_id],
+                meta={"subscription_id": sub_id, "period": keys[sub_id].rsplit(":", 1)[1]},
+            ))
+        if txs:
+            Wallet.objects.bulk_create([Wallet(user_id=u) for u in credits], ignore_conflicts=True)
+            Transaction.objects.bulk_create(txs)
+            _credit_wallets(credits)
+        _advance([(sub_id, next_after(at, renew_day), period(at)) for sub_id, _, _, renew_day, at in due])
+        transaction.on_commit(lambda: _invalidate(credits))
+    metrics.incr("subscriptions.renewed", len(txs))
+    metrics.incr("subscriptions.tokens_credited", sum(credits.values()))
+    return len(due)
+
+
+def run(now=None, max_chunks: int | None = None) -> int:
+    """Schedule new subscriptions, then renew everything due; returns subscriptions handled."""
+    now = now or timezone.now()
+    schedule_new(now)
+    max_chunks = settings.SUBSCRIPTION_RENEWAL_MAX_CHUNKS if max_chunks is None else max_chunks
+    handled = 0
+    for _ in range(max_chunks):
+        n = renew_chunk(now)
+        if not n:
+            break
+        handled += n
+    return handled
@@ -0,0 +1,119 @@
+"""
+Hourly and daily UsageRollup buckets maintained from a high-water mark.
+
+``advance()`` folds UsageRecords with ``id`` above the RollupWatermark into
+the rollup table (one row per user, model and bucket plus an all-users row
+per model and bucket), at most ``USAGE_ROLLUP_BATCH`` records per round,
+and moves the mark in the same transaction, so every record is counted
+exactly once. Each fold is a single ``INSERT ... SELECT ... GROUP BY ... ON
+CONFLICT DO UPDATE`` adding onto existing buckets (PostgreSQL and SQLite
+both support it), so no usage rows pass through Python. The watermark row
+is locked for the duration, which keeps concurrent runs from double
+counting. Records newer than ``USAGE_ROLLUP_LAG_SECONDS`` wait for the next
+run: ids come from a sequence, and a lower id can still be uncommitted when
+a higher one is already visible. The mark stops below the first such record,
+so rows after it with an older ``created_at`` (backdated, or written late
+by the stream-mode ledger) wait with it instead of being skipped. Buckets are
+UTC hours and days.
+
+Reports (``report``) read only the rollups, so their cost depends on the
+number of buckets in the range, not on the number of requests.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from analytics import metrics
+from .models import RollupWatermark, UsageRecord, UsageRollup
+
+WATERMARK = "usage"
+GRANULARITIES = ("hour", "day")
+TOTALS = ("requests", "input_tokens", "cached_input_tokens", "output_tokens", "cost_usd")
+COST_PLACES = Decimal("0.0001")
+
+
+def _fold_sql(granularity: str, per_user: bool):
+    rollup, usage = UsageRollup._meta.db_table, UsageRecord._meta.db_table
+    bucket, bucket_params = connection.ops.datetime_trunc_sql(granularity, "created_at", (), "UTC")
+    if per_user:
+        user, group, target = "user_id", "user_id, model_alias, bucket", "(user_id, granularity, bucket, model_alias)"
+    else:
+        user, group, target = "NULL", "model_alias, bucket", "(granularity, model_alias, bucket) WHERE user_id IS NULL"
+    increments = ", ".join(f"{f} = {rollup}.{f} + excluded.{f}" for f in TOTALS)
+    sql = (
+        f"INSERT INTO {rollup} (granularity, bucket, user_id, model_alias, {', '.join(TOTALS)}) "
+        f"SELECT %s, bucket, {user}, model_alias, COUNT(*), SUM(input_tokens), SUM(cached_input_tokens), "
+        f"SUM(output_tokens), SUM(cost_usd) "
+        f"FROM (SELECT {bucket} AS bucket, * FROM {usage} WHERE id > %s AND id <= %s) AS u "
+        f"WHERE true GROUP BY {group} "
+        f"ON CONFLICT {target} DO UPDATE SET {increments}"
+    )
+    return sql, [granularity, *bucket_params]
+
+
+def advance_once(now=None) -> int:
+    """One round; returns the number of UsageRecords folded in."""
+    settled = (now or timezone.now()) - timedelta(seconds=settings.USAGE_ROLLUP_LAG_SECONDS)
+    with transaction.atomic():
+        RollupWatermark.objects.get_or_create(name=WATERMARK)
+        mark = RollupWatermark.objects.select_for_update().get(name=WATERMARK)
+        ids = UsageRecord.objects.filter(id__gt=mark.last_id)
+        # اولین ردیف تازه مرز است؛ ردیف‌های بعدی (حتی با created_at قدیمی‌تر) همراه آن صبر می‌کنند
+        newest = ids.filter(created_at__gt=settled).aggregate(first=Min("id"))["first"]
+        if newest is not None:
+            ids = ids.filter(id__lt=newest)
+        top = ids.order_by("id")[: settings.USAGE_ROLLUP_BATCH].aggregate(top=Max("id"), n=Count("id"))
+        if not top["n"]:
+            return 0
+        with connection.cursor() as cur:
+            for granularity in GRANULARITIES:
+                for per_user in (True, False):
+                    sql, params = _fold_sql(granularity, per_user)
+                    cur.execute(sql, [*params, mark.last_id, top["top"]])
+        mark.last_id = top["top"]
+        mark.save(update_fields=["last_id", "updated_at"])
+    metrics.incr("usage_rollup.records", top["n"])
+    return top["n"]
+
+
+def advance(max_rounds: int | None = None, now=None) -> int:
+    total, rounds = 0, 0
+    while max_rounds is None or rounds < max_rounds:
+        n = advance_once(now)
+        total += n
+        rounds += 1
+        if n < settings.USAGE_ROLLUP_BATCH:
+            break
+    return total
+
+
+def rebuild() -> int:
+    """Drop every bucket and refold all UsageRecords still in the table (archived ones are lost)."""
+    with transaction.atomic():
+        UsageRollup.objects.all().delete()
+        RollupWatermark.objects.update_or_create(name=WATERMARK, defaults={"last_id": 0})
+    return advance()
+
+
+def report(granularity: str, since, until, *, user_id=None, model_alias=None, by_user=False):
+    """
+    ``(buckets, totals)`` over ``[since, until)`` from rollups only.
+
+    Without ``user_id`` or ``by_user`` only the all-users rows are read, a few
+    per model and bucket however many users there are.
+    """
+    qs = UsageRollup.objects.filter(granularity=granularity, bucket__gte=since, bucket__lt=until)
+    if user_id is not None:
+        qs = qs.filter(user_id=user_id)
+    else:
+        qs = qs.filter(user__isnull=not by_user)
+    if model_alias:
+        qs = qs.filter(model_alias=model_alias)
+    keys = ["bucket", "model_alias"] + (["user_id"] if by_user else [])
+    rows = list(qs.values(*keys, *TOTALS).order_by(*keys))
+    totals = {f: sum(r[f] or 0 for r in rows) for f in TOTALS}
+    for r in rows + [totals]:
+        r["cost_usd"] = Decimal(r["cost_usd"] or 0).quantize(COST_PLACES)
+    return rows, totals
@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import Wallet
+from django.utils import timezone
+from .models import Wallet, ModelCatalog, Subscription
+from . import balance, catalog, renewals
 
 
 @receiver(post_save, sender=get_user_model())
@@ -9,3 +12,28 @@ def create_wallet_for_user(sender, instance, created, **kwargs):
     if created:
         Wallet.objects.get_or_create(user=instance)
 
+
+@receiver(post_save, sender=Wallet)
+def refresh_cached_balance(sender, instance, **kwargs):
+    # ویرایش از admin یا ساخت کیف پول؛ مسیرهای update() خودشان balance.changed را صدا می‌زنند
+    balance.changed(instance.user_id)
+
+
+@receiver(post_save, sender=ModelCatalog)
+@receiver(post_delete, sender=ModelCatalog)
+def invalidate_model_catalog(sender, **kwargs):
+    # این پردازه فوراً، بقیهٔ پردازه‌ها بعد از commit از طریق کلید نسخه
+    catalog.invalidate_local()
+    transaction.on_commit(catalog.bump_version)
+
+
+@receiver(pre_save, sender=Subscription)
+def schedule_subscription(sender, instance, **kwargs):
+    # اولین شارژ در نزدیک‌ترین renew_day؛ ردیف‌های bulk را renewals.schedule_new زمان‌بندی می‌کند
+    if not instance.active:
+        return
+    reactivated = instance.pk is not None and Subscription.objects.filter(pk=instance.pk, active=False).exists()
+    # تاریخ قدیمیِ اشتراکِ غیرفعال باعث می‌شد renew_chunk همهٔ ماه‌های غیرفعال را جبران کند
+    if instance.next_renewal_at is None or reactivated:
+        instance.next_renewal_at = renewals.next_after(timezone.now(), instance.renew_day)
+
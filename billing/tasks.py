@@ -0,0 +1,30 @@
+from celery import shared_task
+from django.conf import settings
+from . import ledger, renewals, rollups
+
+
+@shared_task
+def flush_usage_ledger(max_batches: int = 20):
+    """Bulk-insert queued usage ledger entries (BILLING_LEDGER_MODE=stream)."""
+    total = ledger.recover(batch_size=settings.BILLING_LEDGER_BATCH)
+    if settings.BILLING_LEDGER_MODE != "stream":
+        # بعد از برگشت به sync فقط باقی‌ماندهٔ outbox اعمال می‌شود؛ سراغ ردیس نمی‌رویم
+        return total
+    for _ in range(max_batches):
+        applied = ledger.flush(batch_size=settings.BILLING_LEDGER_BATCH)
+        total += applied
+        if applied < settings.BILLING_LEDGER_BATCH:
+            break
+    return total
+
+
+@shared_task
+def rollup_usage():
+    """Fold settled UsageRecords into the hourly/daily rollups (see billing.rollups)."""
+    return rollups.advance(max_rounds=settings.USAGE_ROLLUP_MAX_ROUNDS)
+
+
+@shared_task
+def renew_subscriptions():
+    """Credit wallets for every subscription whose period has started (see billing.renewals)."""
+    return renewals.run()
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ModelCatalogViewSet, DevPurchaseMillionView, WalletView
+from .views import ModelCatalogViewSet, DevPurchaseMillionView, WalletStreamView, WalletView
+from .views import ModelUsageReportView, UsageReportView
 
 router = DefaultRouter()
 router.register("models", ModelCatalogViewSet, basename="models")
@@ -9,4 +10,7 @@ urlpatterns = [
     path("", include(router.urls)),
     path("purchase/dev-million/", DevPurchaseMillionView.as_view()),
     path("wallet/", WalletView.as_view()),
+    path("wallet/stream/", WalletStreamView.as_view()),
+    path("usage/", UsageReportView.as_view()),
+    path("usage/models/", ModelUsageReportView.as_view()),
 ]
\ No newline at end of file
@@ -1,36 +1,160 @@
 from rest_framework.viewsets import ReadOnlyModelViewSet
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.generics import ListAPIView
 from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
+from django.views import View
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import APIException
+from datetime import datetime, time, timedelta
 from decimal import Decimal
-from .models import ModelCatalog, Wallet, Transaction
+from .models import ModelCatalog, Transaction
 from .serializers import ModelCatalogSerializer
+from chat.streaming import authenticate, can_hold, event_stream
+from . import balance, catalog, debit, rollups
 
 class ModelCatalogViewSet(ReadOnlyModelViewSet):
     queryset = ModelCatalog.objects.filter(enabled=True)
     serializer_class = ModelCatalogSerializer
     permission_classes = [AllowAny]  # لیست عمومی مشکلی ندارد
 
+    def list(self, request, *args, **kwargs):
+        # از cache درون‌پردازه‌ای؛ بدون کوئری دیتابیس
+        return Response(self.get_serializer(catalog.list_enabled(), many=True).data)
+
 class ModelsListView(ListAPIView):
     queryset = ModelCatalog.objects.filter(enabled=True)
     serializer_class = ModelCatalogSerializer
     permission_classes = [AllowAny]
 
+    def get_queryset(self):
+        return catalog.list_enabled()
+
 class DevPurchaseMillionView(APIView):
     def post(self, request):
         base = Decimal(str(settings.DEFAULT_MILLION_TOKENS_PRICE_USD or 1.0))
         margin = Decimal(str(getattr(settings, "PROFIT_MARGIN", 0.20)))
         price = (base * (1 + margin)).quantize(Decimal("0.01"))
-        w, _ = Wallet.objects.get_or_create(user=request.user)
-        w.balance_tokens += 1_000_000
-        w.save(update_fields=["balance_tokens"])
-        Transaction.objects.create(user=request.user, delta_tokens=+1_000_000, reason="topup",
-                                   meta={"usd_charged": str(price)})
+        with transaction.atomic():
+            debit.credit(request.user.id, 1_000_000)
+            Transaction.objects.create(user=request.user, delta_tokens=+1_000_000, reason="topup",
+                                       meta={"usd_charged": str(price)})
         return Response({"tokens_added": 1_000_000, "charged_usd": str(price)})
 
+def _wallet_response(request, current):
+    # If-None-Match بر If-Modified-Since مقدم است (get_conditional_response)
+    not_modified = get_conditional_response(request, etag=current.etag, last_modified=current.changed_at)
+    if not_modified is not None:
+        not_modified["ETag"] = current.etag
+        return not_modified
+    return JsonResponse(current.payload(), headers={
+        "ETag": current.etag, "Last-Modified": http_date(current.changed_at), "Cache-Control": "private, no-cache",
+    })
+
+
 class WalletView(APIView):
+    """The caller's balance from ``billing.balance``; 304 while it has not changed."""
+
     def get(self, request):
-        wallet, _ = Wallet.objects.get_or_create(user=request.user)
-        return Response({"balance_tokens": wallet.balance_tokens})
\ No newline at end of file
+        return _wallet_response(request, balance.get(request.user.id))
+
+
+class WalletStreamView(View):
+    """
+    Balance changes pushed instead of polled.
+
+    With ``Accept: text/event-stream`` this is an SSE stream of ``balance``
+    events for WALLET_STREAM_SECONDS. Otherwise it is a long poll: it answers
+    as soon as the balance's ETag differs from the client's If-None-Match, or
+    with 304 after WALLET_LONGPOLL_SECONDS. Both only hold the connection
+    under the ASGI app; under WSGI the stream is one event plus a reconnect
+    delay and the long poll answers at once, like ``WalletView``.
+    """
+
+    async def get(self, request):
+        try:
+            user, _ = await sync_to_async(authenticate)(request)
+        except APIException as e:
+            return JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+        held = can_hold(request)
+        if "text/event-stream" in request.META.get("HTTP_ACCEPT", ""):
+            return event_stream(balance.stream(user.id) if held else balance.snapshot(user.id))
+        if held:
+            current = await balance.wait_for_change(
+                user.id, request.META.get("HTTP_IF_NONE_MATCH"), settings.WALLET_LONGPOLL_SECONDS,
+            )
+        else:
+            current = await sync_to_async(balance.get)(user.id)
+        return _wallet_response(request, current)
+
+
+def _report_range(params):
+    """``(granularity, since, until)`` from query params; ValueError on bad input."""
+    granularity = params.get("granularity", "day")
+    if granularity not in rollups.GRANULARITIES:
+        raise ValueError("granularity must be hour or day")
+    bounds = []
+    for name, default in (("since", timedelta(days=7)), ("until", timedelta(0))):
+        raw = params.get(name)
+        if not raw:
+            bounds.append(timezone.now() - default)
+            continue
+        value = parse_datetime(raw) or (parse_date(raw) and datetime.combine(parse_date(raw), time.min))
+        if not value:
+            raise ValueError(f"{name} must be an ISO date or datetime")
+        bounds.append(timezone.make_aware(value) if timezone.is_naive(value) else value)
+    since, until = bounds
+    limit = settings.USAGE_REPORT_MAX_DAYS[granularity]
+    if until - since > timedelta(days=limit):
+        raise ValueError(f"{granularity} reports cover at most {limit} days")
+    return granularity, since, until
+
+
+def _report_response(rows, totals, granularity, since, until):
+    return Response({
+        "granularity": granularity,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "totals": {**totals, "cost_usd": str(totals["cost_usd"])},
+        "buckets": [{**r, "bucket": r["bucket"].isoformat(), "cost_usd": str(r["cost_usd"])} for r in rows],
+    })
+
+
+class UsageReportView(APIView):
+    """The caller's own spend per model, from rollups."""
+
+    def get(self, request):
+        try:
+            granularity, since, until = _report_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        rows, totals = rollups.report(
+            granularity, since, until, user_id=request.user.id, model_alias=request.query_params.get("model_alias")
+        )
+        return _report_response(rows, totals, granularity, since, until)
+
+
+class ModelUsageReportView(APIView):
+    """Spend across all users per model (``by_user=1`` splits it per user), from rollups."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            granularity, since, until = _report_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        rows, totals = rollups.report(
+            granularity, since, until,
+            model_alias=request.query_params.get("model_alias"),
+            by_user=request.query_params.get("by_user") in ("1", "true"),
+        )
+        return _report_response(rows, totals, granularity, since, until)
+
@@ -0,0 +1,177 @@
+"""
+Admission control for upstream LLM calls.
+
+Before a chat send reaches OpenAI it takes a slot in up to three Redis
+semaphores (per user, per ModelCatalog alias, whole deployment) and counts
+against the deployment-wide requests/tokens per minute. Semaphores are
+sorted sets of ``token -> acquired_at``: leases older than
+``ADMISSION_LEASE_SECONDS`` (a worker killed mid-call) are dropped on the next
+acquire. RPM/TPM are fixed one-minute windows. Every check and increment
+happens in one Lua script, so concurrent workers can't overshoot a limit.
+
+A send that doesn't fit waits up to ``ADMISSION_QUEUE_SECONDS`` for a slot and
+is then rejected with ``Rejected.retry_after``; views turn that into 429 with a
+``Retry-After`` header. Limits of 0 are off, and with every limit off no Redis
+call is made. If Redis is unreachable the send is admitted (fail open).
+"""
+import asyncio
+import logging
+import math
+import time
+import uuid
+from dataclasses import dataclass, field
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from analytics import metrics
+from config.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SEM_KEY = "admit:sem:{}"
+RATE_KEY = "admit:{}:{}"  # admit:rpm:<minute> / admit:tpm:<minute>
+POLL_SECONDS = 0.05
+
+# 0 = پذیرفته شد؛ در غیر این صورت شمارهٔ (از 1) محدودیتی که پر است
+_ACQUIRE = """
+local now = tonumber(ARGV[1])
+local lease = tonumber(ARGV[2])
+local nsem = tonumber(ARGV[4])
+local tokens = tonumber(ARGV[5])
+for i = 1, nsem do
+  redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now - lease)
+  if redis.call('ZCARD', KEYS[i]) >= tonumber(ARGV[5 + i]) then return i end
+end
+local rpm = tonumber(ARGV[6 + nsem])
+local tpm = tonumber(ARGV[7 + nsem])
+if rpm > 0 and tonumber(redis.call('GET', KEYS[nsem + 1]) or '0') >= rpm then return nsem + 1 end
+if tpm > 0 then
+  local used = tonumber(redis.call('GET', KEYS[nsem + 2]) or '0')
+  if used > 0 and used + tokens > tpm then return nsem + 2 end
+end
+for i = 1, nsem do
+  redis.call('ZADD', KEYS[i], now, ARGV[3])
+  redis.call('EXPIRE', KEYS[i], math.ceil(lease))
+end
+if rpm > 0 then redis.call('INCR', KEYS[nsem + 1]); redis.call('EXPIRE', KEYS[nsem + 1], 120) end
+if tpm > 0 then redis.call('INCRBY', KEYS[nsem + 2], tokens); redis.call('EXPIRE', KEYS[nsem + 2], 120) end
+return 0
+"""
+
+
+class Rejected(Exception):
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"admission rejected: {scope}")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    token: str
+    keys: list = field(default_factory=list)
+
+
+def _semaphores(user_id, alias: str):
+    return [
+        (scope, SEM_KEY.format(name), limit)
+        for scope, name, limit in (
+            ("user", f"user:{user_id}", settings.ADMISSION_USER_CONCURRENCY),
+            ("model", f"model:{alias}", settings.ADMISSION_MODEL_CONCURRENCY),
+            ("global", "global", settings.ADMISSION_GLOBAL_CONCURRENCY),
+        )
+        if limit > 0
+    ]
+
+
+def enabled() -> bool:
+    return any((
+        settings.ADMISSION_USER_CONCURRENCY, settings.ADMISSION_MODEL_CONCURRENCY,
+        settings.ADMISSION_GLOBAL_CONCURRENCY, settings.ADMISSION_RPM, settings.ADMISSION_TPM,
+    ))
+
+
+def _acquire(user_id, alias: str, tokens: int):
+    """One atomic attempt; returns ``(ticket, None)`` or ``(None, Rejected)``."""
+    now = time.time()
+    sems = _semaphores(user_id, alias)
+    minute = int(now // 60)
+    token = uuid.uuid4().hex
+    keys = [key for _, key, _ in sems] + [RATE_KEY.format("rpm", minute), RATE_KEY.format("tpm", minute)]
+    args = [now, settings.ADMISSION_LEASE_SECONDS, token, len(sems), tokens,
+            *(limit for _, _, limit in sems), settings.ADMISSION_RPM, settings.ADMISSION_TPM]
+    result = int(get_redis().eval(_ACQUIRE, len(keys), *keys, *args))
+    if result == 0:
+        return Ticket(token, [key for _, key, _ in sems]), None
+    if result <= len(sems):
+        return None, Rejected(sems[result - 1][0], settings.ADMISSION_RETRY_AFTER)
+    # پنجرهٔ یک‌دقیقه‌ای تا ابتدای دقیقهٔ بعد پر می‌ماند
+    scope = "rpm" if result == len(sems) + 1 else "tpm"
+    return None, Rejected(scope, max(1, math.ceil(60 - now % 60)))
+
+
+def _try_acquire(user_id, alias: str, tokens: int):
+    try:
+        return _acquire(user_id, alias, tokens)
+    except Exception:
+        logger.warning("admission control unavailable; admitting", exc_info=True)
+        metrics.incr("admission.decisions", model=alias, outcome="error")
+        return Ticket(""), None
+
+
+def _admitted(alias, started, ticket, attempts):
+    metrics.incr("admission.decisions", model=alias, outcome="queued" if attempts > 1 else "admitted")
+    metrics.observe("admission.wait_seconds", time.monotonic() - started, model=alias)
+    return ticket
+
+
+def _rejected(alias, started, rejection):
+    metrics.incr("admission.decisions", model=alias, outcome="rejected", scope=rejection.scope)
+    metrics.observe("admission.wait_seconds", time.monotonic() - started, model=alias)
+    return rejection
+
+
+def admit(user_id, alias: str, tokens: int):
+    """Take the slots for one upstream call (waiting up to ADMISSION_QUEUE_SECONDS); raises Rejected."""
+    if not enabled():
+        return None
+    started = time.monotonic()
+    deadline = started + settings.ADMISSION_QUEUE_SECONDS
+    attempts = 0
+    while True:
+        attempts += 1
+        ticket, rejection = _try_acquire(user_id, alias, tokens)
+        if ticket is not None:
+            return _admitted(alias, started, ticket, attempts)
+        if time.monotonic() + POLL_SECONDS > deadline:
+            raise _rejected(alias, started, rejection)
+        time.sleep(POLL_SECONDS)
+
+
+async def aadmit(user_id, alias: str, tokens: int):
+    """``admit`` for the ASGI view: the wait is an ``asyncio.sleep``, Redis calls run in a thread."""
+    if not enabled():
+        return None
+    started = time.monotonic()
+    deadline = started + settings.ADMISSION_QUEUE_SECONDS
+    attempts = 0
+    while True:
+        attempts += 1
+        ticket, rejection = await sync_to_async(_try_acquire)(user_id, alias, tokens)
+        if ticket is not None:
+            return _admitted(alias, started, ticket, attempts)
+        if time.monotonic() + POLL_SECONDS > deadline:
+            raise _rejected(alias, started, rejection)
+        await asyncio.sleep(POLL_SECONDS)
+
+
+def release(ticket: Ticket | None):
+    """Give the concurrency slots back; RPM/TPM usage stays counted for its minute."""
+    if ticket is None or not ticket.keys:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        for key in ticket.keys:
+            pipe.zrem(key, ticket.token)
+        pipe.execute()
+    except Exception:
+        logger.warning("admission release failed; slot expires with its lease", exc_info=True)
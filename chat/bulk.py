@@ -0,0 +1,431 @@
+"""
+Many sends in one request: ``POST /api/chat/send/bulk``.
+
+A teacher sending one prompt to a whole class, or QA replaying a prompt
+suite, posts ``items`` of ``{prompt, thread_id?, model_alias?}`` (a top-level
+``model_alias`` is the default). Items are validated and their threads
+resolved with one query; items without a thread get a new one each, created
+only once the wallet check has passed.
+
+``mode=interactive`` (default) pre-authorises the summed estimate once,
+answers what it can from the response cache, and sends the rest to
+``chat_completion`` from at most ``CHAT_BULK_CONCURRENCY`` threads. Items
+that would share a response-cache entry (same model, prompt and recent
+context) make one upstream call; the others are billed as cache hits, as
+they would be if sent one after the other. All messages are then written
+with one ``bulk_create`` and the wallet is charged with one debit, in one
+transaction: if the wallet can't cover the total nothing is stored (402).
+Failures of single items (upstream errors, admission) are reported per item
+and not billed.
+
+``mode=offline`` uploads the items to the provider's Batch API (one model
+alias per request) and returns 202 with a ChatBatch id. Jobs finish up to a
+day later, long after a Redis pre-auth would have expired, so the estimate is
+reserved on the wallet (``billing.debit.reserve``, recorded as
+``ChatBatch.reserved_tokens``): interactive sends can't spend it while the job
+runs, and it is given back when the job is collected or fails. The
+``chat.tasks.poll_chat_batches`` beat collects finished jobs, stores the
+replies the same way and bills them at ``CHAT_BATCH_BILLING_RATE``. If the
+replies cost more than the wallet still covers, the leading ones that fit are
+kept and billed and the rest are reported as 402.
+"""
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from analytics import metrics
+from billing import catalog, debit
+from billing.models import Wallet
+from billing.pricing import charge_wallet_for_exchanges, exchange_tokens
+from . import admission, context_cache, openai_client, response_cache
+from .models import ChatBatch, ChatMessage, ChatThread
+from .prompts import SendError, build_messages_with_memory, reply_text
+
+logger = logging.getLogger(__name__)
+
+MODES = ("interactive", "offline")
+FAILED = ("failed", "expired", "cancelled")
+
+
+@dataclass
+class Item:
+    index: int
+    prompt: str
+    cat: object = None
+    thread: ChatThread | None = None
+    messages: list = field(default_factory=list)
+    prompt_tokens: int = 0
+    text: str = ""
+    in_tokens: int = 0
+    out_tokens: int = 0
+    cached_tokens: int = 0
+    cache_hit: str = ""  # tier: exact / semantic / batch (پاسخ مشترک با آیتم دیگری از همین درخواست)
+    status: int = 200
+    error: str = ""
+    retry_after: int | None = None
+
+    def fail(self, error: str, status: int, retry_after=None):
+        self.error, self.status, self.retry_after = error, status, retry_after
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+
+def result(item: Item) -> dict:
+    if not item.ok:
+        out = {"index": item.index, "status": item.status, "error": item.error}
+        if item.retry_after is not None:
+            out["retry_after"] = item.retry_after
+        return out
+    return {
+        "index": item.index,
+        "status": 200,
+        "thread_id": str(item.thread.id),
+        "reply": item.text,
+        "usage": {
+            "prompt_tokens": item.in_tokens, "completion_tokens": item.out_tokens, "cached_tokens": item.cached_tokens,
+        },
+        "cached": bool(item.cache_hit),
+    }
+
+
+def _thread_ids(user, raw_items, items):
+    """Resolve given thread ids with one query; marks unknown and repeated ones as failed."""
+    wanted = {}
+    for raw, item in zip(raw_items, items):
+        thread_id = raw.get("thread_id")
+        if not thread_id or not item.ok:
+            continue
+        try:
+            thread_id = int(thread_id)
+        except (TypeError, ValueError):
+            item.fail("thread not found", 404)
+            continue
+        if thread_id in wanted:
+            # دو پیام هم‌زمان در یک thread تاریخچهٔ یکدیگر را نمی‌بینند
+            item.fail("thread_id repeated in batch", 400)
+            continue
+        wanted[thread_id] = item
+    threads = ChatThread.objects.filter(user=user, id__in=wanted).in_bulk()
+    for thread_id, item in wanted.items():
+        item.thread = threads.get(thread_id)
+        if item.thread is None:
+            item.fail("thread not found", 404)
+
+
+def prepare(user, data, *, single_model=False) -> list:
+    """Validate a bulk payload into Items with threads and prompts built; raises SendError for the whole request."""
+    raw_items = data.get("items")
+    if not isinstance(raw_items, list) or not raw_items:
+        raise SendError("items required", 400)
+    if len(raw_items) > settings.CHAT_BULK_MAX_ITEMS:
+        raise SendError(f"at most {settings.CHAT_BULK_MAX_ITEMS} items per request", 400)
+    raw_items = [raw if isinstance(raw, dict) else {} for raw in raw_items]
+
+    items = []
+    for index, raw in enumerate(raw_items):
+        item = Item(index, raw.get("prompt") or "")
+        alias = raw.get("model_alias") or data.get("model_alias")
+        if not item.prompt or not alias:
+            item.fail("prompt and model_alias required", 400)
+        else:
+            item.cat = catalog.get_enabled(alias)
+            if item.cat is None or item.cat.pricing_mode != "text":
+                item.fail("invalid model alias", 400)
+        items.append(item)
+    if single_model and len({item.cat.alias for item in items if item.ok}) > 1:
+        # Batch API هر فایل ورودی را به یک مدل محدود می‌کند
+        raise SendError("offline batches take a single model_alias", 400)
+
+    _thread_ids(user, raw_items, items)
+    for item in items:
+        if item.ok and item.thread is None:
+            item.thread = ChatThread(user=user, model_alias=item.cat.alias)  # ذخیره پس از بررسی کیف پول
+    for item in items:
+        if item.ok:
+            item.messages, item.prompt_tokens = build_messages_with_memory(item.thread, item.prompt, item.cat)
+    return items
+
+
+def _save_threads(items):
+    ChatThread.objects.bulk_create([item.thread for item in items if item.thread.pk is None])
+
+
+def _estimate(items, rate=1) -> int:
+    return math.ceil(sum(item.prompt_tokens + settings.WALLET_PREAUTH_OUTPUT_TOKENS for item in items) * Decimal(rate))
+
+
+def _complete(user, item: Item):
+    try:
+        ticket = admission.admit(user.id, item.cat.alias, item.prompt_tokens)
+    except admission.Rejected as e:
+        item.fail("too many requests", 429, retry_after=e.retry_after)
+        return
+    try:
+        resp, usage = openai_client.chat_completion(item.cat.model_name, item.messages, tools=None)
+    except Exception:
+        logger.warning("bulk item %s failed upstream", item.index, exc_info=True)
+        item.fail("upstream error", 502)
+        return
+    finally:
+        admission.release(ticket)
+    item.in_tokens, item.out_tokens, item.cached_tokens = openai_client.split_usage(usage)
+    item.text = reply_text(resp)
+
+
+def _fan_out(user, items):
+    """Upstream calls for ``items`` with bounded concurrency; equal cache keys share one call."""
+    groups, work = {}, []
+    for item in items:
+        key = response_cache.shared_key(item.cat, item.prompt, item.messages, user_id=user.id) or ("item", item.index)
+        if key not in groups:
+            work.append(item)
+        groups.setdefault(key, []).append(item)
+    if work:
+        # فراخوانی‌های OpenAI به ORM دست نمی‌زنند؛ نوشتن در دیتابیس بعداً در همین thread انجام می‌شود
+        with ThreadPoolExecutor(max_workers=min(settings.CHAT_BULK_CONCURRENCY, len(work))) as pool:
+            list(pool.map(lambda item: _complete(user, item), work))
+    for leader, *followers in groups.values():
+        for item in followers:
+            if not leader.ok:
+                item.fail(leader.error, leader.status, leader.retry_after)
+                continue
+            item.text, item.in_tokens, item.out_tokens = leader.text, leader.in_tokens, leader.out_tokens
+            item.cache_hit = "batch"
+        if leader.ok:
+            response_cache.store(leader.cat, leader.prompt, leader.messages, leader.text, leader.in_tokens,
+                                 leader.out_tokens, user_id=user.id)
+    metrics.incr("chat.bulk.upstream_calls", len(work))
+
+
+def _exchange(item: Item) -> dict:
+    return {
+        "cat": item.cat, "in_tokens": item.in_tokens, "out_tokens": item.out_tokens,
+        "cached_tokens": item.cached_tokens, "cache_hit": bool(item.cache_hit),
+    }
+
+
+def persist(user, items, *, hold=None, batch=False, meta=None):
+    """Store every exchange with one ``bulk_create`` and bill them with one debit; raises INSUFFICIENT_WALLET."""
+    with transaction.atomic():
+        _save_threads(items)
+        rows, pairs = [], {}
+        for item in items:
+            item_meta = {**(meta or {}), **({"response_cache": item.cache_hit} if item.cache_hit else {})}
+            pair = [
+                ChatMessage(thread=item.thread, role="user", content=item.prompt, tokens_in=item.in_tokens),
+                ChatMessage(thread=item.thread, role="assistant", content=item.text, tokens_out=item.out_tokens,
+                            meta=item_meta),
+            ]
+            rows.extend(pair)
+            pairs.setdefault(item.thread.id, []).extend(pair)
+        ChatMessage.objects.bulk_create(rows)
+        ChatThread.objects.filter(id__in=pairs).update(last_activity=timezone.now())
+        charge_wallet_for_exchanges(user, [_exchange(item) for item in items], hold=hold, batch=batch)
+        transaction.on_commit(lambda: [context_cache.append(thread_id, pair) for thread_id, pair in pairs.items()])
+
+
+def send(user, items) -> list:
+    """Answer and bill every valid item now; returns per-item results. Raises SendError(402) for the wallet."""
+    started = time.perf_counter()
+    todo = [item for item in items if item.ok]
+    if todo:
+        try:
+            hold = debit.preauthorize(user.id, _estimate(todo))
+        except ValueError:
+            raise SendError("insufficient wallet", 402)
+        try:
+            misses = []
+            for item in todo:
+                hit = response_cache.lookup(item.cat, item.prompt, item.messages, user_id=user.id)
+                if hit is None:
+                    misses.append(item)
+                    continue
+                item.text, item.in_tokens, item.out_tokens, item.cache_hit = hit.reply, hit.in_tokens, hit.out_tokens, hit.tier
+            _fan_out(user, misses)
+            done = [item for item in todo if item.ok]
+            if done:
+                persist(user, done, hold=hold)
+            else:
+                debit.release(hold)
+        except ValueError as e:
+            debit.release(hold)
+            if str(e) == "INSUFFICIENT_WALLET":
+                raise SendError("insufficient wallet", 402)
+            raise
+        except Exception:
+            debit.release(hold)
+            raise
+    for item in items:
+        metrics.incr("chat.bulk.items", mode="interactive", status=item.status)
+    metrics.observe("chat.bulk.seconds", time.perf_counter() - started, mode="interactive")
+    return [result(item) for item in items]
+
+
+def custom_id(index: int) -> str:
+    return f"item-{index}"
+
+
+def submit(user, items):
+    """Hand the valid items to the provider's Batch API; returns the ChatBatch or None when nothing was valid."""
+    todo = [item for item in items if item.ok]
+    if not todo:
+        return None
+    cat = todo[0].cat
+    # job تا ۲۴ ساعت طول می‌کشد و mirror ردیس پس از WALLET_PREAUTH_TTL منقضی می‌شود؛
+    # برآورد روی خود کیف پول رزرو می‌شود تا ارسال‌های دیگر آن را خرج نکنند
+    reserved = _estimate(todo, settings.CHAT_BATCH_BILLING_RATE) if settings.WALLET_PREAUTH != "off" else 0
+    if reserved and not debit.reserve(user.id, reserved):
+        raise SendError("insufficient wallet", 402)
+    try:
+        provider_batch_id, provider = openai_client.submit_batch(
+            cat.model_name, [(custom_id(item.index), item.messages) for item in todo]
+        )
+    except Exception:
+        debit.unreserve(user.id, reserved)
+        logger.warning("batch submission failed", exc_info=True)
+        raise SendError("upstream error", 502)
+    try:
+        with transaction.atomic():
+            _save_threads(todo)
+            batch = ChatBatch.objects.create(
+                user=user, model_alias=cat.alias, provider=provider, provider_batch_id=provider_batch_id,
+                items=[
+                    {"index": item.index, "thread_id": item.thread.id, "prompt": item.prompt,
+                     "prompt_tokens": item.prompt_tokens}
+                    for item in todo
+                ],
+                results=[result(item) for item in items if not item.ok],
+                reserved_tokens=reserved,
+            )
+    except Exception:
+        debit.unreserve(user.id, reserved)
+        raise
+    metrics.incr("chat.bulk.items", len(todo), mode="offline", status="submitted")
+    return batch
+
+
+def payload(batch: ChatBatch) -> dict:
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "model_alias": batch.model_alias,
+        "items": len(batch.items),
+        "results": sorted(batch.results, key=lambda r: r["index"]) if batch.status != "submitted" else
+        [r for r in batch.results if r["status"] != 200],
+        "error": batch.error or None,
+    }
+
+
+def _parse(item: Item, row):
+    response = (row or {}).get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") != 200 or not body.get("choices"):
+        item.fail("upstream error", 502)
+        return
+    usage = body.get("usage") or {}
+    item.text = (body["choices"][0].get("message") or {}).get("content") or ""
+    item.in_tokens = usage.get("prompt_tokens", 0) or 0
+    item.out_tokens = usage.get("completion_tokens", 0) or 0
+    item.cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+
+def _fail(batch: ChatBatch, error: str):
+    with transaction.atomic():
+        if not ChatBatch.objects.filter(id=batch.id, status="submitted").update(
+            status="failed", error=error[:500], finished_at=timezone.now()
+        ):
+            return
+        debit.unreserve(batch.user_id, batch.reserved_tokens)
+    metrics.incr("chat.bulk.batches", status="failed")
+
+
+def _affordable(batch: ChatBatch, done: list) -> list:
+    """The leading ``done`` items whose batch-rate cost fits what the wallet has left once this batch's reservation is back."""
+    left = Wallet.objects.filter(user_id=batch.user_id).values_list(
+        F("balance_tokens") - F("reserved_tokens") + batch.reserved_tokens, flat=True
+    ).first() or 0
+    kept = []
+    for item in done:
+        left -= exchange_tokens(_exchange(item), batch=True)
+        if left < 0:
+            break
+        kept.append(item)
+    return kept
+
+
+def _store(batch: ChatBatch, items: list, done: list) -> bool:
+    """Mark the batch completed, give its reservation back and bill ``done``; False if another collector won."""
+    with transaction.atomic():
+        results = batch.results + [result(item) for item in items]
+        if not ChatBatch.objects.filter(id=batch.id, status="submitted").update(
+            status="completed", results=results, finished_at=timezone.now()
+        ):
+            return False
+        debit.unreserve(batch.user_id, batch.reserved_tokens)
+        if done:
+            persist(batch.user, done, batch=True, meta={"chat_batch": batch.id})
+    return True
+
+
+def collect(batch_id: int) -> bool:
+    """Store and bill a finished Batch API job; False while the provider is still working on it."""
+    batch = ChatBatch.objects.select_related("user").filter(id=batch_id, status="submitted").first()
+    if batch is None:
+        return True
+    cat = catalog.get_enabled(batch.model_alias)
+    if cat is None:
+        _fail(batch, "model is no longer available")
+        return True
+    status, rows = openai_client.batch_results(cat.model_name, batch.provider, batch.provider_batch_id)
+    if status in FAILED:
+        _fail(batch, f"provider batch {status}")
+        return True
+    if rows is None:
+        return False
+
+    threads = ChatThread.objects.filter(user=batch.user, id__in=[i["thread_id"] for i in batch.items]).in_bulk()
+    items = []
+    for spec in batch.items:
+        item = Item(spec["index"], spec["prompt"], cat, threads.get(spec["thread_id"]), prompt_tokens=spec["prompt_tokens"])
+        if item.thread is None:
+            item.fail("thread not found", 404)
+        else:
+            _parse(item, rows.get(custom_id(item.index)))
+        items.append(item)
+    done = [item for item in items if item.ok]
+    try:
+        if not _store(batch, items, done):
+            return True  # collector دیگری زودتر رسید
+    except ValueError as e:
+        if str(e) != "INSUFFICIENT_WALLET":
+            raise
+        # هزینهٔ واقعی از رزرو بیشتر شد؛ پاسخ‌هایی که provider برایشان پول گرفته تا جای ممکن نگه داشته می‌شوند
+        kept = _affordable(batch, done)
+        for item in done[len(kept):]:
+            item.fail("insufficient wallet", 402)
+        if not _store(batch, items, kept):
+            return True
+    for item in items:
+        metrics.incr("chat.bulk.items", mode="offline", status=item.status)
+    metrics.incr("chat.bulk.batches", status="completed")
+    return True
+
+
+def poll() -> int:
+    """Collect up to CHAT_BATCH_POLL_LIMIT submitted jobs, oldest first; returns how many finished."""
+    finished = 0
+    ids = ChatBatch.objects.filter(status="submitted").order_by("id").values_list("id", flat=True)
+    for batch_id in list(ids[: settings.CHAT_BATCH_POLL_LIMIT]):
+        try:
+            finished += collect(batch_id)
+        except Exception:
+            logger.warning("collecting chat batch %s failed", batch_id, exc_info=True)
+    return finished
@@ -0,0 +1,77 @@
+"""
+Rolling prompt context per ChatThread.
+
+``chat:ctx:<thread_id>`` in the shared cache holds the latest summary and the
+last ``CHAT_HISTORY_MAX_MESSAGES`` messages (oldest first). Sends append the
+new pair after commit and the summariser replaces the summary, so a hot
+thread builds its prompt without touching the DB; a miss rebuilds the window
+from two indexed queries. Concurrent appends to the same thread may drop one
+message from the window until it expires — the DB stays authoritative.
+"""
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from .models import ChatMessage, MemorySummary
+
+logger = logging.getLogger(__name__)
+
+KEY = "chat:ctx:{}"
+TTL_SECONDS = 24 * 3600
+
+
+def _safe_get(key):
+    try:
+        return cache.get(key)
+    except Exception:
+        logger.warning("context cache read failed", exc_info=True)
+        return None
+
+
+def _safe_set(key, value):
+    try:
+        cache.set(key, value, TTL_SECONDS)
+    except Exception:
+        logger.warning("context cache write failed", exc_info=True)
+
+
+def _from_db(thread_id):
+    latest = MemorySummary.objects.filter(thread_id=thread_id).only("summary").order_by("-id").first()
+    recent = (
+        ChatMessage.objects.filter(thread_id=thread_id)
+        .only("id", "role", "content")
+        .order_by("-id")[: settings.CHAT_HISTORY_MAX_MESSAGES]
+    )
+    return {
+        "summary": latest.summary if latest else "",
+        "messages": [{"id": m.id, "role": m.role, "content": m.content} for m in reversed(list(recent))],
+    }
+
+
+def load(thread_id) -> dict:
+    ctx = _safe_get(KEY.format(thread_id))
+    if ctx is None:
+        ctx = _from_db(thread_id)
+        _safe_set(KEY.format(thread_id), ctx)
+    return ctx
+
+
+def append(thread_id, messages):
+    """Push freshly committed ChatMessage rows onto the cached window (no-op on miss)."""
+    key = KEY.format(thread_id)
+    ctx = _safe_get(key)
+    if ctx is None:
+        return
+    known = {m["id"] for m in ctx["messages"]}
+    ctx["messages"].extend(
+        {"id": m.id, "role": m.role, "content": m.content} for m in messages if m.id not in known
+    )
+    ctx["messages"] = sorted(ctx["messages"], key=lambda m: m["id"])[-settings.CHAT_HISTORY_MAX_MESSAGES:]
+    _safe_set(key, ctx)
+
+
+def set_summary(thread_id, summary: str):
+    key = KEY.format(thread_id)
+    ctx = _safe_get(key)
+    if ctx is not None:
+        ctx["summary"] = summary
+        _safe_set(key, ctx)
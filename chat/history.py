@@ -0,0 +1,129 @@
+"""
+Keyset pagination over a user's threads and a thread's messages.
+
+Pages never use OFFSET: the cursor carries the sort key of the last row
+returned (``(last_activity, id)`` for threads, ``id`` for messages) and the
+next page starts strictly after it, so page 10 000 costs the same index
+range scan as page 1. Listings load only the columns they return; message
+bodies come back as a ``HISTORY_PREVIEW_CHARS`` preview computed in the
+database unless ``full`` is asked for, and ``meta`` is never loaded.
+
+``etag`` gives a validator that can be checked with one indexed aggregate
+before the page itself is read.
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import Length, Substr
+from .models import ChatMessage, ChatThread
+
+THREAD_FIELDS = ("id", "title", "model_alias", "last_activity")
+MESSAGE_FIELDS = ("id", "role", "tokens_in", "tokens_out", "created_at")
+
+
+class BadCursor(ValueError):
+    pass
+
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise BadCursor("invalid cursor") from e
+
+
+def page_size(raw) -> int:
+    try:
+        size = int(raw) if raw not in (None, "") else settings.HISTORY_PAGE_SIZE
+    except (TypeError, ValueError):
+        raise BadCursor("limit must be an integer")
+    return max(1, min(size, settings.HISTORY_MAX_PAGE_SIZE))
+
+
+def etag(*parts) -> str:
+    return '"' + hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest() + '"'
+
+
+def threads_version(user_id: int):
+    """Changes whenever a thread is created, deleted or touched (index-only on Postgres)."""
+    row = ChatThread.objects.filter(user_id=user_id).aggregate(n=Count("id"), last=Max("last_activity"), top=Max("id"))
+    return row["n"], row["last"], row["top"]
+
+
+def messages_version(thread_id: int):
+    """Newest id for appends; count and oldest id for messages removed by archiving (analytics.archive)."""
+    row = ChatMessage.objects.filter(thread_id=thread_id).aggregate(n=Count("id"), low=Min("id"), top=Max("id"))
+    return row["n"], row["low"], row["top"]
+
+
+def page_threads(user_id: int, cursor: str | None, limit: int):
+    """``(threads, next_cursor)``, most recently active first."""
+    qs = ChatThread.objects.filter(user_id=user_id).only(*THREAD_FIELDS).order_by("-last_activity", "-id")
+    if cursor:
+        key = decode_cursor(cursor)
+        if not isinstance(key, list) or len(key) != 2:
+            raise BadCursor("invalid cursor")
+        try:
+            last_activity, last_id = datetime.fromisoformat(key[0]), int(key[1])
+        except (TypeError, ValueError) as e:
+            raise BadCursor("invalid cursor") from e
+        qs = qs.filter(Q(last_activity__lt=last_activity) | Q(last_activity=last_activity, id__lt=last_id))
+    rows = list(qs[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1].last_activity.isoformat(), rows[-1].id])
+    return rows, next_cursor
+
+
+def page_messages(thread_id: int, cursor: str | None, limit: int, *, newest_first: bool = True, full: bool = False):
+    """``(messages, next_cursor)``; newest first pages back through history, oldest first replays it."""
+    qs = ChatMessage.objects.filter(thread_id=thread_id).order_by("-id" if newest_first else "id")
+    if full:
+        qs = qs.only(*MESSAGE_FIELDS, "content")
+    else:
+        qs = qs.only(*MESSAGE_FIELDS).annotate(
+            preview=Substr("content", 1, settings.HISTORY_PREVIEW_CHARS), length=Length("content")
+        )
+    if cursor:
+        key = decode_cursor(cursor)
+        if not isinstance(key, int) or isinstance(key, bool):
+            raise BadCursor("invalid cursor")
+        qs = qs.filter(id__lt=key) if newest_first else qs.filter(id__gt=key)
+    rows = list(qs[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return rows, next_cursor
+
+
+def thread_item(thread: ChatThread) -> dict:
+    return {
+        "thread_id": str(thread.id),
+        "title": thread.title,
+        "model_alias": thread.model_alias,
+        "last_activity": thread.last_activity.isoformat(),
+    }
+
+
+def message_item(msg: ChatMessage) -> dict:
+    item = {
+        "id": msg.id,
+        "role": msg.role,
+        "tokens_in": msg.tokens_in,
+        "tokens_out": msg.tokens_out,
+        "created_at": msg.created_at.isoformat(),
+    }
+    if hasattr(msg, "preview"):
+        item.update(preview=msg.preview, truncated=msg.length > len(msg.preview))
+    else:
+        item["content"] = msg.content
+    return item
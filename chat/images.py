@@ -0,0 +1,185 @@
+"""
+Background image generation jobs.
+
+``POST /api/chat/images`` stores an ImageJob and queues
+``chat.tasks.generate_image_job``; the worker calls the image model, streams
+the bytes into MinIO (see ``chat.storage``) and bills the user through the
+catalog's image pricing. Clients poll ``GET /api/chat/images/<id>`` or keep
+it open as SSE (held only under the ASGI app). A user gets at most
+``IMAGE_JOBS_PER_USER`` unfinished jobs, and repeating a prompt within
+``IMAGE_JOB_DEDUP_SECONDS`` returns the earlier job instead of paying for a
+new image. A job still unfinished after ``IMAGE_JOB_STALE_SECONDS`` (task
+lost, worker killed) stops counting against the cap, and
+``chat.tasks.expire_stale_image_jobs`` fails it and gives back its hold.
+"""
+import asyncio
+import hashlib
+import itertools
+import logging
+import time
+import urllib.request
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from analytics import metrics
+from billing import catalog, debit
+from billing.pricing import charge_wallet_for_usage
+from . import openai_client, storage
+from .models import ImageJob
+from .response_cache import normalize
+from .streaming import sse
+from .uploads import EXTENSIONS
+
+ACTIVE = ("queued", "running")
+TERMINAL = ("succeeded", "failed")
+IMAGE_COUNTS = {"in": 1, "out": 1}  # یک prompt ورودی، یک تصویر خروجی
+# output_format پاسخ provider (gpt-image-*)؛ مدل‌هایی که آن را نمی‌فرستند از بایت‌های اول شناخته می‌شوند
+OUTPUT_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "jpg": "image/jpeg", "webp": "image/webp"}
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_hash(alias: str, prompt: str) -> str:
+    return hashlib.sha256(f"{alias}\n{normalize(prompt)}".encode()).hexdigest()
+
+
+def find_duplicate(user, digest: str):
+    """The user's unfinished or successful job for the same prompt, if recent enough."""
+    since = timezone.now() - timedelta(seconds=settings.IMAGE_JOB_DEDUP_SECONDS)
+    return (
+        ImageJob.objects.filter(user=user, prompt_hash=digest, created_at__gte=since)
+        .exclude(status="failed")
+        .order_by("-id")
+        .first()
+    )
+
+
+def _stale_before():
+    return timezone.now() - timedelta(seconds=settings.IMAGE_JOB_STALE_SECONDS)
+
+
+def active_count(user) -> int:
+    return ImageJob.objects.filter(user=user, status__in=ACTIVE, created_at__gte=_stale_before()).count()
+
+
+def payload(job) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "model_alias": job.model_alias,
+        "image_url": storage.object_url(job.object_name) if job.status == "succeeded" else None,
+        "error": job.error or None,
+    }
+
+
+def _download(url: str):
+    with urllib.request.urlopen(url, timeout=settings.OPENAI_TIMEOUT) as resp:
+        while chunk := resp.read(64 * 1024):
+            yield chunk
+
+
+def image_chunks(item):
+    """Byte chunks of one ``images.generate`` result, whether it came as base64 or as a URL."""
+    if getattr(item, "b64_json", None):
+        return storage.b64_chunks(item.b64_json)
+    return _download(item.url)
+
+
+def sniff_content_type(head: bytes) -> str:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"GIF8"):
+        return "image/gif"
+    return "image/png"
+
+
+def image_object(job_id: int, resp, chunks):
+    """``(object_name, content_type, chunks)`` for a result, typed from ``output_format`` or its first bytes."""
+    first = next(chunks, b"")
+    content_type = OUTPUT_FORMATS.get((getattr(resp, "output_format", None) or "").lower()) or sniff_content_type(first)
+    return f"generated/{job_id}{EXTENSIONS[content_type]}", content_type, itertools.chain([first], chunks)
+
+
+def _finish(job_id, status: str, **fields) -> bool:
+    # فقط از running؛ اگر sweeper زودتر job را منقضی کرده باشد چیزی عوض نمی‌شود
+    return bool(ImageJob.objects.filter(id=job_id, status="running").update(
+        status=status, finished_at=timezone.now(), **fields
+    ))
+
+
+def run(job_id: int):
+    """Generate, upload and bill one queued job; a redelivered job that is no longer queued is skipped."""
+    if not ImageJob.objects.filter(id=job_id, status="queued").update(status="running"):
+        return
+    job = ImageJob.objects.select_related("user").get(id=job_id)
+    hold = debit.Hold(job.user_id, job.reserved_tokens, reserved=True) if job.reserved_tokens else None
+    started = time.perf_counter()
+    cat = catalog.get_enabled(job.model_alias)
+    try:
+        if cat is None:
+            raise ValueError("model is no longer available")
+        resp = openai_client.generate_image(cat.model_name, job.prompt)
+        object_name, content_type, chunks = image_object(job.id, resp, iter(image_chunks(resp.data[0])))
+        size = storage.put_stream(object_name, chunks, content_type=content_type)
+    except Exception as e:
+        logger.warning("image job %s failed", job_id, exc_info=True)
+        if _finish(job_id, "failed", error=str(e)[:500]):
+            debit.release(hold)
+        metrics.incr("image_jobs.finished", model=job.model_alias, status="failed")
+        return
+
+    try:
+        with transaction.atomic():
+            if not _finish(job_id, "succeeded", object_name=object_name):
+                logger.warning("image job %s expired before it finished; not billed", job_id)
+                return
+            charge_wallet_for_usage(job.user, job.model_alias, 0, 0, cat=cat, image_counts=IMAGE_COUNTS, hold=hold)
+    except ValueError:
+        if _finish(job_id, "failed", error="insufficient wallet"):
+            debit.release(hold)
+        metrics.incr("image_jobs.finished", model=job.model_alias, status="failed")
+        return
+    metrics.incr("image_jobs.finished", model=job.model_alias, status="succeeded")
+    metrics.incr("image_jobs.bytes", size, model=job.model_alias)
+    metrics.observe("image_jobs.seconds", time.perf_counter() - started, model=job.model_alias)
+
+
+def expire_stale() -> int:
+    """Fail jobs unfinished past IMAGE_JOB_STALE_SECONDS and release their holds; returns how many."""
+    expired = 0
+    stale = ImageJob.objects.filter(status__in=ACTIVE, created_at__lt=_stale_before())
+    for job_id, user_id, reserved, alias in stale.values_list("id", "user_id", "reserved_tokens", "model_alias"):
+        if not ImageJob.objects.filter(id=job_id, status__in=ACTIVE).update(
+            status="failed", error="timed out", finished_at=timezone.now()
+        ):
+            continue  # worker همین حالا تمامش کرد
+        debit.release(debit.Hold(user_id, reserved, reserved=True) if reserved else None)
+        metrics.incr("image_jobs.finished", model=alias, status="expired")
+        expired += 1
+    return expired
+
+
+async def stream_status(job_id: int, user_id: int):
+    """SSE frames on every status change until the job finishes or IMAGE_JOB_STREAM_SECONDS pass."""
+    deadline = time.monotonic() + settings.IMAGE_JOB_STREAM_SECONDS
+    last = None
+    while True:
+        job = await ImageJob.objects.filter(id=job_id, user_id=user_id).afirst()
+        if job is None:  # در همین فاصله حذف شد
+            return
+        data = payload(job)
+        if data != last:
+            yield sse("status", data)
+            last = data
+        if job.status in TERMINAL or time.monotonic() > deadline:
+            return
+        await asyncio.sleep(settings.IMAGE_JOB_POLL_SECONDS)
+
+
+def status_snapshot(job):
+    """One SSE ``status`` frame; EventSource reconnects after IMAGE_JOB_POLL_SECONDS (WSGI fallback)."""
+    yield f"retry: {int(settings.IMAGE_JOB_POLL_SECONDS * 1000)}\n\n"
+    yield sse("status", payload(job))
@@ -0,0 +1,87 @@
+"""
+Pillow normalisation for uploaded images.
+
+Uploads are stored as sent, but nothing downstream needs a 12-megapixel
+phone photo: the vision models shrink anything larger than
+``IMAGE_VISION_MAX_SIDE`` on the long side / ``IMAGE_VISION_SHORT_SIDE`` on
+the short side themselves, so ``normalize`` does that once here and
+re-encodes to ``IMAGE_NORMALIZE_FORMAT`` with a ``IMAGE_THUMB_SIDE``
+thumbnail. JPEGs are decoded in draft mode (libjpeg's DCT scaling decodes at
+1/2, 1/4 or 1/8 size directly), EXIF orientation is applied and then all
+metadata (EXIF, GPS, ICC) is dropped.
+"""
+import io
+from dataclasses import dataclass
+from django.conf import settings
+from PIL import Image, ImageOps
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+EXTENSIONS = {"WEBP": ".webp", "JPEG": ".jpg"}
+
+
+@dataclass
+class Normalized:
+    display: bytes
+    thumbnail: bytes
+    width: int
+    height: int
+    content_type: str
+
+
+def extension() -> str:
+    return EXTENSIONS[settings.IMAGE_NORMALIZE_FORMAT]
+
+
+def target_size(width: int, height: int) -> tuple[int, int]:
+    """Size after the vision downscale; never upscales."""
+    scale = min(
+        1.0,
+        settings.IMAGE_VISION_MAX_SIDE / max(width, height),
+        settings.IMAGE_VISION_SHORT_SIDE / min(width, height),
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _flatten(img: Image.Image, fmt: str) -> Image.Image:
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+    if not has_alpha:
+        return img if img.mode == "RGB" else img.convert("RGB")
+    img = img.convert("RGBA")
+    if fmt == "WEBP":
+        return img
+    background = Image.new("RGB", img.size, (255, 255, 255))
+    background.paste(img, mask=img.getchannel("A"))
+    return background
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    img.info = {}  # exif/icc/xmp از info به فایل خروجی منتقل نشوند
+    out = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(out, "WEBP", quality=settings.IMAGE_NORMALIZE_QUALITY, method=4)
+    else:
+        img.save(out, "JPEG", quality=settings.IMAGE_NORMALIZE_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def normalize(data: bytes, *, draft: bool = True) -> Normalized:
+    """Downscaled display copy and thumbnail of ``data``; ValueError if it is not a usable image."""
+    fmt = settings.IMAGE_NORMALIZE_FORMAT
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.width * img.height > settings.IMAGE_MAX_PIXELS:
+                raise ValueError("image has too many pixels")
+            size = target_size(*img.size)
+            if draft and img.format == "JPEG":
+                img.draft("RGB", size)
+            img = ImageOps.exif_transpose(img)
+            if (img.width > img.height) != (size[0] > size[1]):
+                size = size[::-1]
+            img = _flatten(img, fmt)
+            img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            display = _encode(img, fmt)
+            thumb = img.copy()
+            thumb.thumbnail((settings.IMAGE_THUMB_SIDE, settings.IMAGE_THUMB_SIDE), Image.Resampling.LANCZOS)
+            return Normalized(display, _encode(thumb, fmt), img.width, img.height, CONTENT_TYPES[fmt])
+    except (OSError, Image.DecompressionBombError, SyntaxError) as e:
+        raise ValueError(f"not a decodable image: {e}") from e
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['thread', 'id'], name='chat_msg_thread_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='memorysummary',
+            index=models.Index(fields=['thread', 'id'], name='chat_summary_thread_id_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chatmessage_chat_msg_thread_id_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['last_activity'], name='chat_thread_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_imageupload_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['user', '-last_activity', '-id'], include=('title', 'model_alias'), name='chat_thread_user_activity_idx'),
+        ),
+    ]
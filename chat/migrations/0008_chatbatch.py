@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_thread_history_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_alias', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('submitted', 'submitted'), ('completed', 'completed'), ('failed', 'failed')], default='submitted', max_length=16)),
+                ('provider', models.CharField(blank=True, default='', max_length=64)),
+                ('provider_batch_id', models.CharField(blank=True, default='', max_length=128)),
+                ('items', models.JSONField(default=list)),
+                ('results', models.JSONField(blank=True, default=list)),
+                ('reserved_tokens', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='chat_batch_status_idx')],
+            },
+        ),
+    ]
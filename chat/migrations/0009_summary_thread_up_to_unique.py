@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:01
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def drop_duplicate_summaries(apps, schema_editor):
+    # اجراهای هم‌زمان قبلی ممکن است برای یک پیام دو خلاصه ثبت کرده باشند؛ جدیدترین می‌ماند
+    MemorySummary = apps.get_model('chat', 'MemorySummary')
+    keep = (
+        MemorySummary.objects.exclude(up_to_message_id=None)
+        .values('thread_id', 'up_to_message_id')
+        .annotate(keep=Max('id'))
+        .values_list('keep', flat=True)
+    )
+    MemorySummary.objects.exclude(up_to_message_id=None).exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_chatbatch'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_summaries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='memorysummary',
+            constraint=models.UniqueConstraint(fields=('thread', 'up_to_message_id'), name='chat_summary_thread_up_to_uniq'),
+        ),
+    ]
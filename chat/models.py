@@ -9,6 +9,17 @@ class ChatThread(models.Model):
     memory_summary = models.TextField(blank=True, default="")
     last_activity = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["last_activity"], name="chat_thread_activity_idx"),
+            # لیست thread‌های کاربر (chat.history)؛ روی Postgres بدون خواندن جدول
+            models.Index(
+                fields=["user", "-last_activity", "-id"],
+                include=["title", "model_alias"],
+                name="chat_thread_user_activity_idx",
+            ),
+        ]
+
 
 class ChatMessage(models.Model):
     thread = models.ForeignKey(ChatThread, on_delete=models.CASCADE)
@@ -19,6 +30,9 @@ class ChatMessage(models.Model):
     meta = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["thread", "id"], name="chat_msg_thread_id_idx")]
+
 
 class MemorySummary(models.Model):
     thread = models.ForeignKey(ChatThread, on_delete=models.CASCADE)
@@ -26,3 +40,95 @@ class MemorySummary(models.Model):
     up_to_message_id = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["thread", "id"], name="chat_summary_thread_id_idx")]
+        constraints = [
+            # اجرای دوباره یا هم‌زمان summariser خلاصهٔ تکراری برای همان پیام ثبت نمی‌کند
+            models.UniqueConstraint(fields=["thread", "up_to_message_id"], name="chat_summary_thread_up_to_uniq"),
+        ]
+
+
+
+IMAGE_JOB_STATUSES = (
+    ("queued", "queued"),
+    ("running", "running"),
+    ("succeeded", "succeeded"),
+    ("failed", "failed"),
+)
+
+
+class ImageJob(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    model_alias = models.CharField(max_length=64)
+    prompt = models.TextField()
+    # hash مدل + prompt نرمال‌شده برای یافتن درخواست‌های تکراری
+    prompt_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=IMAGE_JOB_STATUSES, default="queued")
+    object_name = models.CharField(max_length=255, blank=True, default="")
+    error = models.TextField(blank=True, default="")
+    # توکن‌هایی که هنگام صف‌کردن در Redis رزرو شد (WALLET_PREAUTH=redis)
+    reserved_tokens = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "status"], name="chat_imagejob_user_status_idx"),
+            models.Index(fields=["user", "prompt_hash"], name="chat_imagejob_user_hash_idx"),
+        ]
+
+
+IMAGE_UPLOAD_STATUSES = (("pending", "pending"), ("stored", "stored"))
+
+
+class ImageUpload(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # sha256 محتوا که کلاینت اعلام کرده؛ نام object از روی آن ساخته می‌شود
+    sha256 = models.CharField(max_length=64)
+    object_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    status = models.CharField(max_length=16, choices=IMAGE_UPLOAD_STATUSES, default="pending")
+    created_at = models.DateTimeField(auto_now_add=True)
+    confirmed_at = models.DateTimeField(null=True, blank=True)
+    # نسخه‌های نرمال‌شده (chat.imaging)؛ بر اساس hash واقعی محتوا بین کاربران مشترک‌اند
+    display_object = models.CharField(max_length=255, blank=True, default="")
+    thumb_object = models.CharField(max_length=255, blank=True, default="")
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=500, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "sha256"], name="chat_upload_user_sha_idx"),
+            models.Index(fields=["display_object"], name="chat_upload_display_idx"),
+        ]
+
+
+CHAT_BATCH_STATUSES = (
+    ("submitted", "submitted"),
+    ("completed", "completed"),
+    ("failed", "failed"),
+)
+
+
+class ChatBatch(models.Model):
+    """A bulk send handed to the provider's Batch API (``mode=offline``, see chat.bulk)."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    model_alias = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=CHAT_BATCH_STATUSES, default="submitted")
+    # شناسهٔ job در provider و نام provider تا poll به همان endpoint برود
+    provider = models.CharField(max_length=64, blank=True, default="")
+    provider_batch_id = models.CharField(max_length=128, blank=True, default="")
+    # [{"index", "thread_id", "prompt", "prompt_tokens"}]؛ پیام‌ها فقط در فایل provider هستند
+    items = models.JSONField(default=list)
+    results = models.JSONField(default=list, blank=True)
+    reserved_tokens = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "id"], name="chat_batch_status_idx")]
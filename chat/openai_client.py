@@ -1,22 +1,286 @@
+import asyncio
+import json
 import os
-from openai import OpenAI
+import threading
+import time
+import weakref
+from django.conf import settings
+from openai import (
+    OpenAI,
+    AsyncOpenAI,
+    DefaultHttpxClient,
+    DefaultAsyncHttpxClient,
+    DEFAULT_CONNECTION_LIMITS,
+)
+from analytics import metrics
+from . import router
 
+# httpx.Limits، بدون وابستگی مستقیم به نسخهٔ httpx که SDK با آن نصب شده
+_Limits = type(DEFAULT_CONNECTION_LIMITS)
 
-def get_client():
-    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_API_BASE"))
+BATCH_ENDPOINT = "/v1/chat/completions"
 
+# یک client بلندمدت برای هر (api_key, base_url) در هر پردازه
+_clients: dict = {}
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
 
-def chat_completion(model: str, messages: list, tools: list | None = None):
-    client = get_client()
-    resp = client.chat.completions.create(model=model, messages=messages, tools=tools or [])
+
+def _reset_after_fork():
+    # سوکت‌های به‌ارث‌رسیده از والد (gunicorn --preload / Celery prefork) نباید مشترک شوند
+    _clients.clear()
+    _async_clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _client_key(api_key=None, base_url=None, max_retries=None):
+    return api_key or os.getenv("OPENAI_API_KEY"), base_url or os.getenv("OPENAI_API_BASE"), max_retries
+
+
+def _limits():
+    return _Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def _connection_tracer(host: str):
+    """httpcore trace callback: records TCP+TLS setup time per request (0 on a reused connection)."""
+    started = {}
+    state = {"setup": 0.0, "reported": False}
+
+    def trace(name: str, info: dict):
+        if name.startswith("connection.") and name.endswith(".started"):
+            started[name[: -len(".started")]] = time.perf_counter()
+        elif name.startswith("connection.") and name.endswith(".complete"):
+            t0 = started.pop(name[: -len(".complete")], None)
+            if t0 is not None:
+                state["setup"] += time.perf_counter() - t0
+        elif name.endswith("send_request_headers.started") and not state["reported"]:
+            state["reported"] = True
+            reused = not state["setup"]
+            metrics.observe("openai.connection_setup_seconds", state["setup"], host=host)
+            metrics.incr("openai.requests", host=host, connection="reused" if reused else "new")
+
+    return trace
+
+
+def _attach_trace(request):
+    request.extensions["trace"] = _connection_tracer(request.url.host)
+
+
+async def _aattach_trace(request):
+    trace = _connection_tracer(request.url.host)
+
+    async def atrace(name, info):
+        trace(name, info)
+
+    request.extensions["trace"] = atrace
+
+
+def _retry_options(max_retries):
+    return {} if max_retries is None else {"max_retries": max_retries}
+
+
+def _build_client(api_key, base_url, max_retries=None):
+    http_client = DefaultHttpxClient(limits=_limits(), event_hooks={"request": [_attach_trace]})
+    return OpenAI(
+        api_key=api_key, base_url=base_url, timeout=settings.OPENAI_TIMEOUT, http_client=http_client,
+        **_retry_options(max_retries),
+    )
+
+
+def _build_async_client(api_key, base_url, max_retries=None):
+    http_client = DefaultAsyncHttpxClient(limits=_limits(), event_hooks={"request": [_aattach_trace]})
+    return AsyncOpenAI(
+        api_key=api_key, base_url=base_url, timeout=settings.OPENAI_TIMEOUT, http_client=http_client,
+        **_retry_options(max_retries),
+    )
+
+
+def get_client(api_key=None, base_url=None, max_retries=None):
+    key = _client_key(api_key, base_url, max_retries)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _build_client(*key)
+    return client
+
+
+def get_async_client(api_key=None, base_url=None, max_retries=None):
+    # pool اتصال‌های async به event loop گره خورده است؛ پس registry برای هر loop جداست
+    loop = asyncio.get_running_loop()
+    key = _client_key(api_key, base_url, max_retries)
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(key)
+        if client is None:
+            client = per_loop[key] = _build_async_client(*key)
+    return client
+
+
+def timeout_for(model: str) -> float:
+    return settings.OPENAI_MODEL_TIMEOUTS.get(model, settings.OPENAI_TIMEOUT)
+
+
+def usage_tokens(resp):
+    """``(prompt, completion, cached prompt)`` tokens of a response or of the final stream chunk."""
     usage = getattr(resp, "usage", None)
-    return resp, (
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (
         getattr(usage, "prompt_tokens", 0) or 0,
         getattr(usage, "completion_tokens", 0) or 0,
+        getattr(details, "cached_tokens", 0) or 0,
     )
 
 
-def generate_image(model: str, prompt: str):
+def split_usage(usage):
+    # stubها و نسخه‌های قدیمی فقط (in, out) برمی‌گردانند
+    in_tokens, out_tokens, *rest = usage
+    return in_tokens, out_tokens, (rest[0] if rest else 0)
+
+
+def record_prompt_cache(model: str, prompt_tokens: int, cached_tokens: int, seconds: float | None = None):
+    """Per-model provider prompt-cache counters, plus latency split by cache hit/miss."""
+    metrics.incr("openai.prompt_tokens", prompt_tokens, model=model)
+    metrics.incr("openai.cached_prompt_tokens", cached_tokens, model=model)
+    if seconds is not None:
+        metrics.observe(
+            "openai.completion_seconds", seconds, model=model, prompt_cache="hit" if cached_tokens else "miss"
+        )
+
+
+def prompt_cache_stats() -> dict:
+    out = {}
+    for c in metrics.snapshot()["counters"]:
+        if c["name"] in ("openai.prompt_tokens", "openai.cached_prompt_tokens"):
+            row = out.setdefault(c["labels"]["model"], {"prompt_tokens": 0, "cached_prompt_tokens": 0})
+            row[c["name"].split(".", 1)[1]] += c["value"]
+    for row in out.values():
+        row["hit_rate"] = row["cached_prompt_tokens"] / row["prompt_tokens"] if row["prompt_tokens"] else 0.0
+    return out
+
+
+def chat_completion(model: str, messages: list, tools: list | None = None):
+    """Returns ``(resp, (prompt_tokens, completion_tokens, cached_tokens))``; routed through chat.router."""
+
+    def call(endpoint):
+        client = get_client(endpoint.api_key, endpoint.base_url, endpoint.max_retries)
+        return client.chat.completions.create(
+            model=endpoint.model, messages=messages, tools=tools or [], timeout=timeout_for(model)
+        )
+
+    started = time.perf_counter()
+    resp = router.run(model, call)
+    usage = usage_tokens(resp)
+    record_prompt_cache(model, usage[0], usage[2], time.perf_counter() - started)
+    return resp, usage
+
+
+async def async_chat_completion(model: str, messages: list, tools: list | None = None):
+    async def call(endpoint):
+        client = get_async_client(endpoint.api_key, endpoint.base_url, endpoint.max_retries)
+        return await client.chat.completions.create(
+            model=endpoint.model, messages=messages, tools=tools or [], timeout=timeout_for(model)
+        )
+
+    started = time.perf_counter()
+    resp = await router.arun(model, call)
+    usage = usage_tokens(resp)
+    record_prompt_cache(model, usage[0], usage[2], time.perf_counter() - started)
+    return resp, usage
+
+
+def chat_completion_stream(model: str, messages: list):
+    """Open a streamed completion; the last chunk carries ``usage`` (and no choices)."""
+
+    def call(endpoint):
+        client = get_client(endpoint.api_key, endpoint.base_url, endpoint.max_retries)
+        return client.chat.completions.create(
+            model=endpoint.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout_for(model),
+        )
+
+    # failover فقط تا باز شدن stream؛ hedge روی stream دو پاسخ هم‌زمان می‌خواست
+    return router.run(model, call, hedge=False, timed=False)
+
+
+async def async_chat_completion_stream(model: str, messages: list):
+    """``chat_completion_stream`` on the async client: an async iterator of chunks."""
+
+    async def call(endpoint):
+        client = get_async_client(endpoint.api_key, endpoint.base_url, endpoint.max_retries)
+        return await client.chat.completions.create(
+            model=endpoint.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout_for(model),
+        )
+
+    return await router.arun(model, call, hedge=False, timed=False)
+
+
+def submit_batch(model: str, requests) -> tuple:
+    """
+    Upload ``(custom_id, messages)`` pairs as one Batch API job; returns ``(batch_id, provider)``.
+
+    Sent to the first endpoint the router would pick for ``model``; pass the
+    provider back to ``batch_results`` to poll the same one.
+    """
+    endpoint = router.endpoints_for(model)[0]
+    client = get_client(endpoint.api_key, endpoint.base_url, endpoint.max_retries)
+    lines = "\n".join(
+        json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {"model": endpoint.model, "messages": messages},
+        }, ensure_ascii=False)
+        for custom_id, messages in requests
+    )
+    upload = client.files.create(file=("batch.jsonl", lines.encode()), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=upload.id, endpoint=BATCH_ENDPOINT, completion_window=settings.CHAT_BATCH_COMPLETION_WINDOW
+    )
+    return batch.id, endpoint.provider
+
+
+def batch_results(model: str, provider: str, batch_id: str) -> tuple:
+    """``(status, rows)``: rows maps custom_id to its output line once the job is ``completed``, else None."""
+    endpoints = router.endpoints_for(model)
+    endpoint = next((e for e in endpoints if e.provider == provider), endpoints[0])
+    client = get_client(endpoint.api_key, endpoint.base_url, endpoint.max_retries)
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch.status, None
+    rows = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if line.strip():
+                row = json.loads(line)
+                rows[row["custom_id"]] = row
+    return batch.status, rows
+
+
+def embed(model: str, text: str):
+    """Return ``(vector, prompt_tokens)`` for one input."""
     client = get_client()
-    return client.images.generate(model=model, prompt=prompt)
+    resp = client.embeddings.create(model=model, input=text, timeout=timeout_for(model))
+    usage = getattr(resp, "usage", None)
+    return list(resp.data[0].embedding), getattr(usage, "prompt_tokens", 0) or 0
+
 
+def generate_image(model: str, prompt: str):
+    client = get_client()
+    return client.images.generate(model=model, prompt=prompt, timeout=timeout_for(model))
@@ -0,0 +1,60 @@
+"""
+Prompt building and the pieces shared by every send path (views, chat.bulk).
+"""
+from asgiref.sync import sync_to_async
+from billing.models import DEFAULT_CONTEXT_BUDGET_TOKENS
+from . import context_cache, tokens
+from .models import ChatThread
+
+SYSTEM_PROMPT = "You are a kind assistant for kids."
+
+
+def build_messages_with_memory(thread: ChatThread, user_msg: str, cat=None):
+    """
+    Pack the summary and as much recent history as fits ``cat.context_budget_tokens``.
+
+    The fixed system prompt goes first and the thread summary second, so every
+    request shares the longest possible prefix with the previous ones (provider
+    prompt caching matches on prefixes). History is taken newest-first and stops
+    at the first message that would overflow the budget; the prefix and the new
+    user message always go in. Returns ``(messages, prompt_tokens)``, a local
+    estimate used for pre-auth.
+    """
+    model = cat.model_name if cat else ""
+    budget = cat.context_budget_tokens if cat else DEFAULT_CONTEXT_BUDGET_TOKENS
+    # thread تازه‌ای که هنوز ذخیره نشده (chat.bulk) تاریخچه‌ای ندارد
+    ctx = context_cache.load(thread.id) if thread.pk else {"summary": "", "messages": []}
+    prefix = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if ctx["summary"]:
+        prefix.append({"role": "system", "content": f"Summary of the conversation so far:\n{ctx['summary']}"})
+    user = {"role": "user", "content": user_msg}
+    used = tokens.REPLY_PRIMER + tokens.message_tokens(user, model)
+    used += sum(tokens.message_tokens(m, model) for m in prefix)
+
+    history = []
+    for m in reversed(ctx["messages"]):
+        item = {"role": m["role"], "content": m["content"]}
+        cost = tokens.message_tokens(item, model)
+        if used + cost > budget:
+            break
+        history.append(item)
+        used += cost
+    return [*prefix, *reversed(history), user], used
+
+
+async def abuild_messages_with_memory(thread: ChatThread, user_msg: str, cat=None):
+    # ORM در thread جداگانه اجرا می‌شود تا event loop بلاک نشود
+    return await sync_to_async(build_messages_with_memory)(thread, user_msg, cat)
+
+
+class SendError(Exception):
+    def __init__(self, message: str, status: int, headers: dict | None = None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers
+
+
+def reply_text(resp) -> str:
+    choice = resp.choices[0]
+    return getattr(choice.message, "content", "") if hasattr(choice, "message") else ""
@@ -0,0 +1,243 @@
+"""
+Opt-in cache of assistant replies for repeated questions.
+
+Enabled per ``ModelCatalog.response_cache_enabled``. Entries are keyed by
+model alias, the normalised prompt and a fingerprint of the system messages
+(fixed prompt and thread summary) and the last
+``RESPONSE_CACHE_CONTEXT_MESSAGES`` history messages, so "why?" after two
+different answers does not collide. Only fresh threads share answers across
+users: once a thread has a summary or history, the fingerprint also carries
+the user id, since a reply may then depend on what that child said earlier.
+
+* exact tier: the shared Django cache (Redis in production), expiring after
+  ``RESPONSE_CACHE_TTL``; past that, Redis' maxmemory LRU policy evicts.
+* semantic tier (``RESPONSE_CACHE_SEMANTIC``): a per-process index of prompt
+  embeddings with the same TTL and LRU eviction at
+  ``RESPONSE_CACHE_VECTOR_MAX_ENTRIES``; a lookup hits at cosine similarity
+  ``>= RESPONSE_CACHE_SIMILARITY``. Embedding spend is counted per model in
+  ``response_cache.embedding_tokens`` and recorded as ``UsageRecord`` rows of
+  the summariser's system user, priced at
+  ``RESPONSE_CACHE_EMBEDDING_PER_MILLION_USD``; failed embeddings are not
+  memoised, so the next send retries.
+
+Hits are billed through ``charge_wallet_for_usage(..., cache_hit=True)``.
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from analytics import metrics, summarizer
+from billing.models import UsageRecord
+from billing.pricing import cost_usd
+from . import openai_client
+
+try:
+    import numpy
+except ImportError:  # اختیاری؛ بدون آن شباهت با حلقهٔ پایتونی حساب می‌شود
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+KEY = "chat:resp:{}"
+
+_TRANSLATE = str.maketrans({
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "أ": "ا", "إ": "ا", "آ": "ا",
+    "‌": " ", "ـ": None,  # نیم‌فاصله و کشیده
+    **{chr(c): None for c in range(0x064B, 0x0653)},  # اعراب
+    **{d: str(i) for i, d in enumerate("۰۱۲۳۴۵۶۷۸۹")},
+    **{d: str(i) for i, d in enumerate("٠١٢٣٤٥٦٧٨٩")},
+})
+_PUNCT = re.compile(r"[^\w\s]|_")
+
+
+def normalize(prompt: str) -> str:
+    """Case, punctuation, digits and Arabic/Persian letter variants folded; whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", prompt).translate(_TRANSLATE).casefold()
+    return " ".join(_PUNCT.sub(" ", text).split())
+
+
+def fingerprint(messages, user_id) -> str:
+    """Short hash of the system messages and recent history before the new user message, per user once personal."""
+    system = [m["content"] for m in messages[:-1] if m["role"] == "system"]
+    history = [m for m in messages[:-1] if m["role"] != "system"]
+    n = settings.RESPONSE_CACHE_CONTEXT_MESSAGES
+    parts = [f"system:{content}" for content in system]
+    parts += [f"{m['role']}:{normalize(m['content'])}" for m in (history[-n:] if n > 0 else [])]
+    # اولین پیام system همان prompt ثابت است؛ خلاصه یا تاریخچه یعنی پاسخ به این کاربر وابسته است
+    if len(system) > 1 or history:
+        parts.append(f"user:{user_id}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def cache_key(alias: str, norm: str, fp: str) -> str:
+    return KEY.format(hashlib.sha256(f"{alias}|{norm}|{fp}".encode()).hexdigest())
+
+
+@dataclass
+class Hit:
+    reply: str
+    in_tokens: int
+    out_tokens: int
+    tier: str
+
+
+class VectorIndex:
+    """Process-local embedding index with TTL and LRU eviction."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = OrderedDict()  # key -> (alias, fp, unit vector, entry, expires_at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key, alias, fp, vector, entry, ttl):
+        with self._lock:
+            self._items[key] = (alias, fp, _unit(vector), entry, time.monotonic() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def search(self, alias, fp, vector, threshold):
+        query = _unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, item in self._items.items() if item[4] <= now]
+            for k in expired:
+                del self._items[k]
+            candidates = [(k, item) for k, item in self._items.items() if item[0] == alias and item[1] == fp]
+            if not candidates:
+                return None
+            scores = _dot([item[2] for _, item in candidates], query)
+            best = max(range(len(candidates)), key=scores.__getitem__)
+            if scores[best] < threshold:
+                return None
+            key, item = candidates[best]
+            self._items.move_to_end(key)
+            return item[3]
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def _dot(vectors, query):
+    if numpy is not None:
+        return (numpy.asarray(vectors) @ numpy.asarray(query)).tolist()
+    return [sum(a * b for a, b in zip(v, query)) for v in vectors]
+
+
+_index = VectorIndex(settings.RESPONSE_CACHE_VECTOR_MAX_ENTRIES)
+
+
+def reset_index():
+    global _index
+    _index = VectorIndex(settings.RESPONSE_CACHE_VECTOR_MAX_ENTRIES)
+    _embed.cache_clear()
+
+
+@lru_cache(maxsize=1024)
+def _embed(norm: str):
+    # lookup و store در یک درخواست، یک بار embedding می‌گیرند؛ خطا cache نمی‌شود چون بالا می‌رود
+    model = settings.RESPONSE_CACHE_EMBEDDING_MODEL
+    vector, prompt_tokens = openai_client.embed(model, norm)
+    metrics.incr("response_cache.embedding_tokens", prompt_tokens, model=model)
+    if prompt_tokens:
+        try:
+            UsageRecord.objects.create(
+                user=summarizer.system_user(), model_alias=model, input_tokens=prompt_tokens,
+                cost_usd=(Decimal(prompt_tokens) / Decimal(1_000_000)
+                          * Decimal(settings.RESPONSE_CACHE_EMBEDDING_PER_MILLION_USD)).quantize(Decimal("0.0001")),
+            )
+        except Exception:
+            logger.warning("recording embedding usage failed", exc_info=True)
+    return tuple(vector)
+
+
+def _embedding(norm: str):
+    try:
+        return _embed(norm)
+    except Exception:
+        logger.warning("embedding for response cache failed", exc_info=True)
+        return None
+
+
+def _enabled(cat) -> bool:
+    return bool(getattr(cat, "response_cache_enabled", False)) and cat.pricing_mode == "text"
+
+
+def shared_key(cat, prompt: str, messages, *, user_id) -> str | None:
+    """Exact-tier key when caching is on for ``cat``: sends with equal keys may share one reply."""
+    if not _enabled(cat):
+        return None
+    return cache_key(cat.alias, normalize(prompt), fingerprint(messages, user_id))
+
+
+def lookup(cat, prompt: str, messages, *, user_id) -> Hit | None:
+    if not _enabled(cat):
+        return None
+    norm, fp = normalize(prompt), fingerprint(messages, user_id)
+    tier = "exact"
+    try:
+        entry = cache.get(cache_key(cat.alias, norm, fp))
+    except Exception:
+        logger.warning("response cache read failed", exc_info=True)
+        entry = None
+    if entry is None and settings.RESPONSE_CACHE_SEMANTIC:
+        tier = "semantic"
+        vector = _embedding(norm)
+        if vector is not None:
+            entry = _index.search(cat.alias, fp, vector, settings.RESPONSE_CACHE_SIMILARITY)
+    if entry is None:
+        metrics.incr("response_cache.requests", model=cat.alias, result="miss")
+        return None
+    metrics.incr("response_cache.requests", model=cat.alias, result=tier)
+    metrics.incr("response_cache.saved_usd", float(cost_usd(cat.alias, entry["in"], entry["out"], cat=cat)),
+                 model=cat.alias)
+    return Hit(reply=entry["reply"], in_tokens=entry["in"], out_tokens=entry["out"], tier=tier)
+
+
+def store(cat, prompt: str, messages, reply: str, in_tokens: int, out_tokens: int, *, user_id):
+    if not _enabled(cat) or not reply:
+        return
+    norm, fp = normalize(prompt), fingerprint(messages, user_id)
+    key = cache_key(cat.alias, norm, fp)
+    entry = {"reply": reply, "in": in_tokens, "out": out_tokens}
+    try:
+        cache.set(key, entry, settings.RESPONSE_CACHE_TTL)
+    except Exception:
+        logger.warning("response cache write failed", exc_info=True)
+    if settings.RESPONSE_CACHE_SEMANTIC:
+        vector = _embedding(norm)
+        if vector is not None:
+            _index.add(key, cat.alias, fp, vector, entry, settings.RESPONSE_CACHE_TTL)
+
+
+def stats() -> dict:
+    """Per-model hits, misses, hit ratio and saved USD from this process' counters."""
+    out = {}
+    for c in metrics.snapshot()["counters"]:
+        if not c["name"].startswith("response_cache."):
+            continue
+        row = out.setdefault(c["labels"]["model"], {"hits": 0, "misses": 0, "saved_usd": 0.0})
+        if c["name"] == "response_cache.saved_usd":
+            row["saved_usd"] += c["value"]
+        elif c["labels"].get("result") == "miss":
+            row["misses"] += c["value"]
+        else:
+            row["hits"] += c["value"]
+    for row in out.values():
+        total = row["hits"] + row["misses"]
+        row["hit_ratio"] = row["hits"] / total if total else 0.0
+    return out
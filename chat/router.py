@@ -0,0 +1,283 @@
+"""
+Latency-aware routing of LLM calls over several OpenAI-compatible endpoints.
+
+``LLM_PROVIDERS`` names the endpoints and ``LLM_ROUTES`` maps an upstream
+model name (``ModelCatalog.model_name``) to the endpoints that serve it, in
+preference order. Each endpoint keeps a rolling window of latencies and
+outcomes in this process:
+
+* a call goes to the healthy endpoint with the lowest p50 (endpoints still
+  below ``LLM_ROUTER_MIN_SAMPLES`` are tried first so they get measured) and
+  fails over to the next one on connection errors, timeouts, 429 and 5xx;
+* an endpoint whose error rate passes ``LLM_ROUTER_MAX_ERROR_RATE`` is ejected
+  for ``LLM_ROUTER_EJECT_SECONDS`` and then starts over with a clean window;
+* with ``LLM_HEDGE`` a second endpoint is started when the first has not
+  answered within its p95 (at least ``LLM_HEDGE_MIN_DELAY``); the first
+  answer wins and the other call is cancelled. Async calls are really
+  cancelled; a sync loser cannot be interrupted mid-read, so it finishes in
+  the hedge thread pool and only its result is dropped.
+
+Models without a route use the default ``OPENAI_API_BASE`` client as before.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from analytics import metrics
+
+# خطاهایی که تلاش دوباره روی endpoint دیگر را توجیه می‌کنند (APITimeoutError زیرکلاس APIConnectionError است)
+RETRYABLE = (APIConnectionError, InternalServerError, RateLimitError)
+
+_lock = threading.Lock()
+_endpoints: dict = {}
+_executor = None
+
+
+class Endpoint:
+    def __init__(self, provider: str, base_url, api_key, model: str):
+        self.provider = provider
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        # روی endpointهای route‌شده خود router به endpoint بعدی می‌رود، نه retry داخلی SDK
+        self.max_retries = None if provider == "default" else 0
+        self.latencies = deque(maxlen=settings.LLM_ROUTER_WINDOW)
+        self.outcomes = deque(maxlen=settings.LLM_ROUTER_WINDOW)
+        self.ejected_until = 0.0
+
+    def quantile(self, q: float):
+        with _lock:
+            recent = list(self.latencies)
+        return metrics.quantile(recent, q) if len(recent) >= settings.LLM_ROUTER_MIN_SAMPLES else None
+
+    def error_rate(self) -> float:
+        with _lock:
+            outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def observe(self, seconds: float):
+        with _lock:
+            self.latencies.append(seconds)
+        metrics.observe("llm.endpoint_seconds", seconds, provider=self.provider, model=self.model)
+
+    def succeeded(self, seconds: float | None = None):
+        if seconds is not None:
+            self.observe(seconds)
+        with _lock:
+            self.outcomes.append(True)
+
+    def failed(self):
+        metrics.incr("llm.endpoint_errors", provider=self.provider, model=self.model)
+        with _lock:
+            self.outcomes.append(False)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) < settings.LLM_ROUTER_MIN_SAMPLES or \
+                    failures / len(self.outcomes) <= settings.LLM_ROUTER_MAX_ERROR_RATE:
+                return
+            # پس از پایان ejection با پنجرهٔ تمیز دوباره سنجیده می‌شود
+            self.ejected_until = time.monotonic() + settings.LLM_ROUTER_EJECT_SECONDS
+            self.outcomes.clear()
+        metrics.incr("llm.endpoint_ejected", provider=self.provider, model=self.model)
+
+
+def _reset_after_fork():
+    global _executor
+    _executor = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _endpoint(provider: str, model: str) -> Endpoint:
+    key = (provider, model)
+    endpoint = _endpoints.get(key)
+    if endpoint is None:
+        with _lock:
+            endpoint = _endpoints.get(key)
+            if endpoint is None:
+                if provider == "default":
+                    base_url = api_key = None  # همان OPENAI_API_BASE / OPENAI_API_KEY
+                else:
+                    base_url = settings.LLM_PROVIDERS[provider]
+                    api_key = os.getenv(f"LLM_PROVIDER_{provider.upper()}_API_KEY") or os.getenv("OPENAI_API_KEY")
+                endpoint = _endpoints[key] = Endpoint(provider, base_url, api_key, model)
+    return endpoint
+
+
+def endpoints_for(model: str) -> list:
+    """Endpoints serving ``model`` in the order they should be tried."""
+    targets = settings.LLM_ROUTES.get(model)
+    if not targets:
+        return [_endpoint("default", model)]
+    endpoints = []
+    for target in targets:
+        provider, _, upstream_model = target.partition(":")
+        endpoints.append(_endpoint(provider, upstream_model or model))
+
+    def rank(item):
+        index, endpoint = item
+        if not endpoint.healthy():
+            return (1, endpoint.ejected_until, 0.0, index)
+        p50 = endpoint.quantile(0.50)
+        return (0, 0.0, 0.0 if p50 is None else p50, index)
+
+    return [endpoint for _, endpoint in sorted(enumerate(endpoints), key=rank)]
+
+
+def hedge_delay(endpoint: Endpoint):
+    """Seconds to wait on ``endpoint`` before hedging, or None while its p95 is unknown."""
+    p95 = endpoint.quantile(0.95)
+    return None if p95 is None else max(p95, settings.LLM_HEDGE_MIN_DELAY)
+
+
+def _timed(endpoint, call, timed=True):
+    started = time.perf_counter()
+    try:
+        result = call(endpoint)
+    except RETRYABLE:
+        endpoint.failed()
+        raise
+    endpoint.succeeded(time.perf_counter() - started if timed else None)
+    return result
+
+
+def _hedge_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.LLM_HEDGE_THREADS, thread_name_prefix="llm-hedge")
+    return _executor
+
+
+def _hedged(first, second, call):
+    """Race ``second`` against ``first`` once ``first`` is slower than its p95 (or has failed)."""
+    pool = _hedge_executor()
+    pending = {pool.submit(_timed, first, call)}
+    done, _ = wait(pending, timeout=hedge_delay(first))
+    if not done:
+        metrics.incr("llm.router.hedged", provider=second.provider, model=second.model)
+    if not done or done.pop().exception() is not None:
+        pending.add(pool.submit(_timed, second, call))
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+            if not isinstance(error, RETRYABLE):
+                raise error
+    raise error
+
+
+def run(model: str, call, hedge: bool = True, timed: bool = True):
+    """
+    Call ``call(endpoint)`` on the best endpoint for ``model``, failing over on RETRYABLE errors.
+
+    ``timed=False`` records only the outcome (for streams, where the call
+    returns at the first byte and its duration says little about the endpoint).
+    """
+    endpoints = endpoints_for(model)
+    error = None
+    i = 0
+    while i < len(endpoints):
+        endpoint = endpoints[i]
+        hedged = hedge and settings.LLM_HEDGE and i + 1 < len(endpoints) and hedge_delay(endpoint) is not None
+        try:
+            if hedged:
+                return _hedged(endpoint, endpoints[i + 1], call)
+            return _timed(endpoint, call, timed)
+        except RETRYABLE as e:
+            error = e
+            metrics.incr("llm.router.failover", provider=endpoint.provider, model=endpoint.model)
+        i += 2 if hedged else 1
+    raise error
+
+
+async def _atimed(endpoint, acall, timed=True):
+    started = time.perf_counter()
+    try:
+        result = await acall(endpoint)
+    except RETRYABLE:
+        endpoint.failed()
+        raise
+    except asyncio.CancelledError:
+        # بازندهٔ hedge؛ مدت انتظار کران پایینِ latency واقعی است
+        endpoint.observe(time.perf_counter() - started)
+        raise
+    endpoint.succeeded(time.perf_counter() - started if timed else None)
+    return result
+
+
+async def _ahedged(first, second, acall):
+    pending = {asyncio.ensure_future(_atimed(first, acall))}
+    done, _ = await asyncio.wait(pending, timeout=hedge_delay(first))
+    if not done:
+        metrics.incr("llm.router.hedged", provider=second.provider, model=second.model)
+    if not done or next(iter(done)).exception() is not None:
+        pending.add(asyncio.ensure_future(_atimed(second, acall)))
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    return task.result()
+                if not isinstance(error, RETRYABLE):
+                    raise error
+    finally:
+        for task in pending:
+            task.cancel()
+    raise error
+
+
+async def arun(model: str, acall, hedge: bool = True, timed: bool = True):
+    """Async ``run``: the hedging loser's request is cancelled and its connection closed."""
+    endpoints = endpoints_for(model)
+    error = None
+    i = 0
+    while i < len(endpoints):
+        endpoint = endpoints[i]
+        hedged = hedge and settings.LLM_HEDGE and i + 1 < len(endpoints) and hedge_delay(endpoint) is not None
+        try:
+            if hedged:
+                return await _ahedged(endpoint, endpoints[i + 1], acall)
+            return await _atimed(endpoint, acall, timed)
+        except RETRYABLE as e:
+            error = e
+            metrics.incr("llm.router.failover", provider=endpoint.provider, model=endpoint.model)
+        i += 2 if hedged else 1
+    raise error
+
+
+def stats() -> list:
+    """Per-endpoint rolling latency, error rate and health, for /metrics."""
+    with _lock:
+        endpoints = list(_endpoints.values())
+    return [
+        {
+            "provider": e.provider,
+            "model": e.model,
+            "p50": e.quantile(0.50),
+            "p95": e.quantile(0.95),
+            "error_rate": e.error_rate(),
+            "healthy": e.healthy(),
+        }
+        for e in endpoints
+    ]
+
+
+def reset():
+    with _lock:
+        _endpoints.clear()
@@ -0,0 +1,184 @@
+"""
+MinIO access for the chat app.
+
+One client per process, built on first use over a keep-alive urllib3 pool of
+``MINIO_MAX_CONNECTIONS``. The bucket is checked (and created) once per
+process rather than before every write; if it disappears later the next
+write bootstraps it again. Uploads never read a whole file into memory:
+``put_file`` hands MinIO a file object of known size (one PUT up to
+``MINIO_PART_SIZE``, a multipart upload above it) and ``put_stream`` uploads
+any iterator of byte chunks with an unknown total length, holding at most one
+part at a time.
+"""
+import base64
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import certifi
+import urllib3
+from django.conf import settings
+from minio import Minio
+from minio.datatypes import PostPolicy
+from minio.error import S3Error
+
+_lock = threading.Lock()
+_state = {"client": None, "bucket_ready": False}
+
+
+def _reset_after_fork():
+    # سوکت‌های pool والد نباید در پردازهٔ فرزند استفاده شوند
+    _state["client"] = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _http_pool():
+    return urllib3.PoolManager(
+        maxsize=settings.MINIO_MAX_CONNECTIONS,
+        block=False,
+        timeout=urllib3.Timeout(connect=settings.MINIO_CONNECT_TIMEOUT, read=settings.MINIO_READ_TIMEOUT),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    )
+
+
+def get_client() -> Minio:
+    if _state["client"] is None:
+        with _lock:
+            if _state["client"] is None:
+                _state["client"] = Minio(
+                    settings.MINIO_ENDPOINT.replace("http://", "").replace("https://", ""),
+                    access_key=settings.MINIO_ACCESS_KEY,
+                    secret_key=settings.MINIO_SECRET_KEY,
+                    secure=settings.MINIO_ENDPOINT.startswith("https://"),
+                    # با region مشخص، client درخواست GetBucketLocation نمی‌فرستد
+                    region=settings.MINIO_REGION or None,
+                    http_client=_http_pool(),
+                )
+    return _state["client"]
+
+
+def ensure_bucket():
+    if _state["bucket_ready"]:
+        return
+    client = get_client()
+    with _lock:
+        if _state["bucket_ready"]:
+            return
+        if not client.bucket_exists(settings.MINIO_BUCKET):
+            client.make_bucket(settings.MINIO_BUCKET)
+        _state["bucket_ready"] = True
+
+
+def _put(object_name: str, data, length: int, content_type: str):
+    ensure_bucket()
+    try:
+        return get_client().put_object(
+            settings.MINIO_BUCKET, object_name, data, length=length,
+            part_size=settings.MINIO_PART_SIZE, content_type=content_type,
+        )
+    except S3Error as e:
+        if e.code != "NoSuchBucket":
+            raise
+        # bucket بعد از bootstrap حذف شده است؛ دفعهٔ بعد دوباره ساخته می‌شود
+        _state["bucket_ready"] = False
+        if not hasattr(data, "seek"):
+            raise
+        ensure_bucket()
+        data.seek(0)
+        return get_client().put_object(
+            settings.MINIO_BUCKET, object_name, data, length=length,
+            part_size=settings.MINIO_PART_SIZE, content_type=content_type,
+        )
+
+
+def object_url(object_name: str) -> str:
+    return f"{settings.MINIO_ENDPOINT}/{settings.MINIO_BUCKET}/{object_name}"
+
+
+def stat(object_name: str):
+    """HEAD the object; None when it does not exist."""
+    try:
+        return get_client().stat_object(settings.MINIO_BUCKET, object_name)
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject", "ResourceNotFound", "NoSuchBucket"):
+            return None
+        raise
+
+
+def read(object_name: str) -> bytes:
+    """Whole object body; only for objects already bounded in size (e.g. uploads)."""
+    resp = get_client().get_object(settings.MINIO_BUCKET, object_name)
+    try:
+        return resp.read()
+    finally:
+        resp.close()
+        resp.release_conn()
+
+
+def remove(object_name: str):
+    get_client().remove_object(settings.MINIO_BUCKET, object_name)
+
+
+def presigned_post(object_name: str, content_type: str, size: int, expires_seconds: int) -> dict:
+    """
+    Form for a browser/app POST straight to MinIO.
+
+    The signed policy pins the key, the Content-Type and the exact byte size,
+    so the client cannot put anything else there. The policy signature does not
+    cover the host, so the URL may point at ``MINIO_PUBLIC_ENDPOINT``.
+    """
+    ensure_bucket()
+    policy = PostPolicy(settings.MINIO_BUCKET, datetime.now(timezone.utc) + timedelta(seconds=expires_seconds))
+    policy.add_equals_condition("key", object_name)
+    policy.add_equals_condition("Content-Type", content_type)
+    policy.add_content_length_range_condition(size, size)
+    fields = get_client().presigned_post_policy(policy)
+    fields.update({"key": object_name, "Content-Type": content_type})
+    endpoint = settings.MINIO_PUBLIC_ENDPOINT or settings.MINIO_ENDPOINT
+    return {"url": f"{endpoint}/{settings.MINIO_BUCKET}", "fields": fields}
+
+
+class ChunkReader:
+    """``read(n)`` over an iterator of byte chunks, for APIs that want a file object."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size < 0 or size > len(self._buf):
+            size = len(self._buf)
+        out = bytes(self._buf[:size])
+        del self._buf[:size]
+        self.bytes_read += len(out)
+        return out
+
+
+def b64_chunks(data: str, chunk_chars: int = 64 * 1024):
+    """Decode base64 text piecewise (``chunk_chars`` is kept a multiple of 4)."""
+    step = chunk_chars - chunk_chars % 4
+    for i in range(0, len(data), step):
+        yield base64.b64decode(data[i:i + step])
+
+
+def put_file(object_name: str, file, length: int, content_type: str = "application/octet-stream"):
+    """Upload an open file object (e.g. an ``UploadedFile``) of ``length`` bytes, reading it part by part."""
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return _put(object_name, file, length, content_type)
+
+
+def put_stream(object_name: str, chunks, content_type: str = "application/octet-stream") -> int:
+    """Upload an iterator of byte chunks as ``object_name``; returns the number of bytes written."""
+    reader = ChunkReader(chunks)
+    _put(object_name, reader, -1, content_type)
+    return reader.bytes_read
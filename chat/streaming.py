@@ -0,0 +1,48 @@
+import json
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+def sse(event: str, data: dict) -> str:
+    """Format one server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def wants_stream(request, data=None) -> bool:
+    flag = (request.data if data is None else data).get("stream")
+    if isinstance(flag, str):
+        flag = flag.lower() in ("1", "true", "yes")
+    return bool(flag) or "text/event-stream" in request.META.get("HTTP_ACCEPT", "")
+
+
+def event_stream(frames):
+    response = StreamingHttpResponse(frames, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def authenticate(request):
+    """DRF authentication (JWT/Session plus CSRF) for plain Django views; returns ``(user, data)``."""
+    drf_request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    if not drf_request.user or not drf_request.user.is_authenticated:
+        raise NotAuthenticated()
+    return drf_request.user, drf_request.data
+
+
+def can_hold(request) -> bool:
+    """
+    True when the request came in through the ASGI app.
+
+    Streams and long polls wait on the event loop there. Under WSGI a held
+    response occupies a worker for its whole life, and Django buffers async
+    iterators to the end, so callers answer at once instead.
+    """
+    return isinstance(request, ASGIRequest)
@@ -0,0 +1,32 @@
+from celery import shared_task
+from . import bulk, images, uploads
+
+
+@shared_task
+def generate_image_job(job_id: int):
+    """Run one queued ImageJob (see chat.images)."""
+    images.run(job_id)
+
+
+@shared_task
+def expire_stale_image_jobs():
+    """Fail image jobs whose task was lost and give back their holds (see chat.images)."""
+    return images.expire_stale()
+
+
+@shared_task
+def normalize_image_upload(upload_id: int):
+    """Write the display copy and thumbnail of a stored ImageUpload (see chat.uploads)."""
+    uploads.process(upload_id)
+
+
+@shared_task
+def expire_pending_uploads():
+    """Drop presigned uploads that were never confirmed (see chat.uploads)."""
+    return uploads.expire_pending()
+
+
+@shared_task
+def poll_chat_batches():
+    """Store and bill finished Batch API jobs (see chat.bulk)."""
+    return bulk.poll()
@@ -0,0 +1,75 @@
+"""
+Local token counting for prompt budgeting and wallet pre-authorisation.
+
+Uses ``tiktoken`` with one cached encoder per model family. When tiktoken
+(or its BPE file, which it downloads on first use) is unavailable we fall
+back to a character-class estimate that is deliberately on the high side
+for Persian text, so budgets and pre-auth holds err towards over-counting.
+"""
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # اختیاری؛ بدون آن تخمین کاراکتری استفاده می‌شود
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# پیشوند نام مدل ← encoding؛ اولین تطابق برنده است
+FAMILIES = (
+    ("gpt-4o", "o200k_base"),
+    ("chatgpt-4o", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("gpt-4.5", "o200k_base"),
+    ("gpt-5", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+)
+DEFAULT_ENCODING = "o200k_base"
+
+MESSAGE_OVERHEAD = 4  # role و جداکننده‌های هر پیام
+REPLY_PRIMER = 3  # توکن‌های شروع پاسخ assistant
+
+
+def encoding_name(model: str) -> str:
+    for prefix, name in FAMILIES:
+        if (model or "").startswith(prefix):
+            return name
+    return DEFAULT_ENCODING
+
+
+@lru_cache(maxsize=None)
+def _encoder(name: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning("tiktoken encoding %s unavailable (%s); using estimate", name, e)
+        return None
+
+
+def _estimate(text: str) -> int:
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    if not text:
+        return 0
+    enc = _encoder(encoding_name(model))
+    if enc is None:
+        return _estimate(text)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: dict, model: str = "") -> int:
+    return MESSAGE_OVERHEAD + count_tokens(message.get("content") or "", model)
+
+
+def count_message_tokens(messages: list, model: str = "") -> int:
+    return REPLY_PRIMER + sum(message_tokens(m, model) for m in messages)
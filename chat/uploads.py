@@ -0,0 +1,227 @@
+"""
+Direct-to-MinIO image uploads.
+
+``POST /api/chat/image/presign`` hands the client a signed POST form for
+``uploads/<user_id>/<sha256><ext>``; the bytes then go straight to MinIO
+instead of through a Django worker. ``POST /api/chat/image/confirm`` HEADs the
+object, checks it against what was declared and records it as stored. Names
+are content addressed, so presigning an image the user already stored returns
+it without another upload. The hash is declared by the client and not
+re-computed here, which is why the prefix is per user: a wrong hash can only
+shadow the caller's own images.
+
+Once stored, ``chat.tasks.normalize_image_upload`` runs ``process``: it reads
+the original back, hashes what was actually stored and writes the
+``chat.imaging`` display copy and thumbnail under ``derived/<sha256>/``.
+Those names come from the verified hash, so the same picture uploaded again,
+by anyone, reuses the existing copies instead of being decoded again.
+
+Presigns never confirmed within ``IMAGE_UPLOAD_URL_TTL`` plus
+``IMAGE_UPLOAD_CONFIRM_GRACE_SECONDS`` are dropped by
+``chat.tasks.expire_pending_uploads`` together with any object uploaded for
+them, unless a stored upload or a newer presign uses the same object.
+"""
+import hashlib
+import io
+import logging
+import re
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from analytics import metrics
+from . import imaging, storage
+from .models import ImageUpload
+
+EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def object_name(user_id: int, digest: str, content_type: str) -> str:
+    return f"uploads/{user_id}/{digest}{EXTENSIONS.get(content_type, '')}"
+
+
+def validate(content_type, size, digest):
+    """Normalised ``(content_type, size, sha256)`` or UploadError."""
+    if content_type not in settings.IMAGE_UPLOAD_CONTENT_TYPES:
+        raise UploadError("unsupported content_type")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError("size must be an integer")
+    if not 0 < size <= settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise UploadError(f"size must be between 1 and {settings.IMAGE_UPLOAD_MAX_BYTES} bytes")
+    digest = (digest or "").lower()
+    if not _SHA256.match(digest):
+        raise UploadError("sha256 must be 64 hex characters")
+    return content_type, size, digest
+
+
+def file_sha256(file) -> str:
+    h = hashlib.sha256()
+    for chunk in file.chunks():
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def find_stored(user, digest: str):
+    return ImageUpload.objects.filter(user=user, sha256=digest, status="stored").order_by("-id").first()
+
+
+def _matches(info, upload: ImageUpload) -> bool:
+    return info.size == upload.size and (info.content_type or "").split(";")[0] == upload.content_type
+
+
+def payload(upload: ImageUpload, **extra) -> dict:
+    return {
+        "upload_id": upload.id,
+        "status": upload.status,
+        "sha256": upload.sha256,
+        "image_url": storage.object_url(upload.object_name) if upload.status == "stored" else None,
+        "processed": upload.processed_at is not None,
+        "display_url": storage.object_url(upload.display_object) if upload.display_object else None,
+        "thumb_url": storage.object_url(upload.thumb_object) if upload.thumb_object else None,
+        "width": upload.width,
+        "height": upload.height,
+        "error": upload.error or None,
+        **extra,
+    }
+
+
+def needs_processing(upload: ImageUpload) -> bool:
+    return upload.status == "stored" and upload.processed_at is None
+
+
+def presign(user, content_type, size, digest) -> dict:
+    content_type, size, digest = validate(content_type, size, digest)
+    stored = find_stored(user, digest)
+    if stored is not None:
+        metrics.incr("image_uploads.deduped")
+        return payload(stored, exists=True)
+
+    name = object_name(user.id, digest, content_type)
+    upload = ImageUpload(user=user, sha256=digest, object_name=name, content_type=content_type, size=size)
+    # object ممکن است قبلاً آپلود شده ولی confirm نشده باشد
+    info = storage.stat(name)
+    if info is not None and _matches(info, upload):
+        upload.status, upload.confirmed_at = "stored", timezone.now()
+        upload.save()
+        metrics.incr("image_uploads.deduped")
+        return payload(upload, exists=True)
+
+    upload.save()
+    form = storage.presigned_post(name, content_type, size, settings.IMAGE_UPLOAD_URL_TTL)
+    metrics.incr("image_uploads.presigned")
+    return payload(upload, exists=False, expires_in=settings.IMAGE_UPLOAD_URL_TTL, **form)
+
+
+def confirm(user, upload_id) -> dict:
+    try:
+        upload_id = int(upload_id)
+    except (TypeError, ValueError):
+        raise UploadError("upload not found", status=404)
+    upload = ImageUpload.objects.filter(id=upload_id, user=user).first()
+    if upload is None:
+        raise UploadError("upload not found", status=404)
+    if upload.status == "stored":
+        return payload(upload)
+    info = storage.stat(upload.object_name)
+    if info is None:
+        raise UploadError("object not uploaded yet", status=409)
+    if not _matches(info, upload):
+        storage.remove(upload.object_name)
+        ImageUpload.objects.filter(id=upload.id).delete()
+        metrics.incr("image_uploads.rejected")
+        raise UploadError("uploaded object does not match the declared size or content_type")
+    upload.status, upload.confirmed_at = "stored", timezone.now()
+    upload.save(update_fields=["status", "confirmed_at"])
+    metrics.incr("image_uploads.stored", path="direct")
+    return payload(upload)
+
+
+def expire_pending(limit: int = 1000) -> int:
+    """Drop unconfirmed presigns past their URL TTL and their orphaned objects; returns how many."""
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.IMAGE_UPLOAD_URL_TTL + settings.IMAGE_UPLOAD_CONFIRM_GRACE_SECONDS
+    )
+    stale = list(
+        ImageUpload.objects.filter(status="pending", created_at__lt=cutoff).values_list("id", "object_name")[:limit]
+    )
+    if not stale:
+        return 0
+    names = {name for _, name in stale}
+    # همان object ممکن است پشت یک آپلود stored یا presign تازه‌تر (همان کاربر و hash) باشد
+    kept = set(
+        ImageUpload.objects.filter(object_name__in=names)
+        .filter(Q(status="stored") | Q(created_at__gte=cutoff))
+        .values_list("object_name", flat=True)
+    )
+    for name in names - kept:
+        try:
+            storage.remove(name)
+        except Exception:
+            logger.warning("removing unconfirmed upload %s failed", name, exc_info=True)
+    ImageUpload.objects.filter(id__in=[upload_id for upload_id, _ in stale], status="pending").delete()
+    metrics.incr("image_uploads.expired", len(stale))
+    return len(stale)
+
+
+def store_file(user, file) -> ImageUpload:
+    """The legacy multipart path: hash the upload, skip the PUT if the user already has it."""
+    digest = file_sha256(file)
+    stored = find_stored(user, digest)
+    if stored is not None:
+        metrics.incr("image_uploads.deduped")
+        return stored
+    content_type = file.content_type or "application/octet-stream"
+    name = object_name(user.id, digest, content_type)
+    storage.put_file(name, file, file.size, content_type=content_type)
+    metrics.incr("image_uploads.stored", path="proxy")
+    return ImageUpload.objects.create(
+        user=user, sha256=digest, object_name=name, content_type=content_type,
+        size=file.size, status="stored", confirmed_at=timezone.now(),
+    )
+
+
+def derived_names(digest: str) -> tuple[str, str]:
+    ext = imaging.extension()
+    sides = f"{settings.IMAGE_VISION_MAX_SIDE}x{settings.IMAGE_VISION_SHORT_SIDE}"
+    return f"derived/{digest}/{sides}{ext}", f"derived/{digest}/thumb{settings.IMAGE_THUMB_SIDE}{ext}"
+
+
+def process(upload_id: int):
+    """Attach normalised copies to a stored upload; a redelivered or already processed upload is skipped."""
+    upload = ImageUpload.objects.filter(id=upload_id, status="stored", processed_at=None).first()
+    if upload is None:
+        return
+    data = storage.read(upload.object_name)
+    display_name, thumb_name = derived_names(hashlib.sha256(data).hexdigest())
+    done = ImageUpload.objects.filter(display_object=display_name).exclude(processed_at=None).first()
+    if done is not None:
+        fields = {"width": done.width, "height": done.height}
+        metrics.incr("image_uploads.normalized", result="deduped")
+    else:
+        try:
+            out = imaging.normalize(data)
+        except ValueError as e:
+            logger.info("upload %s is not a usable image: %s", upload_id, e)
+            ImageUpload.objects.filter(id=upload_id).update(processed_at=timezone.now(), error=str(e)[:500])
+            metrics.incr("image_uploads.normalized", result="failed")
+            return
+        storage.put_file(display_name, io.BytesIO(out.display), len(out.display), content_type=out.content_type)
+        storage.put_file(thumb_name, io.BytesIO(out.thumbnail), len(out.thumbnail), content_type=out.content_type)
+        fields = {"width": out.width, "height": out.height}
+        metrics.incr("image_uploads.normalized", result="encoded")
+        metrics.incr("image_uploads.bytes_saved", max(0, len(data) - len(out.display)))
+    ImageUpload.objects.filter(id=upload_id).update(
+        display_object=display_name, thumb_object=thumb_name, processed_at=timezone.now(), **fields
+    )
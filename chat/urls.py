@@ -1,8 +1,21 @@
 from django.urls import path
-from .views import ChatSendView, ImageUploadView
+from .views import ChatSendView, AsyncChatSendView, ImageJobsView, ImageJobDetailView, ImageUploadView
+from .views import BulkSendView, ChatBatchDetailView
+from .views import ImageUploadConfirmView, ImageUploadDetailView, ImageUploadPresignView
+from .views import ThreadListView, ThreadMessagesView
 
 urlpatterns = [
     path("send", ChatSendView.as_view()),
+    path("send/async", AsyncChatSendView.as_view()),
+    path("send/bulk", BulkSendView.as_view()),
+    path("send/bulk/<int:batch_id>", ChatBatchDetailView.as_view()),
     path("image", ImageUploadView.as_view()),
+    path("image/presign", ImageUploadPresignView.as_view()),
+    path("image/confirm", ImageUploadConfirmView.as_view()),
+    path("image/<int:upload_id>", ImageUploadDetailView.as_view()),
+    path("images", ImageJobsView.as_view()),
+    path("images/<int:job_id>", ImageJobDetailView.as_view()),
+    path("threads", ThreadListView.as_view()),
+    path("threads/<int:thread_id>/messages", ThreadMessagesView.as_view()),
 ]
 
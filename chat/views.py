@@ -1,83 +1,559 @@
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import APIException
 from django.db import transaction
-from .openai_client import chat_completion
+from django.utils import timezone
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from . import openai_client
 from django.conf import settings
-from minio import Minio
 from django.core.files.uploadedfile import UploadedFile
 from rest_framework.parsers import MultiPartParser, FormParser
-from billing.pricing import charge_wallet_for_usage
-from billing.models import ModelCatalog
-from .models import ChatThread, ChatMessage, MemorySummary
-
-
-def build_messages_with_memory(thread: ChatThread, user_msg: str):
-    msgs = [
-        {
-            "role": "system",
-            "content": (
-                MemorySummary.objects.filter(thread=thread).order_by("-id").first()
-                or MemorySummary(summary="")
-            ).summary
-            or "You are a kind assistant for kids.",
-        }
-    ]
-    recent_msgs = ChatMessage.objects.filter(thread=thread).order_by("-id")[:10]
-    for m in reversed(list(recent_msgs)):
-        msgs.append({"role": m.role, "content": m.content})
-    msgs.append({"role": "user", "content": user_msg})
-    return msgs
+from billing.pricing import IMAGE_TOKENS, charge_wallet_for_usage
+from billing import catalog, debit
+from analytics import metrics
+from .models import ChatBatch, ChatThread, ChatMessage, ImageJob, ImageUpload
+from .streaming import authenticate, can_hold, event_stream, sse, wants_stream
+from . import admission, context_cache, history, images, response_cache, uploads
+from . import bulk
+from .prompts import SendError, abuild_messages_with_memory, build_messages_with_memory, reply_text
+from .tasks import generate_image_job, normalize_image_upload
 
+logger = logging.getLogger(__name__)
 
-class ChatSendView(APIView):
-    def post(self, request):
-        model_alias = request.data.get("model_alias")
-        prompt = request.data.get("prompt")
-        thread_id = request.data.get("thread_id")
 
-        if not prompt or not model_alias:
-            return Response({"error": "prompt and model_alias required"}, status=400)
+def prepare_send(user, data):
+    """Validate a send payload and resolve (catalog, thread, prompt); raises SendError."""
+    model_alias = data.get("model_alias")
+    prompt = data.get("prompt")
+    thread_id = data.get("thread_id")
+
+    if not prompt or not model_alias:
+        raise SendError("prompt and model_alias required", 400)
+
+    cat = catalog.get_enabled(model_alias)
+    if cat is None:
+        raise SendError("invalid model alias", 400)
 
+    if thread_id:
         try:
-            cat = ModelCatalog.objects.get(alias=model_alias, enabled=True)
-        except ModelCatalog.DoesNotExist:
-            return Response({"error": "invalid model alias"}, status=400)
+            thread = ChatThread.objects.get(id=thread_id, user=user)
+        except ChatThread.DoesNotExist:
+            raise SendError("thread not found", 404)
+    else:
+        thread = ChatThread.objects.create(user=user, model_alias=model_alias)
+    return cat, thread, prompt
 
-        if thread_id:
-            try:
-                thread = ChatThread.objects.get(id=thread_id, user=request.user)
-            except ChatThread.DoesNotExist:
-                return Response({"error": "thread not found"}, status=404)
+
+def preauthorize_send(user, prompt_tokens: int):
+    """Reserve the estimated cost before calling upstream; raises SendError(402) for empty wallets."""
+    estimate = prompt_tokens + settings.WALLET_PREAUTH_OUTPUT_TOKENS
+    try:
+        return debit.preauthorize(user.id, estimate)
+    except ValueError:
+        raise SendError("insufficient wallet", 402)
+
+
+def _too_many(rejected):
+    return SendError("too many requests", 429, headers={"Retry-After": str(rejected.retry_after)})
+
+
+def admit_send(user, cat, prompt_tokens: int, hold=None):
+    """Take admission slots for the upstream call; raises SendError(429) and drops the hold when full."""
+    try:
+        return admission.admit(user.id, cat.alias, prompt_tokens)
+    except admission.Rejected as e:
+        debit.release(hold)
+        raise _too_many(e)
+
+
+async def aadmit_send(user, cat, prompt_tokens: int, hold=None):
+    try:
+        return await admission.aadmit(user.id, cat.alias, prompt_tokens)
+    except admission.Rejected as e:
+        await sync_to_async(debit.release)(hold)
+        raise _too_many(e)
+
+
+def persist_exchange(user, thread, cat, prompt, text, in_tokens, out_tokens, meta=None, hold=None,
+                     cache_hit=False, cached_tokens=0):
+    """Store the user/assistant pair and charge the wallet atomically; raises INSUFFICIENT_WALLET."""
+    try:
+        with transaction.atomic():
+            pair = [
+                ChatMessage.objects.create(thread=thread, role="user", content=prompt, tokens_in=in_tokens),
+                ChatMessage.objects.create(
+                    thread=thread, role="assistant", content=text, tokens_out=out_tokens, meta=meta or {}
+                ),
+            ]
+            ChatThread.objects.filter(id=thread.id).update(last_activity=timezone.now())
+            charge_wallet_for_usage(
+                user, cat.alias, in_tokens, out_tokens, cat=cat, hold=hold,
+                cache_hit=cache_hit, cached_tokens=cached_tokens,
+            )
+            transaction.on_commit(lambda: context_cache.append(thread.id, pair))
+    except ValueError:
+        debit.release(hold)
+        raise
+
+
+def persist_cached_reply(user, thread, cat, prompt, hit, hold=None):
+    """Store a response-cache hit as a normal exchange, billed at the cache-hit rate."""
+    persist_exchange(
+        user, thread, cat, prompt, hit.reply, hit.in_tokens, hit.out_tokens,
+        meta={"response_cache": hit.tier}, hold=hold, cache_hit=True,
+    )
+    return {
+        "thread_id": str(thread.id),
+        "reply": hit.reply,
+        "usage": {"prompt_tokens": hit.in_tokens, "completion_tokens": hit.out_tokens},
+        "cached": True,
+    }
+
+
+def stream_cached(payload):
+    yield sse("start", {"thread_id": payload["thread_id"]})
+    yield sse("delta", {"text": payload["reply"]})
+    yield sse("done", {"thread_id": payload["thread_id"], "usage": payload["usage"], "cached": True})
+
+
+async def astream_cached(payload):
+    # ASGI یک iterator همگام را پیش از ارسال تا انتها مصرف می‌کند
+    for frame in stream_cached(payload):
+        yield frame
+
+
+class _ReplyStream:
+    """
+    SSE frames of ``_relay_stream``, closable before the first frame.
+
+    A generator closed before its first ``next()`` never runs its body, so
+    its ``finally`` can't give back the hold or the admission ticket when a
+    client disconnects before the server starts iterating; ``close`` does it
+    here instead. Django closes the iterator of a StreamingHttpResponse.
+    """
+
+    def __init__(self, frames, hold, ticket):
+        self._frames = frames
+        self._hold = hold
+        self._ticket = ticket
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._started = True
+        return next(self._frames)
+
+    def close(self):
+        self._frames.close()
+        if not self._started:
+            self._started = True
+            debit.release(self._hold)
+            admission.release(self._ticket)
+
+
+def stream_reply(user, thread, cat, prompt, messages, prompt_tokens, hold=None, ticket=None):
+    """
+    Relay completion deltas as SSE frames, then persist and bill once.
+
+    If the client goes away mid-stream the WSGI server closes this generator
+    (GeneratorExit at the pending ``yield``); we then close the upstream stream
+    and bill only the prompt plus the deltas actually relayed. An upstream
+    error mid-stream is billed the same way and ends with an ``error`` frame.
+    The admission ``ticket`` is held until the stream ends either way.
+    """
+
+    def frames():
+        try:
+            yield from _relay_stream(user, thread, cat, prompt, messages, prompt_tokens, hold)
+        finally:
+            admission.release(ticket)
+
+    return _ReplyStream(frames(), hold, ticket)
+
+
+def _bill_partial(user, thread, cat, prompt, parts, prompt_tokens, hold, meta):
+    # هر delta تقریباً یک توکن است؛ فقط همان مقدار تولیدشده صورت‌حساب می‌شود
+    try:
+        persist_exchange(
+            user, thread, cat, prompt, "".join(parts), prompt_tokens, len(parts),
+            meta={**meta, "usage_estimated": True}, hold=hold,
+        )
+    except ValueError:
+        logger.warning("interrupted stream for thread %s could not be billed", thread.id)
+
+
+def _relay_stream(user, thread, cat, prompt, messages, prompt_tokens, hold):
+    settled = False  # persist_exchange خودش hold را settle یا آزاد می‌کند
+    try:
+        upstream = openai_client.chat_completion_stream(cat.model_name, messages)
+        parts = []
+        usage_chunk = None
+        try:
+            yield sse("start", {"thread_id": str(thread.id)})
+            for chunk in upstream:
+                if getattr(chunk, "usage", None):
+                    usage_chunk = chunk
+                for choice in chunk.choices or []:
+                    delta = getattr(choice.delta, "content", None)
+                    if delta:
+                        parts.append(delta)
+                        yield sse("delta", {"text": delta})
+        except GeneratorExit:
+            upstream.close()
+            settled = True
+            _bill_partial(user, thread, cat, prompt, parts, prompt_tokens, hold, {"cancelled": True})
+            raise
+        except Exception:
+            upstream.close()
+            logger.warning("upstream stream for thread %s failed", thread.id, exc_info=True)
+            if parts:
+                # توکن‌های رله‌شده را provider حساب کرده است
+                settled = True
+                _bill_partial(user, thread, cat, prompt, parts, prompt_tokens, hold, {"upstream_error": True})
+            yield sse("error", {"error": "upstream error"})
+            return
+
+        text = "".join(parts)
+        if usage_chunk is not None:
+            in_tokens, out_tokens, cached_tokens = openai_client.usage_tokens(usage_chunk)
+            openai_client.record_prompt_cache(cat.model_name, in_tokens, cached_tokens)
+            meta = {}
         else:
-            thread = ChatThread.objects.create(user=request.user, model_alias=model_alias)
+            in_tokens, out_tokens, cached_tokens = prompt_tokens, len(parts), 0
+            meta = {"usage_estimated": True}
+        try:
+            persist_exchange(
+                user, thread, cat, prompt, text, in_tokens, out_tokens, meta=meta, hold=hold,
+                cached_tokens=cached_tokens,
+            )
+        except ValueError as e:
+            settled = True
+            if str(e) == "INSUFFICIENT_WALLET":
+                yield sse("error", {"error": "insufficient wallet"})
+                return
+            raise
+        settled = True
+        response_cache.store(cat, prompt, messages, text, in_tokens, out_tokens, user_id=user.id)
+        yield sse(
+            "done",
+            {
+                "thread_id": str(thread.id),
+                "usage": {"prompt_tokens": in_tokens, "completion_tokens": out_tokens, "cached_tokens": cached_tokens},
+            },
+        )
+    finally:
+        if not settled:
+            debit.release(hold)
 
-        messages = build_messages_with_memory(thread, prompt)
-        resp, (in_tokens, out_tokens) = chat_completion(cat.model_name, messages, tools=None)
 
-        choice = resp.choices[0]
-        text = getattr(choice.message, "content", "") if hasattr(choice, "message") else ""
+async def astream_reply(user, thread, cat, prompt, messages, prompt_tokens, hold=None, ticket=None):
+    """
+    ``stream_reply`` for the ASGI view: deltas come from AsyncOpenAI on the event loop.
 
+    Under ASGI Django buffers a sync iterator to the end before sending, so
+    the sync stream would neither stream nor notice a disconnect. A client
+    going away here cancels the response task (CancelledError at the pending
+    upstream read) or closes this generator at its ``yield`` (GeneratorExit);
+    either way the upstream stream is closed and only the prompt plus the
+    deltas actually relayed are billed. The ``ticket`` is held until the end.
+    """
+    settled = False  # persist_exchange خودش hold را settle یا آزاد می‌کند
+    try:
+        upstream = await openai_client.async_chat_completion_stream(cat.model_name, messages)
+        parts = []
+        usage_chunk = None
+        try:
+            yield sse("start", {"thread_id": str(thread.id)})
+            async for chunk in upstream:
+                if getattr(chunk, "usage", None):
+                    usage_chunk = chunk
+                for choice in chunk.choices or []:
+                    delta = getattr(choice.delta, "content", None)
+                    if delta:
+                        parts.append(delta)
+                        yield sse("delta", {"text": delta})
+        except (GeneratorExit, asyncio.CancelledError):
+            settled = True
+            await upstream.close()
+            await sync_to_async(_bill_partial)(user, thread, cat, prompt, parts, prompt_tokens, hold,
+                                               {"cancelled": True})
+            raise
+        except Exception:
+            await upstream.close()
+            logger.warning("upstream stream for thread %s failed", thread.id, exc_info=True)
+            if parts:
+                settled = True
+                await sync_to_async(_bill_partial)(user, thread, cat, prompt, parts, prompt_tokens, hold,
+                                                   {"upstream_error": True})
+            yield sse("error", {"error": "upstream error"})
+            return
+
+        text = "".join(parts)
+        if usage_chunk is not None:
+            in_tokens, out_tokens, cached_tokens = openai_client.usage_tokens(usage_chunk)
+            openai_client.record_prompt_cache(cat.model_name, in_tokens, cached_tokens)
+            meta = {}
+        else:
+            in_tokens, out_tokens, cached_tokens = prompt_tokens, len(parts), 0
+            meta = {"usage_estimated": True}
+        settled = True
         try:
-            with transaction.atomic():
-                ChatMessage.objects.create(thread=thread, role="user", content=prompt, tokens_in=in_tokens)
-                ChatMessage.objects.create(thread=thread, role="assistant", content=text, tokens_out=out_tokens)
-                charge_wallet_for_usage(request.user, model_alias, in_tokens, out_tokens)
+            await sync_to_async(persist_exchange)(
+                user, thread, cat, prompt, text, in_tokens, out_tokens, meta=meta, hold=hold,
+                cached_tokens=cached_tokens,
+            )
+        except ValueError as e:
+            if str(e) == "INSUFFICIENT_WALLET":
+                yield sse("error", {"error": "insufficient wallet"})
+                return
+            raise
+        await sync_to_async(response_cache.store)(cat, prompt, messages, text, in_tokens, out_tokens, user_id=user.id)
+        yield sse(
+            "done",
+            {
+                "thread_id": str(thread.id),
+                "usage": {"prompt_tokens": in_tokens, "completion_tokens": out_tokens, "cached_tokens": cached_tokens},
+            },
+        )
+    finally:
+        if not settled:
+            await sync_to_async(debit.release)(hold)
+        await sync_to_async(admission.release)(ticket)
+
+
+class ChatSendView(APIView):
+    def post(self, request):
+        try:
+            cat, thread, prompt = prepare_send(request.user, request.data)
+            messages, prompt_tokens = build_messages_with_memory(thread, prompt, cat)
+            hold = preauthorize_send(request.user, prompt_tokens)
+        except SendError as e:
+            return Response({"error": e.message}, status=e.status, headers=e.headers)
+
+        hit = response_cache.lookup(cat, prompt, messages, user_id=request.user.id)
+        if hit is not None:
+            try:
+                payload = persist_cached_reply(request.user, thread, cat, prompt, hit, hold=hold)
+            except ValueError as e:
+                if str(e) == "INSUFFICIENT_WALLET":
+                    return Response({"error": "insufficient wallet"}, status=402)
+                raise
+            if wants_stream(request):
+                return event_stream(stream_cached(payload))
+            return Response(payload, status=200)
+
+        try:
+            ticket = admit_send(request.user, cat, prompt_tokens, hold)
+        except SendError as e:
+            return Response({"error": e.message}, status=e.status, headers=e.headers)
+
+        if wants_stream(request):
+            return event_stream(
+                stream_reply(request.user, thread, cat, prompt, messages, prompt_tokens, hold=hold, ticket=ticket)
+            )
+
+        try:
+            resp, usage = openai_client.chat_completion(cat.model_name, messages, tools=None)
+        except Exception:
+            debit.release(hold)
+            raise
+        finally:
+            admission.release(ticket)
+        in_tokens, out_tokens, cached_tokens = openai_client.split_usage(usage)
+        text = reply_text(resp)
+
+        try:
+            persist_exchange(
+                request.user, thread, cat, prompt, text, in_tokens, out_tokens, hold=hold,
+                cached_tokens=cached_tokens,
+            )
         except ValueError as e:
             if str(e) == "INSUFFICIENT_WALLET":
                 return Response({"error": "insufficient wallet"}, status=402)
             raise
+        response_cache.store(cat, prompt, messages, text, in_tokens, out_tokens, user_id=request.user.id)
 
         return Response(
             {
                 "thread_id": str(thread.id),
                 "reply": text,
-                "usage": {"prompt_tokens": in_tokens, "completion_tokens": out_tokens},
+                "usage": {"prompt_tokens": in_tokens, "completion_tokens": out_tokens, "cached_tokens": cached_tokens},
             },
             status=200,
         )
 
 
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncChatSendView(View):
+    """
+    ASGI variant of ChatSendView.
+
+    Auth, catalog/thread lookups and persistence run through ``sync_to_async``;
+    only the upstream LLM call is awaited on the event loop, so a single worker
+    process can keep many requests in flight. ``stream`` relays deltas through
+    ``astream_reply``; this is the streaming endpoint to use under ASGI.
+    """
+
+    async def post(self, request):
+        try:
+            user, data = await sync_to_async(authenticate)(request)
+            cat, thread, prompt = await sync_to_async(prepare_send)(user, data)
+            messages, prompt_tokens = await abuild_messages_with_memory(thread, prompt, cat)
+            hold = await sync_to_async(preauthorize_send)(user, prompt_tokens)
+        except APIException as e:
+            return JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+        except SendError as e:
+            return JsonResponse({"error": e.message}, status=e.status, headers=e.headers)
+
+        owned = True  # تا وقتی persist_exchange یا stream آن را نگرفته، hold با این view است
+        try:
+            hit = await sync_to_async(response_cache.lookup)(cat, prompt, messages, user_id=user.id)
+            if hit is not None:
+                owned = False
+                payload = await sync_to_async(persist_cached_reply)(user, thread, cat, prompt, hit, hold=hold)
+                if wants_stream(request, data):
+                    return event_stream(astream_cached(payload))
+                return JsonResponse(payload, status=200)
+
+            ticket = await aadmit_send(user, cat, prompt_tokens)
+            if wants_stream(request, data):
+                owned = False
+                return event_stream(
+                    astream_reply(user, thread, cat, prompt, messages, prompt_tokens, hold=hold, ticket=ticket)
+                )
+            try:
+                resp, usage = await openai_client.async_chat_completion(cat.model_name, messages, tools=None)
+            finally:
+                await sync_to_async(admission.release)(ticket)
+            in_tokens, out_tokens, cached_tokens = openai_client.split_usage(usage)
+            text = reply_text(resp)
+
+            owned = False
+            await sync_to_async(persist_exchange)(
+                user, thread, cat, prompt, text, in_tokens, out_tokens, hold=hold, cached_tokens=cached_tokens
+            )
+        except SendError as e:
+            return JsonResponse({"error": e.message}, status=e.status, headers=e.headers)
+        except ValueError as e:
+            if str(e) == "INSUFFICIENT_WALLET":
+                return JsonResponse({"error": "insufficient wallet"}, status=402)
+            raise
+        finally:
+            # قطع اتصال کلاینت view را با CancelledError لغو می‌کند که Exception نیست
+            if owned:
+                await sync_to_async(debit.release)(hold)
+        await sync_to_async(response_cache.store)(
+            cat, prompt, messages, text, in_tokens, out_tokens, user_id=user.id
+        )
+
+        return JsonResponse(
+            {
+                "thread_id": str(thread.id),
+                "reply": text,
+                "usage": {"prompt_tokens": in_tokens, "completion_tokens": out_tokens, "cached_tokens": cached_tokens},
+            },
+            status=200,
+        )
+
+
+class BulkSendView(APIView):
+    """Many (thread, prompt) items at once; see chat.bulk for ``mode=interactive|offline``."""
+
+    def post(self, request):
+        mode = request.data.get("mode") or "interactive"
+        if mode not in bulk.MODES:
+            return Response({"error": "mode must be interactive or offline"}, status=400)
+        try:
+            items = bulk.prepare(request.user, request.data, single_model=mode == "offline")
+            if mode == "interactive":
+                return Response({"results": bulk.send(request.user, items)}, status=200)
+            batch = bulk.submit(request.user, items)
+        except SendError as e:
+            return Response({"error": e.message}, status=e.status, headers=e.headers)
+        if batch is None:
+            return Response({"results": [bulk.result(item) for item in items]}, status=200)
+        return Response(bulk.payload(batch), status=202)
+
+
+class ChatBatchDetailView(APIView):
+    def get(self, request, batch_id: int):
+        batch = ChatBatch.objects.filter(id=batch_id, user=request.user).first()
+        if batch is None:
+            return Response({"error": "batch not found"}, status=404)
+        return Response(bulk.payload(batch), status=200)
+
+
+def enqueue_image_job(user, data):
+    """Return ``(job, created)``: a new queued ImageJob or the user's recent one for the same prompt."""
+    model_alias = data.get("model_alias")
+    prompt = data.get("prompt")
+    if not prompt or not model_alias:
+        raise SendError("prompt and model_alias required", 400)
+    cat = catalog.get_enabled(model_alias)
+    if cat is None or cat.pricing_mode != "image":
+        raise SendError("invalid model alias", 400)
+
+    digest = images.prompt_hash(model_alias, prompt)
+    existing = images.find_duplicate(user, digest)
+    if existing is not None:
+        metrics.incr("image_jobs.deduplicated", model=model_alias)
+        return existing, False
+    # سقف نرم: دو درخواست هم‌زمان ممکن است هر دو از آن رد شوند
+    if images.active_count(user) >= settings.IMAGE_JOBS_PER_USER:
+        raise SendError("too many image jobs", 429, headers={"Retry-After": str(settings.IMAGE_JOB_RETRY_AFTER)})
+    try:
+        hold = debit.preauthorize(user.id, IMAGE_TOKENS)
+    except ValueError:
+        raise SendError("insufficient wallet", 402)
+    job = ImageJob.objects.create(
+        user=user, model_alias=model_alias, prompt=prompt, prompt_hash=digest,
+        reserved_tokens=hold.tokens if hold.reserved else 0,
+    )
+    transaction.on_commit(lambda: generate_image_job.delay(job.id))
+    metrics.incr("image_jobs.queued", model=model_alias)
+    return job, True
+
+
+class ImageJobsView(APIView):
+    def post(self, request):
+        try:
+            job, created = enqueue_image_job(request.user, request.data)
+        except SendError as e:
+            return Response({"error": e.message}, status=e.status, headers=e.headers)
+        return Response(images.payload(job), status=202 if created else 200)
+
+
+class ImageJobDetailView(View):
+    """Job status; with ``Accept: text/event-stream`` SSE updates, held only under the ASGI app."""
+
+    async def get(self, request, job_id: int):
+        try:
+            user, _ = await sync_to_async(authenticate)(request)
+        except APIException as e:
+            return JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+        job = await ImageJob.objects.filter(id=job_id, user_id=user.id).afirst()
+        if job is None:
+            return JsonResponse({"error": "job not found"}, status=404)
+        if "text/event-stream" in request.META.get("HTTP_ACCEPT", ""):
+            if can_hold(request):
+                return event_stream(images.stream_status(job.id, user.id))
+            return event_stream(images.status_snapshot(job))
+        return JsonResponse(images.payload(job), status=200)
+
+
+def normalize_later(upload_id: int):
+    transaction.on_commit(lambda: normalize_image_upload.delay(upload_id))
+
+
 class ImageUploadView(APIView):
     parser_classes = (MultiPartParser, FormParser)
 
@@ -88,24 +564,91 @@ class ImageUploadView(APIView):
         if not file or not model_alias:
             return Response({"error": "image and model_alias required"}, status=400)
 
-        # ensure bucket
-        endpoint = settings.MINIO_ENDPOINT.replace("http://", "").replace("https://", "")
-        secure = settings.MINIO_ENDPOINT.startswith("https://")
-        client = Minio(
-            endpoint,
-            access_key=settings.MINIO_ACCESS_KEY,
-            secret_key=settings.MINIO_SECRET_KEY,
-            secure=secure,
-        )
-        bucket = settings.MINIO_BUCKET
-        if not client.bucket_exists(bucket):
-            client.make_bucket(bucket)
-
-        # store file
-        object_name = f"uploads/{file.name}"
-        client.put_object(bucket, object_name, file, length=file.size, content_type=file.content_type)
+        upload = uploads.store_file(request.user, file)
+        if uploads.needs_processing(upload):
+            normalize_later(upload.id)
 
         # For now, just echo location (hook to OpenAI image APIs can be added)
-        url = f"{settings.MINIO_ENDPOINT}/{bucket}/{object_name}"
-        return Response({"image_url": url, "model_alias": model_alias, "prompt": prompt}, status=200)
+        data = uploads.payload(upload, model_alias=model_alias, prompt=prompt)
+        return Response(data, status=200)
+
+
+class ImageUploadPresignView(APIView):
+    def post(self, request):
+        try:
+            data = uploads.presign(
+                request.user, request.data.get("content_type"), request.data.get("size"), request.data.get("sha256")
+            )
+        except uploads.UploadError as e:
+            return Response({"error": e.message}, status=e.status)
+        if data["status"] == "stored" and not data["processed"]:
+            normalize_later(data["upload_id"])
+        return Response(data, status=200 if data["exists"] else 201)
+
+
+class ImageUploadConfirmView(APIView):
+    def post(self, request):
+        try:
+            data = uploads.confirm(request.user, request.data.get("upload_id"))
+        except uploads.UploadError as e:
+            return Response({"error": e.message}, status=e.status)
+        if not data["processed"]:
+            normalize_later(data["upload_id"])
+        return Response(data, status=200)
+
+
+class ImageUploadDetailView(APIView):
+    def get(self, request, upload_id: int):
+        upload = ImageUpload.objects.filter(id=upload_id, user=request.user).first()
+        if upload is None:
+            return Response({"error": "upload not found"}, status=404)
+        return Response(uploads.payload(upload), status=200)
+
+
+
+def _conditional(request, tag: str, build):
+    """304 when the client's If-None-Match already has ``tag``; otherwise ``build()`` with the ETag set."""
+    if tag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+        return Response(status=304, headers={"ETag": tag})
+    try:
+        body = build()
+    except history.BadCursor as e:
+        return Response({"error": str(e)}, status=400)
+    return Response(body, status=200, headers={"ETag": tag})
+
+
+class ThreadListView(APIView):
+    def get(self, request):
+        cursor = request.query_params.get("cursor")
+        try:
+            limit = history.page_size(request.query_params.get("limit"))
+        except history.BadCursor as e:
+            return Response({"error": str(e)}, status=400)
+        tag = history.etag("threads", history.threads_version(request.user.id), cursor, limit)
+
+        def build():
+            rows, next_cursor = history.page_threads(request.user.id, cursor, limit)
+            return {"results": [history.thread_item(t) for t in rows], "next_cursor": next_cursor}
+
+        return _conditional(request, tag, build)
+
+
+class ThreadMessagesView(APIView):
+    def get(self, request, thread_id: int):
+        if not ChatThread.objects.filter(id=thread_id, user=request.user).exists():
+            return Response({"error": "thread not found"}, status=404)
+        params = request.query_params
+        cursor = params.get("cursor")
+        newest_first = params.get("order", "desc") != "asc"
+        full = params.get("full") in ("1", "true")
+        try:
+            limit = history.page_size(params.get("limit"))
+        except history.BadCursor as e:
+            return Response({"error": str(e)}, status=400)
+        tag = history.etag("messages", thread_id, history.messages_version(thread_id), cursor, limit, newest_first, full)
+
+        def build():
+            rows, next_cursor = history.page_messages(thread_id, cursor, limit, newest_first=newest_first, full=full)
+            return {"results": [history.message_item(m) for m in rows], "next_cursor": next_cursor}
 
+        return _conditional(request, tag, build)
@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -17,5 +18,36 @@ app.conf.beat_schedule = {
         "task": "analytics.tasks.summarize_active_threads",
         "schedule": crontab(minute=30, hour=0),
     },
+    "archive-history": {
+        "task": "analytics.tasks.archive_history",
+        "schedule": crontab(minute=0, hour=3),
+    },
+    "rollup-usage": {
+        "task": "billing.tasks.rollup_usage",
+        "schedule": 60.0,
+    },
+    "renew-subscriptions": {
+        "task": "billing.tasks.renew_subscriptions",
+        "schedule": crontab(minute=5),
+    },
+    "expire-stale-image-jobs": {
+        "task": "chat.tasks.expire_stale_image_jobs",
+        "schedule": 300.0,
+    },
+    "expire-pending-uploads": {
+        "task": "chat.tasks.expire_pending_uploads",
+        "schedule": 900.0,
+    },
+    "poll-chat-batches": {
+        "task": "chat.tasks.poll_chat_batches",
+        "schedule": 60.0,
+    },
 }
 
+if settings.BILLING_LEDGER_MODE == "stream":
+    # در حالت sync ردیفی در صف نیست؛ هر ۵ ثانیه رفت‌وبرگشت ردیس بی‌فایده است
+    app.conf.beat_schedule["flush-usage-ledger"] = {
+        "task": "billing.tasks.flush_usage_ledger",
+        "schedule": 5.0,
+    }
+
@@ -1,6 +1,9 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, JsonResponse
 from django.views.decorators.http import require_GET
 from django.views.decorators.cache import never_cache
+from analytics.metrics import snapshot as metrics_snapshot
+from chat import openai_client, response_cache, router
 
 
 @require_GET
@@ -11,4 +14,19 @@ def healthz(request):
     
     این view برای استفاده به‌عنوان health check در محیط‌هایی مانند Docker یا Kubernetes طراحی شده است. فقط درخواست‌های GET باید به این endpoint فرستاده شوند و پاسخ قابل cache نیست (با استفاده از دکوریتورهای مربوطه در سطح ماژول/ویو). پاسخ از نوع application/json است و مقدار بدنه برای نشان دادن سلامت سرویس برابر با {"status": "ok"} است.
     """
-    return JsonResponse({"status": "ok"})
\ No newline at end of file
+    return JsonResponse({"status": "ok"})
+
+
+@require_GET
+@never_cache
+def metrics(request):
+    """Process-local metrics snapshot (see analytics.metrics); staff only outside DEBUG."""
+    user = getattr(request, "user", None)
+    if not settings.DEBUG and not getattr(user, "is_staff", False):
+        raise Http404
+    return JsonResponse({
+        **metrics_snapshot(),
+        "response_cache": response_cache.stats(),
+        "prompt_cache": openai_client.prompt_cache_stats(),
+        "router": router.stats(),
+    })
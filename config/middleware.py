@@ -2,45 +2,68 @@ import json
 import logging
 import time
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject, empty
+
 
 logger = logging.getLogger("audit")
 
 
+def _user_id(request, is_async=False):
+    user = getattr(request, "user", None)
+    # request.user تنبل است؛ اگر view آن را نخوانده، در مسیر async نباید کوئری sync بزنیم
+    if is_async and isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        return None
+    return getattr(user, "id", None)
+
+
 class AuditLogMiddleware:
+    # هم در WSGI و هم در ASGI بدون جابه‌جایی بین thread و event loop اجرا می‌شود
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
         start = time.time()
-        user_id = getattr(getattr(request, "user", None), "id", None)
-        path = request.path
-        method = request.method
-        ip = request.META.get("REMOTE_ADDR")
         try:
             response = self.get_response(request)
-            status = getattr(response, "status_code", 0)
-            duration_ms = int((time.time() - start) * 1000)
-            payload = {
-                "event": "http_request",
-                "path": path,
-                "method": method,
-                "status": status,
-                "duration_ms": duration_ms,
-                "user_id": user_id,
-                "ip": ip,
-            }
-            logger.info(json.dumps(payload, ensure_ascii=False))
-            return response
         except Exception as e:
-            duration_ms = int((time.time() - start) * 1000)
-            payload = {
-                "event": "http_exception",
-                "path": path,
-                "method": method,
-                "duration_ms": duration_ms,
-                "user_id": user_id,
-                "ip": ip,
-                "error": str(e),
-            }
-            logger.exception(json.dumps(payload, ensure_ascii=False))
+            self._log_exception(request, start, e)
+            raise
+        self._log_response(request, start, response)
+        return response
+
+    async def __acall__(self, request):
+        start = time.time()
+        try:
+            response = await self.get_response(request)
+        except Exception as e:
+            self._log_exception(request, start, e)
             raise
+        self._log_response(request, start, response)
+        return response
+
+    def _base_payload(self, request, start):
+        return {
+            "path": request.path,
+            "method": request.method,
+            "duration_ms": int((time.time() - start) * 1000),
+            "user_id": _user_id(request, self.is_async),
+            "ip": request.META.get("REMOTE_ADDR"),
+        }
+
+    def _log_response(self, request, start, response):
+        payload = {"event": "http_request", **self._base_payload(request, start)}
+        payload["status"] = getattr(response, "status_code", 0)
+        logger.info(json.dumps(payload, ensure_ascii=False))
+
+    def _log_exception(self, request, start, e):
+        payload = {"event": "http_exception", **self._base_payload(request, start), "error": str(e)}
+        logger.exception(json.dumps(payload, ensure_ascii=False))
@@ -59,6 +59,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
 
 # settings.py
 DATABASES = {
@@ -101,6 +102,17 @@ STATIC_URL = "/static/"
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+        "KEY_PREFIX": "kids",
+    }
+}
+
+# ModelCatalog is cached in-process; the shared version key is re-checked at most this often
+CATALOG_CACHE_CHECK_SECONDS = float(os.getenv("CATALOG_CACHE_CHECK_SECONDS", "5"))
+
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_TIMEZONE = TIME_ZONE
@@ -123,12 +135,152 @@ KAVEH_NEGAR_TEMPLATE = os.getenv("KAVEH_NEGAR_TEMPLATE", "users")
 DEFAULT_MILLION_TOKENS_PRICE_USD = os.getenv("DEFAULT_MILLION_TOKENS_PRICE_USD", "1.00")
 PROFIT_MARGIN = os.getenv("PROFIT_MARGIN", "0.20")
 
-# Use sqlite in tests when requested
+# "sync": usage ledger rows are written in the request; "stream": via Redis stream + Celery bulk insert
+BILLING_LEDGER_MODE = os.getenv("BILLING_LEDGER_MODE", "sync")
+BILLING_LEDGER_BATCH = int(os.getenv("BILLING_LEDGER_BATCH", "500"))
+BILLING_LEDGER_OUTBOX_GRACE_SECONDS = int(os.getenv("BILLING_LEDGER_OUTBOX_GRACE_SECONDS", "120"))
+# Subscription renewals (billing.renewals)
+SUBSCRIPTION_RENEWAL_CHUNK = int(os.getenv("SUBSCRIPTION_RENEWAL_CHUNK", "2000"))
+SUBSCRIPTION_RENEWAL_MAX_CHUNKS = int(os.getenv("SUBSCRIPTION_RENEWAL_MAX_CHUNKS", "1000"))
+# Usage rollups (billing.rollups) and the reports that read them
+USAGE_ROLLUP_BATCH = int(os.getenv("USAGE_ROLLUP_BATCH", "50000"))
+USAGE_ROLLUP_MAX_ROUNDS = int(os.getenv("USAGE_ROLLUP_MAX_ROUNDS", "20"))
+USAGE_ROLLUP_LAG_SECONDS = int(os.getenv("USAGE_ROLLUP_LAG_SECONDS", "60"))
+USAGE_REPORT_MAX_DAYS = {"hour": 31, "day": 731}
+
+# Wallet pre-authorisation before the LLM call: "db" (balance check), "redis" (reserve/settle), "off"
+WALLET_PREAUTH = os.getenv("WALLET_PREAUTH", "db")
+WALLET_PREAUTH_TTL = int(os.getenv("WALLET_PREAUTH_TTL", "60"))
+WALLET_PREAUTH_OUTPUT_TOKENS = int(os.getenv("WALLET_PREAUTH_OUTPUT_TOKENS", "256"))
+# Cached balance behind GET /api/billing/wallet/ and its SSE/long-poll stream (billing.balance)
+WALLET_BALANCE_CACHE_TTL = int(os.getenv("WALLET_BALANCE_CACHE_TTL", str(24 * 3600)))
+WALLET_STREAM_SECONDS = float(os.getenv("WALLET_STREAM_SECONDS", "300"))
+WALLET_LONGPOLL_SECONDS = float(os.getenv("WALLET_LONGPOLL_SECONDS", "25"))
+WALLET_STREAM_POLL_SECONDS = float(os.getenv("WALLET_STREAM_POLL_SECONDS", "0.5"))
+WALLET_STREAM_RETRY_SECONDS = float(os.getenv("WALLET_STREAM_RETRY_SECONDS", "5"))
+
+# How many recent messages are considered before packing them into the model's context budget
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "20"))
+# threads per analytics.tasks.summarize_threads subtask
+SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", "200"))
+# summaries are written by a cheap catalog model; its spend is recorded under SUMMARY_SYSTEM_USERNAME
+SUMMARY_MODEL_ALIAS = os.getenv("SUMMARY_MODEL_ALIAS", "robot-5-mini")
+SUMMARY_SYSTEM_USERNAME = os.getenv("SUMMARY_SYSTEM_USERNAME", "system-summarizer")
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))
+SUMMARY_MAX_NEW_MESSAGES = int(os.getenv("SUMMARY_MAX_NEW_MESSAGES", "50"))
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "120"))
+SUMMARY_LOCK_SECONDS = int(os.getenv("SUMMARY_LOCK_SECONDS", "600"))
+SUMMARY_WATERMARK_OVERLAP_SECONDS = int(os.getenv("SUMMARY_WATERMARK_OVERLAP_SECONDS", "600"))
+
+# Reply cache for repeated questions (enabled per ModelCatalog.response_cache_enabled)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_CONTEXT_MESSAGES = int(os.getenv("RESPONSE_CACHE_CONTEXT_MESSAGES", "1"))
+# fraction of the original tokens debited from the wallet on a hit
+RESPONSE_CACHE_BILLING_RATE = os.getenv("RESPONSE_CACHE_BILLING_RATE", "0.25")
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "False") == "True"
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+RESPONSE_CACHE_EMBEDDING_PER_MILLION_USD = os.getenv("RESPONSE_CACHE_EMBEDDING_PER_MILLION_USD", "0.02")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_VECTOR_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_VECTOR_MAX_ENTRIES", "5000"))
+
+# Retention (analytics.archive): rows past these horizons move to gzipped JSONL in MinIO; 0 disables
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "180"))
+USAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("USAGE_ARCHIVE_AFTER_DAYS", "400"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+ARCHIVE_MAX_BATCHES = int(os.getenv("ARCHIVE_MAX_BATCHES", "200"))
+
+# Bulk sends (chat.bulk): items per request, concurrent upstream calls, and the offline Batch API mode
+CHAT_BULK_MAX_ITEMS = int(os.getenv("CHAT_BULK_MAX_ITEMS", "100"))
+CHAT_BULK_CONCURRENCY = int(os.getenv("CHAT_BULK_CONCURRENCY", "8"))
+CHAT_BATCH_BILLING_RATE = os.getenv("CHAT_BATCH_BILLING_RATE", "0.5")
+OPENAI_BATCH_COST_RATE = os.getenv("OPENAI_BATCH_COST_RATE", "0.5")
+CHAT_BATCH_COMPLETION_WINDOW = os.getenv("CHAT_BATCH_COMPLETION_WINDOW", "24h")
+CHAT_BATCH_POLL_LIMIT = int(os.getenv("CHAT_BATCH_POLL_LIMIT", "50"))
+
+# Thread/message history listings (chat.history)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+HISTORY_PREVIEW_CHARS = int(os.getenv("HISTORY_PREVIEW_CHARS", "200"))
+
+# Direct-to-MinIO image uploads (chat.uploads)
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_UPLOAD_CONTENT_TYPES = [
+    t.strip() for t in os.getenv("IMAGE_UPLOAD_CONTENT_TYPES", "image/png,image/jpeg,image/webp,image/gif").split(",")
+    if t.strip()
+]
+IMAGE_UPLOAD_URL_TTL = int(os.getenv("IMAGE_UPLOAD_URL_TTL", "600"))
+IMAGE_UPLOAD_CONFIRM_GRACE_SECONDS = int(os.getenv("IMAGE_UPLOAD_CONFIRM_GRACE_SECONDS", "300"))
+# Normalised copies of uploads (chat.imaging): fit the vision models' own
+# downscale (long side <= 2048, short side <= 768) plus a thumbnail
+IMAGE_VISION_MAX_SIDE = int(os.getenv("IMAGE_VISION_MAX_SIDE", "2048"))
+IMAGE_VISION_SHORT_SIDE = int(os.getenv("IMAGE_VISION_SHORT_SIDE", "768"))
+IMAGE_THUMB_SIDE = int(os.getenv("IMAGE_THUMB_SIDE", "256"))
+IMAGE_NORMALIZE_FORMAT = os.getenv("IMAGE_NORMALIZE_FORMAT", "WEBP").upper()  # WEBP or JPEG
+IMAGE_NORMALIZE_QUALITY = int(os.getenv("IMAGE_NORMALIZE_QUALITY", "80"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+
+# Background image generation (chat.images)
+IMAGE_JOBS_PER_USER = int(os.getenv("IMAGE_JOBS_PER_USER", "2"))
+IMAGE_JOB_RETRY_AFTER = int(os.getenv("IMAGE_JOB_RETRY_AFTER", "10"))
+# the same prompt within this window returns the earlier job
+IMAGE_JOB_DEDUP_SECONDS = int(os.getenv("IMAGE_JOB_DEDUP_SECONDS", str(24 * 3600)))
+IMAGE_JOB_POLL_SECONDS = float(os.getenv("IMAGE_JOB_POLL_SECONDS", "1"))
+IMAGE_JOB_STREAM_SECONDS = float(os.getenv("IMAGE_JOB_STREAM_SECONDS", "120"))
+IMAGE_JOB_STALE_SECONDS = int(os.getenv("IMAGE_JOB_STALE_SECONDS", "900"))
+
+# Admission control for upstream chat calls (chat.admission); 0 = no limit
+ADMISSION_USER_CONCURRENCY = int(os.getenv("ADMISSION_USER_CONCURRENCY", "0"))
+ADMISSION_MODEL_CONCURRENCY = int(os.getenv("ADMISSION_MODEL_CONCURRENCY", "0"))
+ADMISSION_GLOBAL_CONCURRENCY = int(os.getenv("ADMISSION_GLOBAL_CONCURRENCY", "0"))
+ADMISSION_RPM = int(os.getenv("ADMISSION_RPM", "0"))
+ADMISSION_TPM = int(os.getenv("ADMISSION_TPM", "0"))
+# how long a send may wait for a slot before 429, and the Retry-After of a full semaphore
+ADMISSION_QUEUE_SECONDS = float(os.getenv("ADMISSION_QUEUE_SECONDS", "0"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+# a slot not released within this long (worker killed mid-call) is reclaimed
+ADMISSION_LEASE_SECONDS = float(os.getenv("ADMISSION_LEASE_SECONDS", "300"))
+
+# OpenAI HTTP pool (one long-lived client per api_key/base_url per process)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+# per-model overrides, e.g. "gpt-5=120,gpt-4.1-mini=20"
+OPENAI_MODEL_TIMEOUTS = {
+    name.strip(): float(secs)
+    for name, _, secs in (
+        item.partition("=") for item in os.getenv("OPENAI_MODEL_TIMEOUTS", "").split(",") if "=" in item
+    )
+}
+
+# Extra OpenAI-compatible endpoints for chat.router, e.g. "primary=https://api.openai.com/v1,backup=https://llm.example/v1";
+# each one's key comes from LLM_PROVIDER_<NAME>_API_KEY (default OPENAI_API_KEY)
+LLM_PROVIDERS = {
+    name.strip(): url.strip()
+    for name, _, url in (item.partition("=") for item in os.getenv("LLM_PROVIDERS", "").split(",") if "=" in item)
+}
+# upstream model -> endpoints in preference order, optionally with their own model name:
+# "gpt-5=primary|backup:gpt-5-2025-08-07,gpt-4.1-mini=backup"
+LLM_ROUTES = {
+    model.strip(): [t.strip() for t in targets.split("|") if t.strip()]
+    for model, _, targets in (item.partition("=") for item in os.getenv("LLM_ROUTES", "").split(",") if "=" in item)
+}
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "200"))
+LLM_ROUTER_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "5"))
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+LLM_ROUTER_EJECT_SECONDS = float(os.getenv("LLM_ROUTER_EJECT_SECONDS", "30"))
+# start the next endpoint when the first has not answered within its p95
+LLM_HEDGE = os.getenv("LLM_HEDGE", "False") == "True"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_THREADS = int(os.getenv("LLM_HEDGE_THREADS", "32"))
+
+# Use sqlite (and a local-memory cache instead of Redis) in tests when requested
 if os.getenv("USE_SQLITE_FOR_TESTS", "0") == "1" or os.getenv("PYTEST_CURRENT_TEST"):
     DATABASES["default"] = {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": ":memory:",
     }
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
 
 
 # MinIO config
@@ -136,6 +288,15 @@ MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "")
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "media")
+# host clients use for presigned uploads (defaults to MINIO_ENDPOINT)
+MINIO_PUBLIC_ENDPOINT = os.getenv("MINIO_PUBLIC_ENDPOINT", "")
+# set to skip the GetBucketLocation round-trip of the first request
+MINIO_REGION = os.getenv("MINIO_REGION", "")
+# uploads above this size go multipart in parts of this size (S3 minimum: 5 MiB)
+MINIO_PART_SIZE = int(os.getenv("MINIO_PART_SIZE", str(10 * 1024 * 1024)))
+MINIO_MAX_CONNECTIONS = int(os.getenv("MINIO_MAX_CONNECTIONS", "20"))
+MINIO_CONNECT_TIMEOUT = float(os.getenv("MINIO_CONNECT_TIMEOUT", "5"))
+MINIO_READ_TIMEOUT = float(os.getenv("MINIO_READ_TIMEOUT", "60"))
 
 # Production security hardening
 if not DEBUG:
@@ -3,11 +3,12 @@ from django.urls import path, include
 from django.conf import settings
 from billing.views import ModelsListView
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from .health import healthz
+from .health import healthz, metrics
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("healthz/", healthz, name="healthz"),
+    path("metrics", metrics, name="metrics"),
     path("api/accounts/", include("accounts.urls")),
     path("api/chat/", include("chat.urls")),
     path("api/billing/", include("billing.urls")),
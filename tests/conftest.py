@@ -15,3 +15,26 @@ def pytest_configure():
         # In case migrations already exist or no changes
         pass
 
+
+
+@pytest.fixture(autouse=True)
+def _reset_process_caches():
+    # locmem cache and the in-process catalog outlive the per-test DB rollback
+    from django.core.cache import cache
+    from billing import catalog
+    from chat import router
+
+    cache.clear()
+    catalog.invalidate_local()
+    router.reset()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    # Redis درون‌حافظه با Lua تا اسکریپت‌های واقعی (pre-auth، admission) اجرا شوند
+    import fakeredis
+    from config import redis_client
+
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_client, "_client", r)
+    return r
@@ -0,0 +1,114 @@
+import pytest
+from django.contrib.auth import get_user_model
+from analytics import metrics
+from billing.models import ModelCatalog, Wallet
+from chat import admission, openai_client
+
+
+class DummyResp:
+    class Choice:
+        class Message:
+            content = "hello"
+
+        message = Message()
+
+    choices = [Choice()]
+
+
+@pytest.fixture
+def sender(client, settings):
+    settings.ADMISSION_USER_CONCURRENCY = 1
+    ModelCatalog.objects.create(alias="robot-adm", model_name="m", input_per_million_usd=1, output_per_million_usd=1)
+    u = get_user_model().objects.create_user(username="admission")
+    Wallet.objects.filter(user=u).update(balance_tokens=1_000_000)
+    client.force_login(u)
+    metrics.reset()
+
+    def send():
+        return client.post("/api/chat/send", {"model_alias": "robot-adm", "prompt": "hi"},
+                           content_type="application/json")
+
+    return send
+
+
+@pytest.mark.django_db
+def test_full_semaphore_fast_fails_with_retry_after(sender, settings, monkeypatch):
+    settings.ADMISSION_RETRY_AFTER = 3
+    monkeypatch.setattr(admission, "_acquire", lambda *a: (None, admission.Rejected("user", 3)))
+    monkeypatch.setattr(openai_client, "chat_completion", lambda *a, **kw: pytest.fail("upstream called"))
+
+    res = sender()
+    assert res.status_code == 429
+    assert res["Retry-After"] == "3"
+    assert metrics.counter_value("admission.decisions", model="robot-adm", outcome="rejected", scope="user") == 1
+
+
+@pytest.mark.django_db
+def test_queued_send_is_admitted_before_deadline_and_released(sender, settings, monkeypatch):
+    settings.ADMISSION_QUEUE_SECONDS = 1
+    attempts = iter([(None, admission.Rejected("user", 2)), (admission.Ticket("t", ["admit:sem:user:1"]), None)])
+    released = []
+    monkeypatch.setattr(admission, "_acquire", lambda *a: next(attempts))
+    monkeypatch.setattr(admission, "release", released.append)
+    monkeypatch.setattr(openai_client, "chat_completion", lambda *a, **kw: (DummyResp(), (10, 5)))
+
+    assert sender().status_code == 200
+    assert [t.token for t in released] == ["t"]
+    assert metrics.counter_value("admission.decisions", model="robot-adm", outcome="queued") == 1
+
+
+@pytest.mark.django_db
+def test_admits_when_redis_is_down(sender, monkeypatch):
+    def redis_down(*args):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(admission, "_acquire", redis_down)
+    monkeypatch.setattr(openai_client, "chat_completion", lambda *a, **kw: (DummyResp(), (10, 5)))
+    assert sender().status_code == 200
+    assert metrics.counter_value("admission.decisions", model="robot-adm", outcome="error") == 1
+
+
+def test_lua_semaphore_acquires_rejects_and_releases(settings, fake_redis):
+    settings.ADMISSION_USER_CONCURRENCY, settings.ADMISSION_MODEL_CONCURRENCY = 1, 2
+    settings.ADMISSION_GLOBAL_CONCURRENCY = settings.ADMISSION_RPM = settings.ADMISSION_TPM = 0
+    settings.ADMISSION_QUEUE_SECONDS, settings.ADMISSION_RETRY_AFTER = 0, 4
+
+    first = admission.admit(7, "robot-adm", 100)
+    assert first.keys == ["admit:sem:user:7", "admit:sem:model:robot-adm"]
+    assert fake_redis.zrange("admit:sem:user:7", 0, -1) == [first.token.encode()]
+    with pytest.raises(admission.Rejected) as exc:
+        admission.admit(7, "robot-adm", 100)
+    assert (exc.value.scope, exc.value.retry_after) == ("user", 4)
+    other = admission.admit(8, "robot-adm", 100)  # the model still has a slot
+    with pytest.raises(admission.Rejected) as exc:
+        admission.admit(9, "robot-adm", 100)
+    assert exc.value.scope == "model"
+
+    admission.release(first)
+    assert fake_redis.zcard("admit:sem:user:7") == 0
+    again = admission.admit(7, "robot-adm", 100)
+    assert again.token != first.token
+    admission.release(other)
+    admission.release(again)
+    assert fake_redis.zcard("admit:sem:model:robot-adm") == 0
+
+
+def test_lua_rate_windows_count_per_minute(settings, fake_redis, monkeypatch):
+    settings.ADMISSION_USER_CONCURRENCY = settings.ADMISSION_MODEL_CONCURRENCY = settings.ADMISSION_GLOBAL_CONCURRENCY = 0
+    settings.ADMISSION_RPM, settings.ADMISSION_TPM, settings.ADMISSION_QUEUE_SECONDS = 3, 250, 0
+    now = [60_000 * 60 + 15.0]
+    monkeypatch.setattr(admission.time, "time", lambda: now[0])
+
+    admission.admit(1, "robot-adm", 100)
+    admission.admit(1, "robot-adm", 100)
+    with pytest.raises(admission.Rejected) as exc:
+        admission.admit(1, "robot-adm", 100)  # 300 > TPM
+    assert (exc.value.scope, exc.value.retry_after) == ("tpm", 45)
+    admission.admit(1, "robot-adm", 50)
+    with pytest.raises(admission.Rejected) as exc:
+        admission.admit(1, "robot-adm", 1)
+    assert exc.value.scope == "rpm"
+    assert fake_redis.get("admit:rpm:60000") == b"3"
+
+    now[0] += 60  # the next window starts empty
+    assert admission.admit(1, "robot-adm", 200).keys == []
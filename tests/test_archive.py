@@ -0,0 +1,83 @@
+from datetime import timedelta
+from decimal import Decimal
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from analytics import archive
+from analytics.models import ArchiveBatch
+from benchmarks.fake_s3 import FakeS3
+from billing import ledger
+from billing.models import UsageRecord, Wallet
+from chat import storage
+from chat.models import ChatMessage, ChatThread, MemorySummary
+
+
+@pytest.fixture
+def s3(settings, monkeypatch):
+    fake = FakeS3(keep_bodies=True).start_in_thread()
+    settings.MINIO_ENDPOINT = fake.endpoint
+    settings.MINIO_ACCESS_KEY, settings.MINIO_SECRET_KEY = "bench", "bench-secret"
+    settings.MINIO_BUCKET = "kids-archive"
+    settings.MINIO_REGION = "us-east-1"
+    settings.ARCHIVE_BATCH_SIZE = 3
+    monkeypatch.setattr(storage, "_state", {"client": None, "bucket_ready": False})
+    return fake
+
+
+def age(qs, days):
+    qs.update(created_at=timezone.now() - timedelta(days=days))
+
+
+@pytest.mark.django_db
+def test_messages_archive_only_when_old_and_summarised(s3, settings):
+    settings.CHAT_ARCHIVE_AFTER_DAYS = 30
+    user = get_user_model().objects.create_user(username="archivist")
+    thread = ChatThread.objects.create(user=user, model_alias="robot")
+    other = ChatThread.objects.create(user=user, model_alias="robot")
+    msgs = [ChatMessage.objects.create(thread=thread, role="user", content=f"m{i}", meta={"i": i}) for i in range(8)]
+    unsummarised = ChatMessage.objects.create(thread=other, role="user", content="never summarised")
+    age(ChatMessage.objects.filter(id__lte=msgs[6].id) | ChatMessage.objects.filter(id=unsummarised.id), 60)
+    MemorySummary.objects.create(thread=thread, summary="s", up_to_message_id=msgs[5].id)
+
+    assert archive.archive("messages") == 6  # m0..m5: old and covered; m6 is not covered, m7 is recent
+    assert list(ChatMessage.objects.values_list("content", flat=True).order_by("id")) == ["m6", "m7", "never summarised"]
+    batches = list(ArchiveBatch.objects.order_by("first_id"))
+    assert [b.rows for b in batches] == [3, 3]
+    assert all(b.object_name in s3.bodies for b in batches)
+    assert archive.archive("messages") == 0
+
+    assert archive.restore(batches[0].object_name, thread_id=other.id) == 0
+    assert archive.restore(batches[0].object_name) == 3
+    restored = ChatMessage.objects.get(id=msgs[0].id)
+    assert restored.meta == {"i": 0} and restored.created_at < timezone.now() - timedelta(days=59)
+    assert not ArchiveBatch.objects.filter(id=batches[0].id).exists()
+    assert batches[0].object_name not in s3.objects
+
+
+@pytest.mark.django_db
+def test_archived_usage_still_reconciles(s3, settings):
+    settings.USAGE_ARCHIVE_AFTER_DAYS = 365
+    user = get_user_model().objects.create_user(username="spender")
+    Wallet.objects.filter(user=user).update(balance_tokens=-40)
+    ledger.apply([ledger._entry(user.id, "robot", 10, 5, 5, Decimal("0.01"), f"k{i}") for i in range(4)])
+    age(UsageRecord.objects.all(), 400)
+
+    call_command("archive_history", "--kind", "usage", verbosity=0)
+    assert UsageRecord.objects.count() == 0
+    assert ArchiveBatch.objects.filter(kind="usage").count() == 2
+    call_command("reconcile_ledger", verbosity=0)
+
+    for batch in ArchiveBatch.objects.all():
+        archive.restore(batch.object_name)
+    assert UsageRecord.objects.count() == 4
+    call_command("reconcile_ledger", verbosity=0)
+
+
+@pytest.mark.django_db
+def test_zero_horizon_disables(s3, settings):
+    settings.CHAT_ARCHIVE_AFTER_DAYS = 0
+    thread = ChatThread.objects.create(user=get_user_model().objects.create_user(username="z"), model_alias="robot")
+    ChatMessage.objects.create(thread=thread, role="user", content="old")
+    age(ChatMessage.objects.all(), 10_000)
+    assert archive.archive("messages") == 0
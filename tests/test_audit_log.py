@@ -0,0 +1,15 @@
+import json
+import logging
+
+import pytest
+from django.contrib.auth import get_user_model
+
+
+@pytest.mark.django_db
+def test_sync_requests_log_the_user_even_when_the_view_never_reads_it(client, caplog):
+    u = get_user_model().objects.create_user(username="audited")
+    client.force_login(u)
+    with caplog.at_level(logging.INFO, logger="audit"):
+        client.get("/no-such-page")
+    payload = json.loads(next(r for r in caplog.records if r.name == "audit").getMessage())
+    assert payload["path"] == "/no-such-page" and payload["user_id"] == u.id
@@ -0,0 +1,234 @@
+import threading
+from types import SimpleNamespace
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from billing import debit
+from billing.models import ModelCatalog, Transaction, UsageRecord, Wallet
+from chat import bulk, openai_client
+from chat.models import ChatBatch, ChatMessage, ChatThread
+
+
+def _reply(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+@pytest.fixture
+def teacher(db):
+    ModelCatalog.objects.create(alias="robot-b", model_name="gpt-b", input_per_million_usd=1, output_per_million_usd=2)
+    u = get_user_model().objects.create_user(username="teacher")
+    Wallet.objects.filter(user=u).update(balance_tokens=10_000)
+    return u
+
+
+@pytest.mark.django_db
+def test_interactive_bulk_fans_out_and_bills_once(client, teacher, settings, monkeypatch):
+    settings.CHAT_BULK_CONCURRENCY = 3
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def fake_completion(model, messages, tools=None):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        try:
+            prompt = messages[-1]["content"]
+            if prompt == "boom":
+                raise RuntimeError("upstream down")
+            return _reply(f"re: {prompt}"), (10, 5)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    monkeypatch.setattr(openai_client, "chat_completion", fake_completion)
+    thread = ChatThread.objects.create(user=teacher, model_alias="robot-b")
+    items = [{"prompt": f"q{i}"} for i in range(6)] + [
+        {"prompt": "boom"}, {"prompt": "x", "thread_id": 999_999}, {"prompt": "in thread", "thread_id": thread.id},
+    ]
+    client.force_login(teacher)
+
+    with CaptureQueriesContext(connection) as ctx:
+        res = client.post("/api/chat/send/bulk", {"model_alias": "robot-b", "items": items},
+                          content_type="application/json")
+    assert res.status_code == 200
+    results = res.json()["results"]
+    assert [r["status"] for r in results] == [200] * 6 + [502, 404, 200]
+    assert results[8]["thread_id"] == str(thread.id) and results[0]["reply"] == "re: q0"
+    assert peak[0] <= 3
+
+    assert ChatMessage.objects.filter(thread__user=teacher).count() == 14
+    assert Wallet.objects.get(user=teacher).balance_tokens == 10_000 - 7 * 15
+    assert UsageRecord.objects.filter(user=teacher).count() == 7
+    inserts = [q for q in ctx.captured_queries if q["sql"].startswith('INSERT INTO "chat_chatmessage"')]
+    debits = [q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "billing_wallet"')]
+    assert len(inserts) == 1 and len(debits) == 1
+
+
+@pytest.mark.django_db
+def test_identical_prompts_share_one_upstream_call(client, teacher, monkeypatch):
+    ModelCatalog.objects.filter(alias="robot-b").update(response_cache_enabled=True)
+    calls = []
+
+    def fake_completion(model, messages, tools=None):
+        calls.append(messages[-1]["content"])
+        return _reply("a story"), (100, 100)
+
+    monkeypatch.setattr(openai_client, "chat_completion", fake_completion)
+    client.force_login(teacher)
+    res = client.post("/api/chat/send/bulk", {"model_alias": "robot-b", "items": [{"prompt": "Tell a story"}] * 4},
+                      content_type="application/json")
+    results = res.json()["results"]
+    assert calls == ["Tell a story"]
+    assert [r["cached"] for r in results] == [False, True, True, True]
+    # یک پاسخ کامل و سه پاسخ با نرخ cache-hit (0.25)
+    assert Wallet.objects.get(user=teacher).balance_tokens == 10_000 - 200 - 3 * 50
+
+
+@pytest.mark.django_db
+def test_bulk_that_wallet_cannot_cover_stores_nothing(client, teacher, settings, monkeypatch):
+    settings.WALLET_PREAUTH = "off"
+    Wallet.objects.filter(user=teacher).update(balance_tokens=20)
+    monkeypatch.setattr(openai_client, "chat_completion", lambda model, messages, tools=None: (_reply("hi"), (10, 5)))
+    client.force_login(teacher)
+    res = client.post("/api/chat/send/bulk", {"model_alias": "robot-b", "items": [{"prompt": "a"}, {"prompt": "b"}]},
+                      content_type="application/json")
+    assert res.status_code == 402
+    assert not ChatMessage.objects.exists()
+    assert Wallet.objects.get(user=teacher).balance_tokens == 20
+
+
+@pytest.mark.django_db
+def test_offline_batch_is_collected_at_batch_rate(client, teacher, monkeypatch):
+    submitted = {}
+
+    def fake_submit(model, requests):
+        submitted.update(model=model, requests=list(requests))
+        return "batch_abc", "default"
+
+    def fake_results(model, provider, batch_id):
+        assert (provider, batch_id) == ("default", "batch_abc")
+        rows = {}
+        for custom_id, messages in submitted["requests"]:
+            rows[custom_id] = {"custom_id": custom_id, "response": {"status_code": 200, "body": {
+                "choices": [{"message": {"content": f"re: {messages[-1]['content']}"}}],
+                "usage": {"prompt_tokens": 40, "completion_tokens": 20},
+            }}}
+        return "completed", rows
+
+    monkeypatch.setattr(openai_client, "submit_batch", fake_submit)
+    client.force_login(teacher)
+    res = client.post("/api/chat/send/bulk", {
+        "mode": "offline", "model_alias": "robot-b", "items": [{"prompt": "one"}, {"prompt": "two"}, {}],
+    }, content_type="application/json")
+    assert res.status_code == 202
+    body = res.json()
+    assert body["status"] == "submitted" and [r["status"] for r in body["results"]] == [400]
+    assert submitted["model"] == "gpt-b" and [c for c, _ in submitted["requests"]] == ["item-0", "item-1"]
+
+    monkeypatch.setattr(openai_client, "batch_results", fake_results)
+    assert bulk.poll() == 1
+    batch = ChatBatch.objects.get(id=body["batch_id"])
+    assert batch.status == "completed"
+    detail = client.get(f"/api/chat/send/bulk/{batch.id}").json()
+    assert [r["status"] for r in detail["results"]] == [200, 200, 400]
+    assert detail["results"][1]["reply"] == "re: two"
+    # هر پاسخ 60 توکن، با نرخ batch نصف
+    assert Wallet.objects.get(user=teacher).balance_tokens == 10_000 - 2 * 30
+    assert Transaction.objects.filter(user=teacher, reason="batch").count() == 2
+    assert bulk.poll() == 0
+
+
+@pytest.mark.django_db
+def test_offline_batch_rejects_mixed_models(client, teacher):
+    ModelCatalog.objects.create(alias="robot-c", model_name="gpt-c", input_per_million_usd=1, output_per_million_usd=2)
+    client.force_login(teacher)
+    res = client.post("/api/chat/send/bulk", {
+        "mode": "offline", "items": [{"prompt": "a", "model_alias": "robot-b"}, {"prompt": "b", "model_alias": "robot-c"}],
+    }, content_type="application/json")
+    assert res.status_code == 400
+    assert not ChatThread.objects.exists()
+
+
+@pytest.mark.django_db
+def test_offline_reservations_stay_in_chat_batch(client, teacher, settings, monkeypatch, fake_redis):
+    settings.WALLET_PREAUTH = "redis"
+    settings.WALLET_PREAUTH_OUTPUT_TOKENS = 2000
+    monkeypatch.setattr(openai_client, "submit_batch", lambda model, requests: ("batch_x", "default"))
+    client.force_login(teacher)
+
+    def submit():
+        return client.post("/api/chat/send/bulk", {
+            "mode": "offline", "model_alias": "robot-b", "items": [{"prompt": "a"}, {"prompt": "b"}],
+        }, content_type="application/json")
+
+    first = submit()
+    assert first.status_code == 202
+    assert not fake_redis.keys("wallet:avail:*")
+    # حدود ۲۰۰۰ توکن رزرو از ۱۰٬۰۰۰؛ batch پنجم دیگر جا نمی‌شود
+    assert [submit().status_code for _ in range(4)] == [202, 202, 202, 402]
+
+    monkeypatch.setattr(openai_client, "batch_results", lambda model, provider, batch_id: ("expired", None))
+    assert bulk.poll() == 4
+    assert ChatBatch.objects.filter(status="failed").count() == 4
+    assert submit().status_code == 202
+    wallet = Wallet.objects.get(user=teacher)
+    assert wallet.balance_tokens == 10_000
+    assert wallet.reserved_tokens == ChatBatch.objects.get(status="submitted").reserved_tokens
+
+
+@pytest.mark.django_db
+def test_batch_reservation_is_not_spent_by_interactive_sends(client, teacher, settings, monkeypatch):
+    settings.WALLET_PREAUTH_OUTPUT_TOKENS = 2000
+    Wallet.objects.filter(user=teacher).update(balance_tokens=2500)
+    monkeypatch.setattr(openai_client, "submit_batch", lambda model, requests: ("batch_r", "default"))
+    monkeypatch.setattr(openai_client, "chat_completion", lambda *a, **kw: pytest.fail("upstream called"))
+    client.force_login(teacher)
+
+    res = client.post("/api/chat/send/bulk", {"mode": "offline", "model_alias": "robot-b", "items": [{"prompt": "a"}]},
+                      content_type="application/json")
+    assert res.status_code == 202
+    reserved = ChatBatch.objects.get().reserved_tokens
+    assert Wallet.objects.get(user=teacher).reserved_tokens == reserved > 1000
+    res = client.post("/api/chat/send/bulk", {"model_alias": "robot-b", "items": [{"prompt": "b"}]},
+                      content_type="application/json")
+    assert res.status_code == 402
+    with pytest.raises(ValueError):
+        debit.debit(teacher.id, 2500 - reserved + 1)
+
+
+@pytest.mark.django_db
+def test_rejected_offline_submit_creates_no_threads(client, teacher, settings, monkeypatch):
+    Wallet.objects.filter(user=teacher).update(balance_tokens=10)
+    monkeypatch.setattr(openai_client, "submit_batch", lambda model, requests: pytest.fail("submitted"))
+    client.force_login(teacher)
+    res = client.post("/api/chat/send/bulk", {"mode": "offline", "model_alias": "robot-b", "items": [{"prompt": "a"}]},
+                      content_type="application/json")
+    assert res.status_code == 402
+    assert not ChatThread.objects.exists()
+    assert Wallet.objects.get(user=teacher).reserved_tokens == 0
+
+
+@pytest.mark.django_db
+def test_batch_over_its_reservation_keeps_what_the_wallet_covers(client, teacher, monkeypatch):
+    monkeypatch.setattr(openai_client, "submit_batch", lambda model, requests: ("batch_big", "default"))
+    client.force_login(teacher)
+    body = client.post("/api/chat/send/bulk", {
+        "mode": "offline", "model_alias": "robot-b", "items": [{"prompt": "one"}, {"prompt": "two"}],
+    }, content_type="application/json").json()
+
+    def fake_results(model, provider, batch_id):
+        # هر پاسخ 12٬000 توکن، با نرخ batch 6٬000؛ فقط اولی در 10٬000 جا می‌شود
+        return "completed", {custom: {"custom_id": custom, "response": {"status_code": 200, "body": {
+            "choices": [{"message": {"content": "long"}}], "usage": {"prompt_tokens": 2000, "completion_tokens": 10_000},
+        }}} for custom in ("item-0", "item-1")}
+
+    monkeypatch.setattr(openai_client, "batch_results", fake_results)
+    assert bulk.poll() == 1
+    batch = ChatBatch.objects.get(id=body["batch_id"])
+    assert batch.status == "completed"
+    assert [(r["status"], r.get("error")) for r in sorted(batch.results, key=lambda r: r["index"])] == [
+        (200, None), (402, "insufficient wallet"),
+    ]
+    wallet = Wallet.objects.get(user=teacher)
+    assert (wallet.balance_tokens, wallet.reserved_tokens) == (4_000, 0)
+    assert ChatMessage.objects.filter(thread__user=teacher).count() == 2
@@ -0,0 +1,45 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from billing import catalog
+from billing.models import ModelCatalog, Wallet
+from billing.pricing import charge_wallet_for_usage
+
+
+@pytest.mark.django_db
+def test_lookups_are_served_from_memory(django_assert_num_queries):
+    ModelCatalog.objects.create(alias="robot-c", model_name="m", input_per_million_usd=1, output_per_million_usd=2)
+    assert catalog.get_enabled("robot-c").model_name == "m"  # warm up
+    with django_assert_num_queries(0):
+        assert catalog.get_enabled("robot-c") is not None
+        assert catalog.get_enabled("nope") is None
+        assert [c.alias for c in catalog.list_enabled()] == ["robot-c"]
+
+
+@pytest.mark.django_db
+def test_admin_edit_and_seed_invalidate(client, django_capture_on_commit_callbacks):
+    row = ModelCatalog.objects.create(alias="robot-c", model_name="m", input_per_million_usd=1, output_per_million_usd=2)
+    catalog.get_enabled("robot-c")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        row.enabled = False
+        row.save()
+    assert catalog.get_enabled("robot-c") is None
+
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command("seed_models", verbosity=0)
+    aliases = [item["alias"] for item in client.get("/api/models").json()]
+    assert "robot-5" in aliases and "robot-c" not in aliases
+
+
+@pytest.mark.django_db
+def test_charge_with_resolved_catalog_skips_catalog_queries():
+    cat = ModelCatalog.objects.create(alias="robot-c", model_name="m", input_per_million_usd=1, output_per_million_usd=2)
+    u = get_user_model().objects.create_user(username="cat-user")
+    Wallet.objects.filter(user=u).update(balance_tokens=1000)
+    catalog.invalidate_local()
+    with CaptureQueriesContext(connection) as ctx:
+        charge_wallet_for_usage(u, "robot-c", 10, 20, cat=cat)
+    assert not [q for q in ctx.captured_queries if "billing_modelcatalog" in q["sql"]]
@@ -0,0 +1,152 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient
+from billing.models import Wallet, ModelCatalog
+from chat import openai_client
+from chat.models import ChatMessage
+
+
+class DummyResp:
+    class Choice:
+        class Message:
+            content = "hello"
+
+        message = Message()
+
+    choices = [Choice()]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_send_persists_and_charges(monkeypatch):
+    async def fake_completion(model, messages, tools=None):
+        return DummyResp(), (100, 200)
+
+    monkeypatch.setattr(openai_client, "async_chat_completion", fake_completion)
+    ModelCatalog.objects.create(
+        alias="robot-async", model_name="gpt-4o-mini",
+        input_per_million_usd=0.150, output_per_million_usd=0.600, enabled=True,
+    )
+    u = get_user_model().objects.create_user(username="async-user")
+    Wallet.objects.filter(user=u).update(balance_tokens=1_000_000)
+
+    async def send():
+        client = AsyncClient()
+        await client.aforce_login(u)
+        return await client.post(
+            "/api/chat/send/async",
+            {"model_alias": "robot-async", "prompt": "hi"},
+            content_type="application/json",
+        )
+
+    res = async_to_sync(send)()
+    assert res.status_code == 200
+    assert res.json()["reply"] == "hello"
+    assert ChatMessage.objects.count() == 2
+    assert Wallet.objects.get(user=u).balance_tokens == 1_000_000 - 300
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_send_requires_auth():
+    res = async_to_sync(AsyncClient().post)(
+        "/api/chat/send/async", {"model_alias": "x", "prompt": "hi"}, content_type="application/json"
+    )
+    assert res.status_code in (401, 403)
+
+
+class FakeAsyncStream:
+    def __init__(self, deltas, usage=None):
+        self.deltas = deltas
+        self.usage = usage
+        self.closed = False
+
+    async def __aiter__(self):
+        for d in self.deltas:
+            if isinstance(d, BaseException):
+                raise d
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=d))])
+        if self.usage:
+            yield SimpleNamespace(usage=SimpleNamespace(**self.usage), choices=[])
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def streamer(db):
+    ModelCatalog.objects.create(
+        alias="robot-async", model_name="gpt-4o-mini",
+        input_per_million_usd=0.150, output_per_million_usd=0.600, enabled=True,
+    )
+    u = get_user_model().objects.create_user(username="async-streamer")
+    Wallet.objects.filter(user=u).update(balance_tokens=1_000_000)
+    return u
+
+
+def _post(user, body, consume=True):
+    async def send():
+        client = AsyncClient()
+        await client.aforce_login(user)
+        res = await client.post("/api/chat/send/async", body, content_type="application/json")
+        if consume and res.streaming:
+            res.body = b"".join([part async for part in res.streaming_content]).decode()
+        return res
+
+    return async_to_sync(send)()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_send_streams_deltas_on_the_event_loop(streamer, monkeypatch):
+    fake = FakeAsyncStream(["Sky ", "is ", "blue"], usage={"prompt_tokens": 40, "completion_tokens": 3})
+
+    async def open_stream(model, messages):
+        return fake
+
+    monkeypatch.setattr(openai_client, "async_chat_completion_stream", open_stream)
+    res = _post(streamer, {"model_alias": "robot-async", "prompt": "why?", "stream": True})
+    assert res["Content-Type"] == "text/event-stream"
+    assert res.body.count("event: delta") == 3 and "event: done" in res.body
+    assert Wallet.objects.get(user=streamer).balance_tokens == 1_000_000 - 43
+    assert ChatMessage.objects.get(role="assistant").content == "Sky is blue"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_stream_cancelled_by_disconnect_bills_relayed_deltas(streamer, settings, monkeypatch, fake_redis):
+    from billing import debit
+
+    settings.WALLET_PREAUTH = "redis"
+    fake = FakeAsyncStream(["a", "b", asyncio.CancelledError()])
+
+    async def open_stream(model, messages):
+        return fake
+
+    monkeypatch.setattr(openai_client, "async_chat_completion_stream", open_stream)
+    with pytest.raises(asyncio.CancelledError):
+        _post(streamer, {"model_alias": "robot-async", "prompt": "hi", "stream": True})
+
+    assert fake.closed
+    reply = ChatMessage.objects.get(role="assistant")
+    assert reply.content == "ab" and reply.meta["cancelled"] is True
+    prompt_estimate = ChatMessage.objects.get(role="user").tokens_in
+    assert Wallet.objects.get(user=streamer).balance_tokens == 1_000_000 - prompt_estimate - 2
+    # hold settled to the billed amount, not left reserved until WALLET_PREAUTH_TTL
+    assert int(fake_redis.get(debit.AVAIL_KEY.format(streamer.id))) == 1_000_000 - prompt_estimate - 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_send_cancelled_mid_call_releases_hold(streamer, settings, monkeypatch, fake_redis):
+    from billing import debit
+
+    settings.WALLET_PREAUTH = "redis"
+
+    async def cancelled(model, messages, tools=None):
+        raise asyncio.CancelledError()
+
+    monkeypatch.setattr(openai_client, "async_chat_completion", cancelled)
+    with pytest.raises(asyncio.CancelledError):
+        _post(streamer, {"model_alias": "robot-async", "prompt": "hi"})
+    assert int(fake_redis.get(debit.AVAIL_KEY.format(streamer.id))) == 1_000_000
+    assert not ChatMessage.objects.exists()
@@ -38,7 +38,7 @@ def test_chat_deducts_wallet(client, settings, monkeypatch):
     def dummy_chat_completion(model, messages, tools=None):
         return DummyResp(), (100, 200)
 
-    openai_client.chat_completion = dummy_chat_completion
+    monkeypatch.setattr(openai_client, "chat_completion", dummy_chat_completion)
 
     User = get_user_model()
     u = User.objects.create_user(username="u1")
@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth import get_user_model
+from billing.models import Wallet, ModelCatalog
+from chat import openai_client
+from chat.models import ChatMessage
+
+
+class FakeStream:
+    def __init__(self, deltas, usage=None):
+        self.deltas = deltas
+        self.usage = usage
+        self.closed = False
+
+    def __iter__(self):
+        for d in self.deltas:
+            if isinstance(d, Exception):
+                raise d
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=d))])
+        if self.usage:
+            yield SimpleNamespace(usage=SimpleNamespace(**self.usage), choices=[])
+
+    def close(self):
+        self.closed = True
+
+
+def _setup(client):
+    ModelCatalog.objects.create(
+        alias="robot-stream", model_name="gpt-4o-mini",
+        input_per_million_usd=0.150, output_per_million_usd=0.600, enabled=True,
+    )
+    u = get_user_model().objects.create_user(username="streamer")
+    Wallet.objects.filter(user=u).update(balance_tokens=1_000_000)
+    client.force_login(u)
+    return u
+
+
+@pytest.mark.django_db
+def test_stream_relays_deltas_and_bills_from_usage(client, monkeypatch):
+    u = _setup(client)
+    fake = FakeStream(["Sky ", "is ", "blue"], usage={"prompt_tokens": 40, "completion_tokens": 3})
+    monkeypatch.setattr(openai_client, "chat_completion_stream", lambda model, messages: fake)
+
+    res = client.post(
+        "/api/chat/send",
+        {"model_alias": "robot-stream", "prompt": "why?", "stream": True},
+        content_type="application/json",
+    )
+    assert res["Content-Type"] == "text/event-stream"
+    body = b"".join(res.streaming_content).decode()
+    assert body.count("event: delta") == 3
+    assert "event: done" in body
+
+    assert Wallet.objects.get(user=u).balance_tokens == 1_000_000 - 43
+    assert ChatMessage.objects.get(role="assistant").content == "Sky is blue"
+
+
+@pytest.mark.django_db
+def test_stream_disconnect_bills_only_generated_tokens(client, monkeypatch):
+    u = _setup(client)
+    fake = FakeStream(["a", "b", "c", "d"], usage={"prompt_tokens": 40, "completion_tokens": 4})
+    monkeypatch.setattr(openai_client, "chat_completion_stream", lambda model, messages: fake)
+
+    res = client.post(
+        "/api/chat/send",
+        {"model_alias": "robot-stream", "prompt": "hi", "stream": "1"},
+        content_type="application/json",
+    )
+    frames = iter(res.streaming_content)
+    next(frames)  # start
+    next(frames)  # first delta
+    res.close()  # client went away
+
+    assert fake.closed
+    reply = ChatMessage.objects.get(role="assistant")
+    assert reply.content == "a"
+    assert reply.meta["cancelled"] is True
+    prompt_estimate = ChatMessage.objects.get(role="user").tokens_in
+    assert Wallet.objects.get(user=u).balance_tokens == 1_000_000 - prompt_estimate - 1
+
+
+@pytest.mark.django_db
+def test_stream_upstream_error_bills_relayed_deltas_and_ends_with_error(client, monkeypatch):
+    u = _setup(client)
+    fake = FakeStream(["a", "b", RuntimeError("connection reset")])
+    monkeypatch.setattr(openai_client, "chat_completion_stream", lambda model, messages: fake)
+
+    res = client.post("/api/chat/send", {"model_alias": "robot-stream", "prompt": "hi", "stream": True},
+                      content_type="application/json")
+    body = b"".join(res.streaming_content).decode()
+    assert body.count("event: delta") == 2 and "event: error" in body and "event: done" not in body
+
+    assert fake.closed
+    reply = ChatMessage.objects.get(role="assistant")
+    assert reply.content == "ab" and reply.meta["upstream_error"] is True
+    prompt_estimate = ChatMessage.objects.get(role="user").tokens_in
+    assert Wallet.objects.get(user=u).balance_tokens == 1_000_000 - prompt_estimate - 2
+
+
+@pytest.mark.django_db
+def test_stream_closed_before_first_frame_releases_hold_and_ticket(client, settings, monkeypatch, fake_redis):
+    from billing import debit
+    from chat import admission
+
+    settings.WALLET_PREAUTH = "redis"
+    u = _setup(client)
+    released = []
+    monkeypatch.setattr(admission, "release", released.append)
+    monkeypatch.setattr(openai_client, "chat_completion_stream",
+                        lambda model, messages: pytest.fail("upstream opened for a closed stream"))
+
+    res = client.post("/api/chat/send", {"model_alias": "robot-stream", "prompt": "hi", "stream": True},
+                      content_type="application/json")
+    assert int(fake_redis.get(debit.AVAIL_KEY.format(u.id))) < 1_000_000
+    res.close()
+
+    assert int(fake_redis.get(debit.AVAIL_KEY.format(u.id))) == 1_000_000
+    assert len(released) == 1
+    assert not ChatMessage.objects.exists()
@@ -0,0 +1,54 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from billing.models import ModelCatalog, Wallet
+from chat import openai_client
+from chat.models import ChatThread, ChatMessage
+
+
+class DummyResp:
+    class Choice:
+        class Message:
+            content = "hello"
+
+        message = Message()
+
+    choices = [Choice()]
+
+
+def _queries(sql_list, table):
+    return [q for q in sql_list if f'FROM "{table}"' in q["sql"]]
+
+
+@pytest.mark.django_db
+def test_hot_thread_builds_prompt_without_history_queries(client, monkeypatch, django_capture_on_commit_callbacks):
+    monkeypatch.setattr(openai_client, "chat_completion", lambda model, messages, tools=None: (DummyResp(), (10, 5)))
+    ModelCatalog.objects.create(alias="robot-h", model_name="m", input_per_million_usd=1, output_per_million_usd=1)
+    u = get_user_model().objects.create_user(username="hot")
+    Wallet.objects.filter(user=u).update(balance_tokens=1_000_000)
+    thread = ChatThread.objects.create(user=u, model_alias="robot-h")
+    client.force_login(u)
+
+    def send(prompt):
+        with CaptureQueriesContext(connection) as ctx, django_capture_on_commit_callbacks(execute=True):
+            res = client.post("/api/chat/send", {"model_alias": "robot-h", "prompt": prompt,
+                                                 "thread_id": thread.id}, content_type="application/json")
+        assert res.status_code == 200
+        return ctx.captured_queries
+
+    cold = send("first")
+    warm = send("second")
+    history_reads = lambda qs: len(_queries(qs, "chat_chatmessage")) + len(_queries(qs, "chat_memorysummary"))
+    print(f"queries per send: cold={len(cold)} warm={len(warm)} "
+          f"(history reads {history_reads(cold)} -> {history_reads(warm)})")
+    assert history_reads(cold) == 2
+    assert history_reads(warm) == 0
+    assert len(warm) < len(cold)
+
+    # the warm window already contains the first exchange
+    from chat.prompts import build_messages_with_memory
+
+    messages, _ = build_messages_with_memory(thread, "third", ModelCatalog.objects.get(alias="robot-h"))
+    assert [m["content"] for m in messages[1:]] == ["first", "hello", "second", "hello", "third"]
+    assert ChatMessage.objects.filter(thread=thread).count() == 4
@@ -0,0 +1,109 @@
+from datetime import timedelta
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from chat.models import ChatMessage, ChatThread
+
+
+@pytest.fixture
+def user(client):
+    u = get_user_model().objects.create_user(username="reader")
+    client.force_login(u)
+    return u
+
+
+def walk(client, url):
+    items, cursor = [], None
+    while True:
+        res = client.get(url, {"limit": 3, **({"cursor": cursor} if cursor else {})})
+        assert res.status_code == 200
+        items += res.json()["results"]
+        cursor = res.json()["next_cursor"]
+        if cursor is None:
+            return items
+
+
+@pytest.mark.django_db
+def test_threads_page_by_last_activity_with_ties(client, user):
+    now = timezone.now()
+    threads = [ChatThread.objects.create(user=user, model_alias="robot") for _ in range(8)]
+    for i, t in enumerate(threads):
+        # two threads share each timestamp, so the id tie-breaker matters
+        ChatThread.objects.filter(id=t.id).update(last_activity=now - timedelta(minutes=i // 2))
+    ChatThread.objects.create(user=get_user_model().objects.create_user(username="other"), model_alias="robot")
+
+    items = walk(client, "/api/chat/threads")
+    expected = sorted(threads, key=lambda t: (now - timedelta(minutes=threads.index(t) // 2), t.id), reverse=True)
+    assert [int(t["thread_id"]) for t in items] == [t.id for t in expected]
+
+
+@pytest.mark.django_db
+def test_messages_keyset_pages_and_previews(client, user, settings):
+    settings.HISTORY_PREVIEW_CHARS = 10
+    thread = ChatThread.objects.create(user=user, model_alias="robot")
+    msgs = ChatMessage.objects.bulk_create(
+        ChatMessage(thread=thread, role="user", content=f"message number {i}", meta={"big": "x" * 1000})
+        for i in range(7)
+    )
+    url = f"/api/chat/threads/{thread.id}/messages"
+
+    newest = walk(client, url)
+    assert [m["id"] for m in newest] == [m.id for m in reversed(msgs)]
+    assert newest[0]["preview"] == "message nu" and newest[0]["truncated"] is True
+    assert "content" not in newest[0]
+
+    with CaptureQueriesContext(connection) as ctx:
+        res = client.get(url, {"order": "asc", "full": "1", "limit": 2})
+    assert [m["content"] for m in res.json()["results"]] == ["message number 0", "message number 1"]
+    page_sql = [q["sql"] for q in ctx.captured_queries if "chat_chatmessage" in q["sql"] and "LIMIT" in q["sql"]]
+    assert page_sql and "OFFSET" not in page_sql[-1] and '"meta"' not in page_sql[-1]
+
+    other = ChatThread.objects.create(user=get_user_model().objects.create_user(username="x"), model_alias="robot")
+    assert client.get(f"/api/chat/threads/{other.id}/messages").status_code == 404
+    assert client.get(url, {"cursor": "!!"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_etag_revalidation(client, user):
+    thread = ChatThread.objects.create(user=user, model_alias="robot")
+    ChatMessage.objects.create(thread=thread, role="user", content="hi")
+    url = f"/api/chat/threads/{thread.id}/messages"
+
+    first = client.get(url)
+    tag = first["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=tag).status_code == 304
+
+    ChatMessage.objects.create(thread=thread, role="assistant", content="hello")
+    changed = client.get(url, HTTP_IF_NONE_MATCH=tag)
+    assert changed.status_code == 200 and changed["ETag"] != tag
+
+    threads_tag = client.get("/api/chat/threads")["ETag"]
+    assert client.get("/api/chat/threads", HTTP_IF_NONE_MATCH=threads_tag).status_code == 304
+    ChatThread.objects.filter(id=thread.id).update(last_activity=timezone.now() + timedelta(seconds=5))
+    assert client.get("/api/chat/threads", HTTP_IF_NONE_MATCH=threads_tag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_well_formed_cursors_of_the_wrong_shape_are_400(client, user):
+    from chat.history import encode_cursor
+
+    thread = ChatThread.objects.create(user=user, model_alias="robot")
+    for key in ({"a": 1}, [1], "x", [None, 1]):
+        assert client.get("/api/chat/threads", {"cursor": encode_cursor(key)}).status_code == 400
+    for key in ({"a": 1}, [1], True):
+        assert client.get(f"/api/chat/threads/{thread.id}/messages", {"cursor": encode_cursor(key)}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_etag_changes_when_old_messages_are_archived(client, user):
+    thread = ChatThread.objects.create(user=user, model_alias="robot")
+    old = ChatMessage.objects.create(thread=thread, role="user", content="old")
+    ChatMessage.objects.create(thread=thread, role="assistant", content="new")
+    url = f"/api/chat/threads/{thread.id}/messages"
+
+    tag = client.get(url, {"order": "asc"})["ETag"]
+    ChatMessage.objects.filter(id=old.id).delete()  # analytics.archive
+    res = client.get(url, {"order": "asc"}, HTTP_IF_NONE_MATCH=tag)
+    assert res.status_code == 200 and [m["preview"] for m in res.json()["results"]] == ["new"]
@@ -0,0 +1,181 @@
+import base64
+import pytest
+from decimal import Decimal
+from types import SimpleNamespace
+from django.contrib.auth import get_user_model
+from billing.models import ModelCatalog, UsageRecord, Wallet
+from chat import openai_client, storage
+from chat.models import ImageJob
+from chat.tasks import generate_image_job
+
+PNG = b"\x89PNG\r\n" + bytes(range(256)) * 400
+
+
+class FakeMinio:
+    def __init__(self):
+        self.objects = {}
+        self.types = {}
+        self.bucket_checks = 0
+
+    def bucket_exists(self, bucket):
+        self.bucket_checks += 1
+        return True
+
+    def put_object(self, bucket, name, data, length, part_size, content_type):
+        parts = iter(lambda: data.read(part_size), b"")
+        self.objects[name] = b"".join(parts)
+        self.types[name] = content_type
+
+
+@pytest.fixture
+def painter(client, settings, monkeypatch):
+    settings.WALLET_PREAUTH = "db"
+    ModelCatalog.objects.create(alias="painter-t", model_name="dall-e-3", pricing_mode="image",
+                                per_image_input_usd=Decimal("0.040"))
+    u = get_user_model().objects.create_user(username="painter")
+    Wallet.objects.filter(user=u).update(balance_tokens=5000)
+    client.force_login(u)
+    fake = FakeMinio()
+    monkeypatch.setattr(storage, "_state", {"client": fake, "bucket_ready": False})
+    settings.MINIO_PART_SIZE = 4096
+    monkeypatch.setattr(generate_image_job, "delay", lambda job_id: None)
+    monkeypatch.setattr(openai_client, "generate_image", lambda model, prompt: SimpleNamespace(
+        data=[SimpleNamespace(b64_json=base64.b64encode(PNG).decode(), url=None)]
+    ))
+    return u, fake
+
+
+def _post(client, prompt):
+    return client.post("/api/chat/images", {"model_alias": "painter-t", "prompt": prompt},
+                       content_type="application/json")
+
+
+@pytest.mark.django_db
+def test_job_generates_uploads_bills_and_dedups(client, painter, django_capture_on_commit_callbacks):
+    u, fake = painter
+    with django_capture_on_commit_callbacks(execute=True):
+        res = _post(client, "A red dragon!")
+    assert res.status_code == 202
+    job_id = res.json()["job_id"]
+    assert res.json()["status"] == "queued"
+
+    generate_image_job(job_id)
+    status = client.get(f"/api/chat/images/{job_id}").json()
+    assert status["status"] == "succeeded"
+    assert status["image_url"].endswith(f"/generated/{job_id}.png")
+    assert fake.objects[f"generated/{job_id}.png"] == PNG
+    assert fake.types[f"generated/{job_id}.png"] == "image/png"
+    assert Wallet.objects.get(user=u).balance_tokens == 4000
+    assert UsageRecord.objects.get(user=u).cost_usd == Decimal("0.0400")
+
+    again = _post(client, "a red dragon")
+    assert (again.status_code, again.json()["job_id"]) == (200, job_id)
+    assert ImageJob.objects.count() == 1
+
+    generate_image_job(job_id)  # redelivery is a no-op
+    assert Wallet.objects.get(user=u).balance_tokens == 4000
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("output_format, data, name, content_type", [
+    ("webp", b"RIFF\x00\x00\x00\x00WEBPVP8 " + bytes(64), "{}.webp", "image/webp"),
+    (None, b"\xff\xd8\xff\xe0" + bytes(64), "{}.jpg", "image/jpeg"),
+])
+def test_generated_object_follows_the_returned_format(client, painter, monkeypatch, output_format, data, name,
+                                                      content_type):
+    u, fake = painter
+    monkeypatch.setattr(openai_client, "generate_image", lambda model, prompt: SimpleNamespace(
+        output_format=output_format, data=[SimpleNamespace(b64_json=base64.b64encode(data).decode(), url=None)]
+    ))
+    job_id = _post(client, "a blue whale").json()["job_id"]
+    generate_image_job(job_id)
+    key = "generated/" + name.format(job_id)
+    assert (fake.objects[key], fake.types[key]) == (data, content_type)
+    assert client.get(f"/api/chat/images/{job_id}").json()["image_url"].endswith(key)
+
+
+@pytest.mark.django_db
+def test_per_user_job_cap(client, painter, settings):
+    settings.IMAGE_JOBS_PER_USER = 1
+    assert _post(client, "a cat").status_code == 202
+    res = _post(client, "a dog")
+    assert res.status_code == 429
+    assert res["Retry-After"] == str(settings.IMAGE_JOB_RETRY_AFTER)
+
+
+@pytest.mark.django_db
+def test_failed_generation_is_not_billed(client, painter, monkeypatch):
+    u, _ = painter
+
+    def boom(model, prompt):
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(openai_client, "generate_image", boom)
+    job_id = _post(client, "a tree").json()["job_id"]
+    generate_image_job(job_id)
+    assert ImageJob.objects.get(id=job_id).status == "failed"
+    assert Wallet.objects.get(user=u).balance_tokens == 5000
+
+
+@pytest.mark.django_db
+def test_stale_jobs_stop_counting_and_are_expired(client, painter, settings, fake_redis):
+    from datetime import timedelta
+    from django.utils import timezone
+    from billing import debit
+    from chat import images
+
+    u, _ = painter
+    settings.WALLET_PREAUTH = "redis"
+    settings.IMAGE_JOBS_PER_USER = 1
+    settings.IMAGE_JOB_STALE_SECONDS = 600
+    lost = _post(client, "a lost cat").json()["job_id"]
+    reserved = int(fake_redis.get(debit.AVAIL_KEY.format(u.id)))
+    assert _post(client, "a dog").status_code == 429
+
+    ImageJob.objects.filter(id=lost).update(status="running", created_at=timezone.now() - timedelta(seconds=601))
+    assert images.active_count(u) == 0
+    assert images.expire_stale() == 1
+    job = ImageJob.objects.get(id=lost)
+    assert (job.status, job.error) == ("failed", "timed out")
+    assert int(fake_redis.get(debit.AVAIL_KEY.format(u.id))) == reserved + job.reserved_tokens
+    assert images.expire_stale() == 0
+
+    generate_image_job(lost)  # تحویل دیرهنگام task؛ دیگر queued نیست
+    assert Wallet.objects.get(user=u).balance_tokens == 5000
+
+
+@pytest.mark.django_db
+def test_worker_finishing_an_expired_job_does_not_bill(client, painter, monkeypatch):
+    from chat import images
+
+    u, _ = painter
+    job_id = _post(client, "a slow owl").json()["job_id"]
+
+    def expired_meanwhile(model, prompt):
+        ImageJob.objects.filter(id=job_id).update(status="failed", error="timed out")
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=base64.b64encode(PNG).decode(), url=None)])
+
+    monkeypatch.setattr(openai_client, "generate_image", expired_meanwhile)
+    images.run(job_id)
+    assert ImageJob.objects.get(id=job_id).status == "failed"
+    assert Wallet.objects.get(user=u).balance_tokens == 5000
+    assert not UsageRecord.objects.exists()
+
+
+@pytest.mark.django_db
+def test_status_feed_under_wsgi_is_one_frame_and_missing_jobs_end_the_stream(client, painter, settings):
+    from asgiref.sync import async_to_sync
+    from chat import images
+
+    u, _ = painter
+    settings.IMAGE_JOB_POLL_SECONDS = 2
+    job_id = _post(client, "a fox").json()["job_id"]
+    res = client.get(f"/api/chat/images/{job_id}", HTTP_ACCEPT="text/event-stream")
+    body = b"".join(res.streaming_content).decode()
+    assert body.startswith("retry: 2000\n\nevent: status\n") and '"status": "queued"' in body
+    assert client.get("/api/chat/images/999999").status_code == 404
+
+    async def frames():
+        return [frame async for frame in images.stream_status(999999, u.id)]
+
+    assert async_to_sync(frames)() == []
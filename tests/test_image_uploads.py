@@ -0,0 +1,126 @@
+import hashlib
+import io
+from datetime import timedelta
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from benchmarks.fake_s3 import FakeS3
+from chat import storage, uploads
+from chat.models import ImageUpload
+
+PNG = b"\x89PNG" + b"p" * 2000
+DIGEST = hashlib.sha256(PNG).hexdigest()
+
+
+@pytest.fixture
+def s3(settings, monkeypatch):
+    fake = FakeS3().start_in_thread()
+    settings.MINIO_ENDPOINT = fake.endpoint
+    settings.MINIO_PUBLIC_ENDPOINT = "https://media.example.com"
+    settings.MINIO_ACCESS_KEY, settings.MINIO_SECRET_KEY = "bench", "bench-secret"
+    settings.MINIO_BUCKET = "kids-media"
+    settings.MINIO_REGION = "us-east-1"
+    monkeypatch.setattr(storage, "_state", {"client": None, "bucket_ready": False})
+    return fake
+
+
+@pytest.fixture
+def user(client):
+    u = get_user_model().objects.create_user(username="painter")
+    client.force_login(u)
+    return u
+
+
+def presign(client, **overrides):
+    body = {"content_type": "image/png", "size": len(PNG), "sha256": DIGEST, **overrides}
+    return client.post("/api/chat/image/presign", body, content_type="application/json")
+
+
+def confirm(client, upload_id):
+    return client.post("/api/chat/image/confirm", {"upload_id": upload_id}, content_type="application/json")
+
+
+@pytest.mark.django_db
+def test_presign_upload_confirm(client, s3, user):
+    res = presign(client)
+    assert res.status_code == 201
+    data = res.json()
+    name = f"uploads/{user.id}/{DIGEST}.png"
+    assert data["exists"] is False
+    assert data["url"] == "https://media.example.com/kids-media"
+    assert data["fields"]["key"] == name
+    assert data["fields"]["Content-Type"] == "image/png"
+    assert {"policy", "x-amz-signature", "x-amz-credential"} <= set(data["fields"])
+
+    assert confirm(client, data["upload_id"]).status_code == 409  # nothing uploaded yet
+
+    storage.put_file(name, io.BytesIO(PNG), len(PNG), content_type="image/png")  # the client's POST
+    res = confirm(client, data["upload_id"])
+    assert res.status_code == 200
+    assert res.json()["status"] == "stored"
+    assert res.json()["image_url"] == f"{s3.endpoint}/kids-media/{name}"
+
+    # the same image again is served from what is already stored
+    again = presign(client)
+    assert again.status_code == 200
+    assert again.json()["exists"] is True
+    assert again.json()["upload_id"] == data["upload_id"]
+
+
+@pytest.mark.django_db
+def test_confirm_rejects_mismatched_object(client, s3, user):
+    data = presign(client).json()
+    storage.put_file(data["fields"]["key"], io.BytesIO(b"short"), 5, content_type="image/png")
+    res = confirm(client, data["upload_id"])
+    assert res.status_code == 400
+    assert data["fields"]["key"] not in s3.objects
+    assert not ImageUpload.objects.filter(id=data["upload_id"]).exists()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("overrides", [
+    {"content_type": "application/pdf"},
+    {"size": 0},
+    {"size": 50 * 1024 * 1024},
+    {"sha256": "not-a-hash"},
+])
+def test_presign_validates_declared_file(client, s3, user, overrides):
+    assert presign(client, **overrides).status_code == 400
+    assert not ImageUpload.objects.exists()
+
+
+@pytest.mark.django_db
+def test_multipart_upload_skips_stored_duplicates(client, s3, user):
+    for _ in range(2):
+        image = SimpleUploadedFile("cat.png", PNG, content_type="image/png")
+        assert client.post("/api/chat/image", {"image": image, "model_alias": "painter"}).status_code == 200
+    assert s3.calls[("PUT", "object", ())] == 1
+    assert ImageUpload.objects.get().object_name == f"uploads/{user.id}/{DIGEST}.png"
+
+
+@pytest.mark.django_db
+def test_confirm_rejects_malformed_upload_id(client, s3, user):
+    assert confirm(client, "abc").status_code == 404
+    assert confirm(client, None).status_code == 404
+
+
+@pytest.mark.django_db
+def test_unconfirmed_presigns_expire(client, s3, user, settings):
+    settings.IMAGE_UPLOAD_URL_TTL, settings.IMAGE_UPLOAD_CONFIRM_GRACE_SECONDS = 600, 300
+    name = f"uploads/{user.id}/{DIGEST}.png"
+    stale_id = presign(client).json()["upload_id"]
+    other = hashlib.sha256(b"other").hexdigest()
+    orphan_id = presign(client, sha256=other).json()["upload_id"]
+    orphan = f"uploads/{user.id}/{other}.png"
+    storage.put_file(orphan, io.BytesIO(PNG), len(PNG), content_type="image/png")  # uploaded, never confirmed
+    ImageUpload.objects.filter(id__in=[stale_id, orphan_id]).update(created_at=timezone.now() - timedelta(seconds=901))
+    fresh_id = presign(client).json()["upload_id"]  # same object, presigned again
+    storage.put_file(name, io.BytesIO(PNG), len(PNG), content_type="image/png")
+
+    assert uploads.expire_pending() == 2
+    assert set(ImageUpload.objects.values_list("id", flat=True)) == {fresh_id}
+    assert storage.stat(orphan) is None
+    assert confirm(client, fresh_id).status_code == 200
+    assert confirm(client, stale_id).status_code == 404
+    assert uploads.expire_pending() == 0
@@ -0,0 +1,86 @@
+import io
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from benchmarks.fake_s3 import FakeS3
+from chat import imaging, storage, uploads
+from chat.models import ImageUpload
+
+
+def photo(size=(4000, 3000), orientation=None, fmt="JPEG", mode="RGB") -> bytes:
+    img = Image.new(mode, size, (200, 120, 40, 128)[:len(mode)])
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"
+    if orientation:
+        exif[0x0112] = orientation
+    out = io.BytesIO()
+    img.save(out, fmt, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def test_normalize_downscales_rotates_and_strips_exif():
+    out = imaging.normalize(photo(orientation=6))  # rotated 90° on the phone
+    assert (out.width, out.height) == (768, 1024)
+    assert out.content_type == "image/webp"
+    with Image.open(io.BytesIO(out.display)) as img:
+        assert img.format == "WEBP" and img.size == (768, 1024)
+        assert not img.getexif()
+    with Image.open(io.BytesIO(out.thumbnail)) as thumb:
+        assert max(thumb.size) == 256
+
+
+def test_normalize_keeps_small_images_and_alpha(settings):
+    out = imaging.normalize(photo((300, 200), fmt="PNG", mode="RGBA"))
+    assert (out.width, out.height) == (300, 200)
+    with Image.open(io.BytesIO(out.display)) as img:
+        assert img.mode == "RGBA"
+
+    settings.IMAGE_NORMALIZE_FORMAT = "JPEG"
+    out = imaging.normalize(photo((300, 200), fmt="PNG", mode="RGBA"))
+    assert out.content_type == "image/jpeg"
+    with Image.open(io.BytesIO(out.display)) as img:
+        assert img.mode == "RGB"
+
+
+def test_normalize_rejects_garbage_and_bombs(settings):
+    with pytest.raises(ValueError):
+        imaging.normalize(b"definitely not an image")
+    settings.IMAGE_MAX_PIXELS = 1000
+    with pytest.raises(ValueError):
+        imaging.normalize(photo((100, 100)))
+
+
+@pytest.fixture
+def s3(settings, monkeypatch):
+    fake = FakeS3(keep_bodies=True).start_in_thread()
+    settings.MINIO_ENDPOINT = fake.endpoint
+    settings.MINIO_ACCESS_KEY, settings.MINIO_SECRET_KEY = "bench", "bench-secret"
+    settings.MINIO_BUCKET = "kids-media"
+    settings.MINIO_REGION = "us-east-1"
+    monkeypatch.setattr(storage, "_state", {"client": None, "bucket_ready": False})
+    return fake
+
+
+@pytest.mark.django_db
+def test_uploads_are_normalized_once_per_content(client, s3, django_capture_on_commit_callbacks, monkeypatch):
+    monkeypatch.setattr("chat.tasks.normalize_image_upload.delay", uploads.process)
+    data = photo((1600, 1200))
+    users = [get_user_model().objects.create_user(username=f"kid{i}") for i in range(2)]
+    for user in users:
+        client.force_login(user)
+        image = SimpleUploadedFile("drawing.jpg", data, content_type="image/jpeg")
+        with django_capture_on_commit_callbacks(execute=True):
+            res = client.post("/api/chat/image", {"image": image, "model_alias": "painter"})
+        assert res.status_code == 200
+
+    first, second = ImageUpload.objects.order_by("id")
+    assert first.object_name != second.object_name  # originals stay per user
+    assert first.display_object == second.display_object
+    assert (second.width, second.height) == (1024, 768)
+    derived = [k for k in s3.objects if k.startswith("derived/")]
+    assert len(derived) == 2  # one display copy and one thumbnail, shared
+
+    res = client.get(f"/api/chat/image/{second.id}")
+    assert res.json()["processed"] is True
+    assert res.json()["thumb_url"].endswith(second.thumb_object)
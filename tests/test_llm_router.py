@@ -0,0 +1,75 @@
+import time
+
+from asgiref.sync import async_to_sync
+
+from analytics import metrics
+from benchmarks.fake_openai import FakeOpenAI
+from chat import openai_client, router
+
+HI = [{"role": "user", "content": "hi"}]
+
+
+def _route(settings, monkeypatch, **servers):
+    monkeypatch.setenv("OPENAI_API_KEY", "k")
+    settings.LLM_PROVIDERS = {name: fake.base_url for name, fake in servers.items()}
+    settings.LLM_ROUTES = {"gpt-test": list(servers)}
+    settings.LLM_ROUTER_MIN_SAMPLES = 3
+
+
+def test_fails_over_and_ejects_erroring_endpoint(settings, monkeypatch):
+    broken = FakeOpenAI(latency=0, status=500).start_in_thread()
+    healthy = FakeOpenAI(latency=0, reply="from backup").start_in_thread()
+    _route(settings, monkeypatch, primary=broken, backup=healthy)
+    metrics.reset()
+
+    for _ in range(3):
+        resp, _ = openai_client.chat_completion("gpt-test", HI)
+        assert resp.choices[0].message.content == "from backup"
+
+    assert broken.served == 3  # no SDK retries on routed endpoints
+    assert metrics.counter_value("llm.endpoint_ejected", provider="primary", model="gpt-test") == 1
+    assert [e.provider for e in router.endpoints_for("gpt-test")] == ["backup", "primary"]
+
+    openai_client.chat_completion("gpt-test", HI)
+    assert broken.served == 3
+
+
+def test_prefers_endpoint_with_lowest_p50(settings, monkeypatch):
+    slow = FakeOpenAI(latency=0.05, reply="slow").start_in_thread()
+    fast = FakeOpenAI(latency=0, reply="fast").start_in_thread()
+    _route(settings, monkeypatch, slow=slow, fast=fast)
+
+    for _ in range(6):
+        openai_client.chat_completion("gpt-test", HI)
+
+    assert [e.provider for e in router.endpoints_for("gpt-test")] == ["fast", "slow"]
+    resp, _ = openai_client.chat_completion("gpt-test", HI)
+    assert resp.choices[0].message.content == "fast"
+
+
+def test_hedges_after_p95_and_takes_the_first_answer(settings, monkeypatch):
+    delays = iter([0, 0, 0, 2.0])
+    primary = FakeOpenAI(latency=lambda: next(delays, 2.0), reply="primary").start_in_thread()
+    backup = FakeOpenAI(latency=0.02, reply="backup").start_in_thread()
+    _route(settings, monkeypatch, primary=primary, backup=backup)
+    settings.LLM_HEDGE = True
+    settings.LLM_HEDGE_MIN_DELAY = 0.05
+    for _ in range(6):  # unmeasured endpoints go first: three samples each
+        openai_client.chat_completion("gpt-test", HI)
+    assert [e.provider for e in router.endpoints_for("gpt-test")] == ["primary", "backup"]
+    metrics.reset()
+
+    async def call():
+        return await openai_client.async_chat_completion("gpt-test", HI)
+
+    started = time.perf_counter()
+    resp, _ = async_to_sync(call)()
+    assert resp.choices[0].message.content == "backup"
+    assert time.perf_counter() - started < 1.0
+    assert metrics.counter_value("llm.router.hedged", provider="backup", model="gpt-test") == 1
+
+
+def test_unrouted_model_uses_default_endpoint(settings):
+    settings.LLM_ROUTES = {}
+    (endpoint,) = router.endpoints_for("gpt-other")
+    assert (endpoint.provider, endpoint.base_url, endpoint.max_retries) == ("default", None, None)
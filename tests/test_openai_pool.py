@@ -0,0 +1,45 @@
+from asgiref.sync import async_to_sync
+
+from analytics import metrics
+from benchmarks.fake_openai import FakeOpenAI
+from chat import openai_client
+
+
+def test_client_is_reused_per_key_and_recreated_after_fork(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "k1")
+    monkeypatch.setenv("OPENAI_API_BASE", "http://127.0.0.1:9/v1")
+    first = openai_client.get_client()
+    assert openai_client.get_client() is first
+    assert openai_client.get_client(api_key="k2") is not first
+
+    openai_client._reset_after_fork()
+    assert openai_client.get_client() is not first
+
+
+def test_per_model_timeout(settings):
+    settings.OPENAI_TIMEOUT = 60
+    settings.OPENAI_MODEL_TIMEOUTS = {"gpt-5": 120}
+    assert openai_client.timeout_for("gpt-5") == 120
+    assert openai_client.timeout_for("gpt-4o") == 60
+
+
+def test_connection_setup_metric_shows_keepalive(monkeypatch):
+    fake = FakeOpenAI(latency=0).start_in_thread()
+    monkeypatch.setenv("OPENAI_API_KEY", "k")
+    monkeypatch.setenv("OPENAI_API_BASE", fake.base_url)
+    metrics.reset()
+
+    for _ in range(3):
+        openai_client.get_client().chat.completions.create(
+            model="gpt-test", messages=[{"role": "user", "content": "hi"}]
+        )
+
+    assert fake.connections == 1
+    assert metrics.counter_value("openai.requests", host="127.0.0.1", connection="new") == 1
+    assert metrics.counter_value("openai.requests", host="127.0.0.1", connection="reused") == 2
+
+    async def call():
+        return await openai_client.async_chat_completion("gpt-test", [{"role": "user", "content": "hi"}])
+
+    resp, (in_tokens, out_tokens, cached_tokens) = async_to_sync(call)()
+    assert out_tokens > 0
@@ -0,0 +1,34 @@
+import pytest
+from django.contrib.auth import get_user_model
+from billing.models import ModelCatalog
+from chat import tokens
+from chat.models import ChatThread, ChatMessage
+
+
+def test_mixed_text_counting_is_positive_and_monotonic():
+    short = tokens.count_tokens("چرا آسمان آبی است؟ Why is the sky blue?", "gpt-4o")
+    longer = tokens.count_tokens("چرا آسمان آبی است؟ Why is the sky blue? " * 10, "gpt-4o")
+    assert 0 < short < longer
+    assert tokens.encoding_name("gpt-4.1-mini") == "o200k_base"
+    assert tokens.encoding_name("gpt-4-turbo") == "cl100k_base"
+
+
+@pytest.mark.django_db
+def test_history_is_packed_into_context_budget():
+    from chat.prompts import build_messages_with_memory
+
+    cat = ModelCatalog.objects.create(alias="robot-b", model_name="gpt-4o", context_budget_tokens=400,
+                                      input_per_million_usd=1, output_per_million_usd=1)
+    u = get_user_model().objects.create_user(username="budget")
+    thread = ChatThread.objects.create(user=u, model_alias="robot-b")
+    for i in range(10):
+        ChatMessage.objects.create(thread=thread, role="user", content=f"{i} " + "کلمه word " * 30)
+
+    messages, estimate = build_messages_with_memory(thread, "new question", cat)
+
+    assert messages[0]["role"] == "system"
+    assert messages[-1] == {"role": "user", "content": "new question"}
+    kept = [m["content"].split()[0] for m in messages[1:-1]]
+    assert kept and kept[-1] == "9" and len(kept) < 10
+    assert kept == sorted(kept)
+    assert estimate == tokens.count_message_tokens(messages, "gpt-4o") <= 400
@@ -0,0 +1,73 @@
+import pytest
+from decimal import Decimal
+from types import SimpleNamespace
+from django.contrib.auth import get_user_model
+from analytics import metrics
+from billing.models import ModelCatalog, Wallet, UsageRecord
+from billing.pricing import cost_usd
+from chat import openai_client
+from chat.models import ChatThread, MemorySummary
+
+
+def _cat(**kw):
+    return ModelCatalog.objects.create(alias="robot-pc", model_name="gpt-4.1-mini", input_per_million_usd=Decimal("0.40"),
+                                       output_per_million_usd=Decimal("1.60"), **kw)
+
+
+@pytest.mark.django_db
+def test_cached_input_is_billed_at_cached_rate():
+    cat = _cat(cached_per_million_usd=Decimal("0.10"))
+    full = cost_usd(cat.alias, 1_000_000, 0, cat=cat)
+    half_cached = cost_usd(cat.alias, 1_000_000, 0, cat=cat, cached_tokens=500_000)
+    assert (full, half_cached) == (Decimal("0.4000"), Decimal("0.2500"))
+
+    cat.cached_per_million_usd = None  # بدون نرخ cached همان نرخ ورودی
+    assert cost_usd(cat.alias, 1_000_000, 0, cat=cat, cached_tokens=500_000) == full
+
+
+@pytest.mark.django_db
+def test_stable_prefix_comes_first():
+    from chat.prompts import SYSTEM_PROMPT, build_messages_with_memory
+
+    cat = _cat()
+    thread = ChatThread.objects.create(user=get_user_model().objects.create_user(username="pc"), model_alias="robot-pc")
+    MemorySummary.objects.create(thread=thread, summary="Sara likes dinosaurs.")
+
+    first, _ = build_messages_with_memory(thread, "hi", cat)
+    second, _ = build_messages_with_memory(thread, "what about trex?", cat)
+    assert first[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert first[1]["role"] == "system" and "Sara likes dinosaurs." in first[1]["content"]
+    assert first[:2] == second[:2]
+
+
+def test_usage_tokens_reads_cached_prompt_tokens():
+    usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=100,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=1536))
+    assert openai_client.usage_tokens(SimpleNamespace(usage=usage)) == (2000, 100, 1536)
+    assert openai_client.usage_tokens(SimpleNamespace(usage=None)) == (0, 0, 0)
+    assert openai_client.split_usage((10, 5)) == (10, 5, 0)
+
+
+@pytest.mark.django_db
+def test_send_records_cached_tokens_and_hit_rate(client, monkeypatch):
+    metrics.reset()
+    _cat(cached_per_million_usd=Decimal("0.10"))
+    resp = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+    def fake(model, messages, tools=None):
+        openai_client.record_prompt_cache(model, 2000, 1536, 0.2)
+        return resp, (2000, 100, 1536)
+
+    monkeypatch.setattr(openai_client, "chat_completion", fake)
+    u = get_user_model().objects.create_user(username="pc2")
+    Wallet.objects.filter(user=u).update(balance_tokens=100_000)
+    client.force_login(u)
+    res = client.post("/api/chat/send", {"model_alias": "robot-pc", "prompt": "hi"}, content_type="application/json")
+    assert res.status_code == 200
+    assert res.json()["usage"]["cached_tokens"] == 1536
+
+    record = UsageRecord.objects.get(user=u)
+    assert record.cached_input_tokens == 1536
+    assert record.cost_usd == cost_usd("robot-pc", 2000, 100, cached_tokens=1536)
+    assert openai_client.prompt_cache_stats()["gpt-4.1-mini"]["hit_rate"] == pytest.approx(0.768)
+    assert metrics.counter_value("openai.cached_prompt_tokens", model="gpt-4.1-mini") == 1536
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone as dt_timezone
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from billing import renewals
+from billing.models import Subscription, Transaction, Wallet
+
+JAN = datetime(2026, 1, 10, 12, 0, tzinfo=dt_timezone.utc)
+
+
+def at(y, m, d, h=0):
+    return datetime(y, m, d, h, tzinfo=dt_timezone.utc)
+
+
+def balance(user):
+    return Wallet.objects.get(user=user).balance_tokens
+
+
+@pytest.mark.django_db
+def test_next_after_clamps_short_months():
+    assert renewals.next_after(at(2026, 1, 31, 1), 31) == at(2026, 2, 28)
+    assert renewals.next_after(at(2026, 2, 28), 31) == at(2026, 3, 31)
+    assert renewals.next_after(at(2026, 12, 15), 1) == at(2027, 1, 1)
+
+
+@pytest.mark.django_db
+def test_renewals_credit_once_per_period(settings):
+    settings.SUBSCRIPTION_RENEWAL_CHUNK = 2
+    users = [get_user_model().objects.create_user(username=f"s{i}") for i in range(3)]
+    for u in users:
+        Subscription.objects.create(user=u, tokens_per_month=1000, renew_day=15, next_renewal_at=at(2026, 1, 15))
+    Subscription.objects.create(user=users[0], tokens_per_month=500, active=False, next_renewal_at=at(2026, 1, 15))
+
+    assert renewals.run(now=at(2026, 1, 14)) == 0
+    assert renewals.run(now=at(2026, 1, 15, 3)) == 3
+    assert [balance(u) for u in users] == [1000, 1000, 1000]
+    sub = Subscription.objects.filter(active=True).first()
+    assert (sub.next_renewal_at, sub.last_period) == (at(2026, 2, 15), "2026-01")
+
+    # a retry of the same period (e.g. the advance was lost) credits nothing
+    Subscription.objects.filter(active=True).update(next_renewal_at=at(2026, 1, 15))
+    assert renewals.run(now=at(2026, 1, 15, 4)) == 3
+    assert [balance(u) for u in users] == [1000, 1000, 1000]
+    assert Transaction.objects.filter(reason="subscription").count() == 3
+
+    # missed periods are caught up one by one
+    renewals.run(now=at(2026, 4, 20))
+    assert [balance(u) for u in users] == [4000, 4000, 4000]
+    assert set(Subscription.objects.filter(active=True).values_list("last_period", flat=True)) == {"2026-04"}
+    call_command("reconcile_ledger", verbosity=0)
+
+
+@pytest.mark.django_db
+def test_unscheduled_subscriptions_get_a_first_date():
+    user = get_user_model().objects.create_user(username="bulk")
+    Subscription.objects.bulk_create([Subscription(user=user, renew_day=20)])
+    renewals.schedule_new(now=JAN)
+    assert Subscription.objects.get().next_renewal_at == at(2026, 1, 20)
+
+
+@pytest.mark.django_db
+def test_reactivated_subscription_does_not_catch_up_inactive_months(monkeypatch):
+    from django.utils import timezone
+
+    u = get_user_model().objects.create_user(username="paused")
+    sub = Subscription.objects.create(user=u, tokens_per_month=1000, renew_day=15, next_renewal_at=at(2026, 1, 15))
+    assert renewals.run(now=at(2026, 1, 16)) == 1
+    sub.refresh_from_db()
+    sub.active = False
+    sub.save()
+
+    monkeypatch.setattr(timezone, "now", lambda: at(2026, 6, 3))
+    sub.active = True
+    sub.save()
+    assert sub.next_renewal_at == renewals.next_after(at(2026, 6, 3), 15)
+    assert renewals.run(now=at(2026, 6, 4)) == 0
+    assert renewals.run(now=at(2026, 6, 16)) == 1
+    assert balance(u) == 2000
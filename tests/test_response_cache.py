@@ -0,0 +1,171 @@
+import pytest
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from analytics import metrics
+from billing.models import ModelCatalog, Wallet, UsageRecord, Transaction
+from chat import openai_client, response_cache
+
+
+class DummyResp:
+    def __init__(self, text):
+        self.choices = [type("C", (), {"message": type("M", (), {"content": text})()})()]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def fake(model, messages, tools=None):
+        calls.append(messages)
+        return DummyResp(f"answer {len(calls)}"), (100, 300)
+
+    monkeypatch.setattr(openai_client, "chat_completion", fake)
+    return calls
+
+
+@pytest.fixture
+def kid(client):
+    u = get_user_model().objects.create_user(username="kid")
+    Wallet.objects.filter(user=u).update(balance_tokens=10_000)
+    client.force_login(u)
+    return u
+
+
+def _send(client, prompt, alias="robot-rc", **extra):
+    return client.post("/api/chat/send", {"model_alias": alias, "prompt": prompt, **extra},
+                       content_type="application/json")
+
+
+def test_normalize_folds_persian_and_english_variants():
+    assert response_cache.normalize("Why is the SKY blue?!") == response_cache.normalize("why is the sky  blue")
+    assert response_cache.normalize("چرا آسمان آبي است؟") == response_cache.normalize("چرا  آسمان آبی است")
+    assert response_cache.normalize("۲ + ۲ چند می‌شود") == response_cache.normalize("2 2 چند می شود")
+
+
+@pytest.mark.django_db
+def test_repeated_question_is_served_from_cache_at_discount(client, kid, upstream, settings):
+    settings.RESPONSE_CACHE_BILLING_RATE = "0.25"
+    metrics.reset()
+    ModelCatalog.objects.create(alias="robot-rc", model_name="m", input_per_million_usd=1,
+                                output_per_million_usd=2, response_cache_enabled=True)
+
+    first = _send(client, "Why is the sky blue?")
+    second = _send(client, "why is the sky blue")  # thread تازه، همان سؤال
+    assert first.status_code == second.status_code == 200
+    assert len(upstream) == 1
+    assert second.json()["cached"] is True
+    assert second.json()["reply"] == first.json()["reply"]
+
+    assert Wallet.objects.get(user=kid).balance_tokens == 10_000 - 400 - 100
+    hit_usage = UsageRecord.objects.order_by("-id").first()
+    assert hit_usage.cost_usd == Decimal("0")
+    assert Transaction.objects.filter(reason="cache_hit").count() == 1
+
+    stats = response_cache.stats()["robot-rc"]
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+    assert stats["saved_usd"] == pytest.approx(0.0007)
+
+
+@pytest.mark.django_db
+def test_follow_up_depends_on_context_and_disabled_models_never_cache(client, kid, upstream,
+                                                                       django_capture_on_commit_callbacks):
+    ModelCatalog.objects.create(alias="robot-rc", model_name="m", input_per_million_usd=1,
+                                output_per_million_usd=2, response_cache_enabled=True)
+    ModelCatalog.objects.create(alias="robot-off", model_name="m", input_per_million_usd=1,
+                                output_per_million_usd=2)
+
+    with django_capture_on_commit_callbacks(execute=True):  # پنجرهٔ context cache به‌روز شود
+        t1 = _send(client, "tell me about cats").json()["thread_id"]
+        t2 = _send(client, "tell me about dogs").json()["thread_id"]
+    _send(client, "why?", thread_id=t1)
+    assert _send(client, "why?", thread_id=t2).json().get("cached") is None
+    assert len(upstream) == 4
+
+    _send(client, "hello", alias="robot-off")
+    _send(client, "hello", alias="robot-off")
+    assert len(upstream) == 6
+
+
+@pytest.mark.django_db
+def test_threads_with_history_or_summary_never_share_across_users(client, kid, upstream,
+                                                                  django_capture_on_commit_callbacks):
+    ModelCatalog.objects.create(alias="robot-rc", model_name="m", input_per_million_usd=1,
+                                output_per_million_usd=2, response_cache_enabled=True)
+    other = get_user_model().objects.create_user(username="other")
+    Wallet.objects.filter(user=other).update(balance_tokens=10_000)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        mine = _send(client, "hi, I'm Sara").json()
+        client.force_login(other)
+        theirs = _send(client, "hi, I'm Sara").json()  # thread تازه: پاسخ مشترک
+    assert theirs["cached"] is True and len(upstream) == 1
+
+    # تاریخچهٔ یکسان، ولی پاسخ دوم به کاربر دیگری تعلق دارد
+    assert _send(client, "what's my name?", thread_id=theirs["thread_id"]).json().get("cached") is None
+    client.force_login(kid)
+    assert _send(client, "what's my name?", thread_id=mine["thread_id"]).json().get("cached") is None
+    assert len(upstream) == 3
+
+    system = {"role": "system", "content": "rules"}
+    ask = {"role": "user", "content": "what's my name?"}
+    summary = {"role": "system", "content": "Summary: the child is called Sara"}
+    assert response_cache.fingerprint([system, ask], 1) == response_cache.fingerprint([system, ask], 2)
+    assert response_cache.fingerprint([system, summary, ask], 1) != response_cache.fingerprint([system, summary, ask], 2)
+    assert response_cache.fingerprint([system, summary, ask], 1) != response_cache.fingerprint([system, ask], 1)
+
+
+@pytest.mark.django_db
+def test_semantic_tier_matches_similar_prompts(client, kid, upstream, monkeypatch, settings):
+    settings.RESPONSE_CACHE_SEMANTIC = True
+    response_cache.reset_index()
+    vectors = {"why is the sky blue": [1.0, 0.0], "why the sky is blue": [0.99, 0.05], "what is a cat": [0.0, 1.0]}
+    monkeypatch.setattr(openai_client, "embed", lambda model, text: (vectors[text], 5))
+    ModelCatalog.objects.create(alias="robot-rc", model_name="m", input_per_million_usd=1,
+                                output_per_million_usd=2, response_cache_enabled=True)
+
+    _send(client, "why is the sky blue")
+    assert _send(client, "Why the sky is blue?").json()["cached"] is True
+    assert _send(client, "what is a cat").json().get("cached") is None
+    assert len(upstream) == 2
+    response_cache.reset_index()
+
+
+@pytest.mark.django_db
+def test_embedding_failures_are_retried_and_spend_is_recorded(client, kid, upstream, monkeypatch, settings):
+    settings.RESPONSE_CACHE_SEMANTIC = True
+    response_cache.reset_index()
+    metrics.reset()
+    vectors = {"why is the sky blue": [1.0, 0.0], "why the sky is blue": [0.99, 0.05]}
+    calls = []
+
+    def embed(model, text):
+        calls.append(text)
+        if len(calls) == 1:
+            raise RuntimeError("embeddings down")
+        return vectors[text], 7
+
+    monkeypatch.setattr(openai_client, "embed", embed)
+    ModelCatalog.objects.create(alias="robot-rc", model_name="m", input_per_million_usd=1,
+                                output_per_million_usd=2, response_cache_enabled=True)
+
+    _send(client, "why is the sky blue")  # lookup fails, store retries and indexes the reply
+    assert _send(client, "Why the sky is blue?").json()["cached"] is True
+    assert calls == ["why is the sky blue", "why is the sky blue", "why the sky is blue"]
+    assert metrics.counter_value("response_cache.embedding_tokens", model=settings.RESPONSE_CACHE_EMBEDDING_MODEL) == 14
+    usage = UsageRecord.objects.filter(user__username=settings.SUMMARY_SYSTEM_USERNAME)
+    assert [(r.model_alias, r.input_tokens) for r in usage] == [(settings.RESPONSE_CACHE_EMBEDDING_MODEL, 7)] * 2
+    response_cache.reset_index()
+
+
+def test_vector_index_evicts_least_recently_used_and_expired():
+    index = response_cache.VectorIndex(max_entries=2)
+    index.add("a", "m", "", [1, 0], {"reply": "a"}, ttl=60)
+    index.add("b", "m", "", [0, 1], {"reply": "b"}, ttl=60)
+    assert index.search("m", "", [1, 0], 0.9) == {"reply": "a"}  # a تازه‌تر می‌شود
+    index.add("c", "m", "", [1, 1], {"reply": "c"}, ttl=60)
+    assert index.search("m", "", [0, 1], 0.9) is None
+    assert len(index) == 2
+
+    index.add("d", "m", "", [0, 1], {"reply": "d"}, ttl=-1)
+    assert index.search("m", "", [0, 1], 0.9) is None
+    assert index.search("other", "", [1, 0], 0.9) is None
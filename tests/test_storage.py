@@ -0,0 +1,54 @@
+import hashlib
+import io
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from benchmarks.fake_s3 import FakeS3
+from chat import storage
+
+
+@pytest.fixture
+def s3(settings, monkeypatch):
+    fake = FakeS3().start_in_thread()
+    settings.MINIO_ENDPOINT = fake.endpoint
+    settings.MINIO_ACCESS_KEY, settings.MINIO_SECRET_KEY = "bench", "bench-secret"
+    settings.MINIO_BUCKET = "kids-media"
+    settings.MINIO_REGION = "us-east-1"
+    monkeypatch.setattr(storage, "_state", {"client": None, "bucket_ready": False})
+    return fake
+
+
+@pytest.mark.django_db
+def test_upload_view_reuses_client_and_checks_bucket_once(client, s3):
+    user = get_user_model().objects.create_user(username="uploader")
+    client.force_login(user)
+    names = []
+    for i in range(3):
+        body = b"\x89PNG" + b"x" * 1000 + bytes([i])
+        names.append(f"uploads/{user.id}/{hashlib.sha256(body).hexdigest()}.png")
+        image = SimpleUploadedFile(f"d{i}.png", body, content_type="image/png")
+        res = client.post("/api/chat/image", {"image": image, "model_alias": "painter"})
+        assert res.status_code == 200
+        assert res.json()["image_url"] == f"{s3.endpoint}/kids-media/{names[i]}"
+
+    assert s3.calls[("HEAD", "bucket", ())] == 1
+    assert s3.calls[("PUT", "bucket", ())] == 1
+    assert s3.objects == {name: 1005 for name in names}
+    assert s3.connections == 1
+
+
+def test_large_file_goes_multipart(s3, settings):
+    settings.MINIO_PART_SIZE = 5 * 1024 * 1024
+    size = 11 * 1024 * 1024
+    storage.put_file("big.bin", io.BytesIO(b"\0" * size), size)
+    assert s3.objects["big.bin"] == size
+    assert s3.calls[("PUT", "object", ("partNumber", "uploadId"))] == 3
+
+
+def test_bucket_is_recreated_when_deleted(s3):
+    storage.put_stream("a.bin", [b"ab", b"cd"])
+    s3.buckets.clear()
+    with pytest.raises(Exception):
+        storage.put_stream("b.bin", [b"ef"])  # a consumed stream cannot be replayed
+    storage.put_file("c.bin", io.BytesIO(b"gh"), 2)
+    assert s3.objects == {"a.bin": 4, "c.bin": 2}
@@ -0,0 +1,177 @@
+import pytest
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from analytics import tasks
+from chat.models import ChatThread, ChatMessage, MemorySummary
+
+
+@pytest.fixture
+def run_inline(monkeypatch):
+    dispatched = []
+
+    def delay(ids):
+        dispatched.append(list(ids))
+        return tasks.summarize_threads(ids)
+
+    monkeypatch.setattr(tasks.summarize_threads, "delay", delay)
+    return dispatched
+
+
+def _thread(user, *contents):
+    t = ChatThread.objects.create(user=user, model_alias="robot-s")
+    for c in contents:
+        ChatMessage.objects.create(thread=t, role="user", content=c)
+    return t
+
+
+@pytest.mark.django_db
+def test_only_threads_with_new_messages_are_summarized(run_inline, settings):
+    settings.SUMMARY_CHUNK_SIZE = 2
+    u = get_user_model().objects.create_user(username="sum")
+    active = [_thread(u, f"hi {i}") for i in range(5)]
+    _thread(u)  # بدون پیام
+
+    tasks.summarize_active_threads()
+    assert [len(c) for c in run_inline] == [2, 2, 1]
+    assert MemorySummary.objects.count() == 5
+    assert set(MemorySummary.objects.values_list("up_to_message_id", flat=True)) == set(
+        ChatMessage.objects.values_list("id", flat=True)
+    )
+
+    # second run: nothing changed, nothing written
+    run_inline.clear()
+    tasks.summarize_active_threads()
+    assert run_inline == []
+    assert MemorySummary.objects.count() == 5
+
+    m = ChatMessage.objects.create(thread=active[3], role="assistant", content="new")
+    ChatThread.objects.filter(id=active[3].id).update(last_activity=timezone.now() + timedelta(seconds=1))
+    tasks.summarize_active_threads()
+    assert run_inline == [[active[3].id]]
+    latest = MemorySummary.objects.filter(thread=active[3]).latest("id")
+    assert latest.up_to_message_id == m.id
+    assert MemorySummary.objects.count() == 6
+
+
+@pytest.mark.django_db
+def test_missing_watermark_still_skips_summarized_threads(run_inline):
+    u = get_user_model().objects.create_user(username="sum2")
+    t = _thread(u, "a", "b")
+    MemorySummary.objects.create(thread=t, summary="s", up_to_message_id=ChatMessage.objects.latest("id").id)
+
+    tasks.summarize_active_threads()
+    assert run_inline == []
+    assert tasks.summarize_threads([t.id]) == 0
+
+
+class _Resp:
+    def __init__(self, text):
+        self.choices = [type("C", (), {"message": type("M", (), {"content": text})()})()]
+
+
+@pytest.mark.django_db
+def test_summary_folds_previous_and_bills_system_user(run_inline, monkeypatch, settings):
+    import threading
+    import time
+    from billing.models import ModelCatalog, UsageRecord
+    from chat import openai_client
+
+    settings.SUMMARY_CONCURRENCY = 2
+    ModelCatalog.objects.create(alias="robot-sum", model_name="cheap", input_per_million_usd=1,
+                                output_per_million_usd=2)
+    settings.SUMMARY_MODEL_ALIAS = "robot-sum"
+    prompts, active, peak = [], [0], [0]
+    lock = threading.Lock()
+
+    def fake(model, messages, tools=None):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            prompts.append(messages[-1]["content"])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return _Resp("Sara likes dinosaurs."), (100, 10)
+
+    monkeypatch.setattr(openai_client, "chat_completion", fake)
+    u = get_user_model().objects.create_user(username="sum3")
+    t = _thread(u, "old message")
+    MemorySummary.objects.create(thread=t, summary="Sara is 7.", up_to_message_id=ChatMessage.objects.get().id)
+    new = ChatMessage.objects.create(thread=t, role="user", content="I love dinosaurs")
+    others = [_thread(u, f"x{i}") for i in range(4)]
+
+    assert tasks.summarize_threads([t.id, *[o.id for o in others]]) == 5
+    assert peak[0] <= 2
+    folded = next(p for p in prompts if "Sara is 7." in p)
+    assert "I love dinosaurs" in folded and "old message" not in folded
+
+    latest = MemorySummary.objects.filter(thread=t).latest("id")
+    assert (latest.summary, latest.up_to_message_id) == ("Sara likes dinosaurs.", new.id)
+    usage = UsageRecord.objects.filter(user__username=settings.SUMMARY_SYSTEM_USERNAME)
+    assert usage.count() == 5
+    assert {(r.model_alias, r.input_tokens, r.output_tokens) for r in usage} == {("robot-sum", 100, 10)}
+
+
+@pytest.mark.django_db
+def test_failed_summary_call_falls_back_to_truncation(run_inline, monkeypatch, settings):
+    from billing.models import ModelCatalog, UsageRecord
+    from chat import openai_client
+
+    ModelCatalog.objects.create(alias="robot-sum", model_name="cheap", input_per_million_usd=1,
+                                output_per_million_usd=2)
+    settings.SUMMARY_MODEL_ALIAS = "robot-sum"
+
+    def boom(model, messages, tools=None):
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(openai_client, "chat_completion", boom)
+    t = _thread(get_user_model().objects.create_user(username="sum4"), "hello there")
+    assert tasks.summarize_threads([t.id]) == 1
+    assert "hello there" in MemorySummary.objects.get(thread=t).summary
+    assert not UsageRecord.objects.exists()
+
+
+@pytest.mark.django_db
+def test_overlapping_runs_do_not_summarize_a_thread_twice(monkeypatch):
+    from django.core.cache import cache
+    from analytics import summarizer
+
+    u = get_user_model().objects.create_user(username="sum5")
+    t = _thread(u, "hello")
+    up_to = ChatMessage.objects.get().id
+    calls = []
+    model = summarizer.model
+
+    def racing_model():
+        calls.append(t.id)
+        # اجرای دیگری (پس از انقضای claim) همان خلاصه را زودتر نوشته است
+        MemorySummary.objects.create(thread=t, summary="first", up_to_message_id=up_to)
+        return model()
+
+    monkeypatch.setattr(summarizer, "model", racing_model)
+    cache.add(tasks.LOCK_KEY.format(t.id), 1, 60)  # claimed by a run still in flight
+    assert tasks.summarize_threads([t.id]) == 0
+    assert calls == [] and not MemorySummary.objects.exists()
+
+    cache.delete(tasks.LOCK_KEY.format(t.id))
+    tasks.summarize_threads([t.id])
+    assert calls == [t.id]
+    assert list(MemorySummary.objects.values_list("summary", "up_to_message_id")) == [("first", up_to)]
+    assert cache.get(tasks.LOCK_KEY.format(t.id)) is None
+
+
+@pytest.mark.django_db
+def test_watermark_overlap_catches_late_commits(run_inline, settings):
+    settings.SUMMARY_WATERMARK_OVERLAP_SECONDS = 300
+    u = get_user_model().objects.create_user(username="sum6")
+    tasks.summarize_active_threads()
+
+    # committed after the previous run started, stamped before it
+    late = _thread(u, "late")
+    ChatThread.objects.filter(id=late.id).update(last_activity=timezone.now() - timedelta(seconds=60))
+    tasks.summarize_active_threads()
+    assert run_inline == [[late.id]]
+    run_inline.clear()
+    tasks.summarize_active_threads()
+    assert run_inline == []
@@ -0,0 +1,118 @@
+import json
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from billing import ledger
+from billing.models import LedgerOutbox, ModelCatalog, Wallet, Transaction, UsageRecord
+from billing.pricing import charge_wallet_for_usage
+
+
+class FakeStreamRedis:
+    """Just enough of a Redis stream + consumer group for the ledger."""
+
+    def __init__(self):
+        self.entries = {}
+        self.seq = 0
+        self.delivered = set()
+        self.group = False
+
+    def xadd(self, stream, fields):
+        self.seq += 1
+        self.entries[f"{self.seq}-0"] = {k.encode(): v.encode() for k, v in fields.items()}
+
+    def xgroup_create(self, stream, group, id="0", mkstream=False):
+        if self.group:
+            raise Exception("BUSYGROUP Consumer Group name already exists")
+        self.group = True
+
+    def xautoclaim(self, stream, group, consumer, min_idle, start, count=None):
+        claimed = [(i, self.entries[i]) for i in sorted(self.delivered) if i in self.entries][:count]
+        return ["0-0", claimed, []]
+
+    def xreadgroup(self, group, consumer, streams, count=None):
+        fresh = [(i, f) for i, f in self.entries.items() if i not in self.delivered][:count]
+        self.delivered.update(i for i, _ in fresh)
+        return [(ledger.STREAM, fresh)] if fresh else []
+
+    def xack(self, stream, group, *ids):
+        self.delivered.difference_update(ids)
+
+    def xdel(self, stream, *ids):
+        for i in ids:
+            self.entries.pop(i, None)
+
+    def xrange(self, stream):
+        return list(self.entries.items())
+
+
+@pytest.mark.django_db
+def test_stream_ledger_is_applied_exactly_once(settings, monkeypatch, django_capture_on_commit_callbacks):
+    settings.BILLING_LEDGER_MODE = "stream"
+    fake = FakeStreamRedis()
+    monkeypatch.setattr(ledger, "get_redis", lambda: fake)
+
+    cat = ModelCatalog.objects.create(alias="robot-l", model_name="m", input_per_million_usd=1, output_per_million_usd=2)
+    u = get_user_model().objects.create_user(username="ledger-user")
+    Wallet.objects.filter(user=u).update(balance_tokens=1000)
+    Transaction.objects.create(user=u, delta_tokens=1000, reason="topup")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        charge_wallet_for_usage(u, "robot-l", 10, 20, cat=cat)
+        charge_wallet_for_usage(u, "robot-l", 5, 5, cat=cat)
+
+    assert Wallet.objects.get(user=u).balance_tokens == 960
+    assert UsageRecord.objects.count() == 0
+    assert LedgerOutbox.objects.count() == 2
+    call_command("reconcile_ledger", verbosity=0)  # queued entries count towards the ledger
+
+    entries = [json.loads(f[b"data"]) for f in fake.entries.values()]
+    assert ledger.flush(batch_size=10) == 2
+    ledger.apply(entries)  # redelivery after a crash before XACK
+    assert UsageRecord.objects.count() == 2
+    assert Transaction.objects.filter(reason="usage").count() == 2
+    assert fake.entries == {}
+    assert not LedgerOutbox.objects.exists()
+    call_command("reconcile_ledger", verbosity=0)
+
+
+@pytest.mark.django_db
+def test_outbox_recovers_entries_lost_between_commit_and_publish(settings, monkeypatch):
+    from datetime import timedelta
+    from django.utils import timezone
+
+    settings.BILLING_LEDGER_MODE = "stream"
+    settings.BILLING_LEDGER_OUTBOX_GRACE_SECONDS = 60
+    fake = FakeStreamRedis()
+    monkeypatch.setattr(ledger, "get_redis", lambda: fake)
+    cat = ModelCatalog.objects.create(alias="robot-l", model_name="m", input_per_million_usd=1, output_per_million_usd=2)
+    u = get_user_model().objects.create_user(username="crash")
+    Wallet.objects.filter(user=u).update(balance_tokens=1000)
+    Transaction.objects.create(user=u, delta_tokens=1000, reason="topup")
+
+    charge_wallet_for_usage(u, "robot-l", 10, 20, cat=cat)  # on_commit publish never runs: the process died
+    assert fake.entries == {}
+    call_command("reconcile_ledger", verbosity=0)
+
+    assert ledger.recover() == 0  # still inside the grace period
+    LedgerOutbox.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+    assert ledger.recover() == 1
+    assert Transaction.objects.filter(reason="usage").count() == UsageRecord.objects.count() == 1
+    assert not LedgerOutbox.objects.exists()
+    call_command("reconcile_ledger", verbosity=0)
+
+
+@pytest.mark.django_db
+def test_flush_outside_stream_mode_skips_redis(settings, monkeypatch):
+    from billing.tasks import flush_usage_ledger
+
+    settings.BILLING_LEDGER_MODE = "sync"
+    monkeypatch.setattr(ledger, "get_redis", lambda: pytest.fail("redis touched in sync mode"))
+    assert flush_usage_ledger() == 0
+
+
+@pytest.mark.django_db
+def test_reconcile_reports_drift():
+    u = get_user_model().objects.create_user(username="drift")
+    Wallet.objects.filter(user=u).update(balance_tokens=50)
+    with pytest.raises(Exception, match="mismatch"):
+        call_command("reconcile_ledger", verbosity=0)
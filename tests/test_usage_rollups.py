@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from billing import rollups
+from billing.models import UsageRecord, UsageRollup
+
+T0 = datetime(2026, 3, 2, 10, 15, tzinfo=dt_timezone.utc)
+
+
+def usage(user, alias, at, tokens=100, usd="0.0100"):
+    rec = UsageRecord.objects.create(
+        user=user, model_alias=alias, input_tokens=tokens, output_tokens=tokens // 2, cost_usd=Decimal(usd)
+    )
+    UsageRecord.objects.filter(id=rec.id).update(created_at=at)
+    return rec
+
+
+@pytest.mark.django_db
+def test_rollups_fold_incrementally_and_respect_lag(settings):
+    settings.USAGE_ROLLUP_BATCH = 2
+    a, b = (get_user_model().objects.create_user(username=n) for n in ("a", "b"))
+    usage(a, "robot-5", T0)
+    usage(a, "robot-5", T0 + timedelta(minutes=30))
+    usage(a, "robot-5", T0 + timedelta(hours=1))
+    usage(b, "robot-mini", T0 + timedelta(days=1))
+    fresh = usage(b, "robot-mini", timezone.now())  # not settled yet
+
+    assert rollups.advance() == 4
+    hour = UsageRollup.objects.get(granularity="hour", user=a, bucket=T0.replace(minute=0))
+    assert (hour.requests, hour.input_tokens, hour.cost_usd) == (2, 200, Decimal("0.0200"))
+    day = UsageRollup.objects.get(granularity="day", user=a, model_alias="robot-5")
+    assert (day.requests, day.output_tokens) == (3, 150)
+
+    # a later row with an older created_at (backdated, late ledger write) waits behind the unsettled one
+    usage(a, "robot-5", T0 + timedelta(minutes=45))
+    assert rollups.advance() == 0
+    later = fresh.created_at + timedelta(seconds=settings.USAGE_ROLLUP_LAG_SECONDS + 1)
+    # then a run only adds what arrived since, onto the same buckets
+    assert rollups.advance(now=later) == 2
+    assert UsageRollup.objects.get(granularity="day", user=a, model_alias="robot-5").requests == 4
+    assert rollups.advance(now=later) == 0
+
+    UsageRecord.objects.filter(id=fresh.id).update(created_at=T0 + timedelta(days=2))
+    call_command("rollup_usage", "--rebuild", verbosity=0)
+    assert UsageRollup.objects.get(granularity="day", user=a, model_alias="robot-5").requests == 4
+
+
+@pytest.mark.django_db
+def test_reports_read_rollups(client):
+    user = get_user_model().objects.create_user(username="parent")
+    other = get_user_model().objects.create_user(username="other")
+    for i in range(3):
+        usage(user, "robot-5", T0 + timedelta(days=i), usd="0.5000")
+    usage(other, "robot-5", T0, usd="2.0000")
+    rollups.advance()
+    UsageRecord.objects.all().delete()  # reports must not need the raw rows
+
+    client.force_login(user)
+    params = {"since": "2026-03-01", "until": "2026-03-04", "granularity": "day"}
+    res = client.get("/api/billing/usage/", params)
+    assert res.status_code == 200
+    body = res.json()
+    assert body["totals"]["requests"] == 2 and body["totals"]["cost_usd"] == "1.0000"
+    assert [b["bucket"][:10] for b in body["buckets"]] == ["2026-03-02", "2026-03-03"]
+
+    assert client.get("/api/billing/usage/models/", params).status_code == 403
+    assert client.get("/api/billing/usage/", {"granularity": "hour", "since": "2025-01-01"}).status_code == 400
+
+    admin = get_user_model().objects.create_user(username="admin", is_staff=True)
+    client.force_login(admin)
+    res = client.get("/api/billing/usage/models/", {**params, "model_alias": "robot-5"})
+    assert res.json()["totals"]["cost_usd"] == "3.0000"
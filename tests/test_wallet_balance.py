@@ -0,0 +1,121 @@
+import asyncio
+import time
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
+from billing import balance, debit, renewals
+from billing.models import Subscription, Wallet
+
+
+@pytest.fixture
+def user(django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        u = get_user_model().objects.create_user(username="poller")
+        Wallet.objects.filter(user=u).update(balance_tokens=500)
+    balance.refresh(u.id)
+    return u
+
+
+@pytest.mark.django_db
+def test_unchanged_polls_are_304_without_queries(client, user):
+    client.force_login(user)
+    first = client.get("/api/billing/wallet/")
+    assert first.status_code == 200 and first.json() == {"balance_tokens": 500}
+    assert first["Last-Modified"]
+
+    with CaptureQueriesContext(connection) as ctx:
+        again = client.get("/api/billing/wallet/", HTTP_IF_NONE_MATCH=first["ETag"])
+        since = client.get("/api/billing/wallet/", HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+    assert again.status_code == 304 and again["ETag"] == first["ETag"]
+    assert since.status_code == 304
+    assert not [q for q in ctx.captured_queries if "billing_wallet" in q["sql"]]
+
+
+@pytest.mark.django_db
+def test_debits_and_credits_write_through_after_commit(client, user, django_capture_on_commit_callbacks):
+    client.force_login(user)
+    before = client.get("/api/billing/wallet/")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        debit.debit(user.id, 120)
+    with CaptureQueriesContext(connection) as ctx:
+        after = client.get("/api/billing/wallet/", HTTP_IF_NONE_MATCH=before["ETag"])
+    assert after.status_code == 200 and after.json() == {"balance_tokens": 380}
+    assert not [q for q in ctx.captured_queries if "billing_wallet" in q["sql"]]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post("/api/billing/purchase/dev-million/")
+    assert client.get("/api/billing/wallet/").json() == {"balance_tokens": 1_000_380}
+
+
+@pytest.mark.django_db
+def test_stale_entry_behind_newer_version_is_rebuilt(user):
+    assert balance.get(user.id).balance_tokens == 500
+    # نسخه بالا رفته ولی ورودی cache هنوز قدیمی است (مثلاً refresh کندِ نویسندهٔ دیگر)
+    Wallet.objects.filter(user=user).update(balance_tokens=7)
+    balance.invalidate(user.id)
+    assert balance.get(user.id).balance_tokens == 7
+
+
+@pytest.mark.django_db
+def test_renewals_invalidate_cached_balances(user, django_capture_on_commit_callbacks):
+    from django.utils import timezone
+
+    old = balance.get(user.id)
+    Subscription.objects.create(user=user, tokens_per_month=1000, renew_day=1, active=True,
+                                next_renewal_at=timezone.now())
+    with django_capture_on_commit_callbacks(execute=True):
+        renewals.renew_chunk()
+    new = balance.get(user.id)
+    assert new.balance_tokens == 1500 and new.etag != old.etag
+
+
+@pytest.mark.django_db
+def test_under_wsgi_stream_endpoint_answers_at_once(client, user, settings):
+    settings.WALLET_LONGPOLL_SECONDS = 30
+    settings.WALLET_STREAM_RETRY_SECONDS = 5
+    client.force_login(user)
+    tag = client.get("/api/billing/wallet/")["ETag"]
+
+    started = time.monotonic()
+    assert client.get("/api/billing/wallet/stream/", HTTP_IF_NONE_MATCH=tag).status_code == 304
+    assert time.monotonic() - started < 5
+    balance.invalidate(user.id)
+    Wallet.objects.filter(user=user).update(balance_tokens=9)
+    res = client.get("/api/billing/wallet/stream/", HTTP_IF_NONE_MATCH=tag)
+    assert res.status_code == 200 and res.json() == {"balance_tokens": 9}
+
+    sse = client.get("/api/billing/wallet/stream/", HTTP_ACCEPT="text/event-stream")
+    assert b"".join(sse.streaming_content).decode() == 'retry: 5000\n\nevent: balance\ndata: {"balance_tokens": 9}\n\n'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_under_asgi_long_poll_waits_for_change_and_stream_pushes(settings):
+    settings.WALLET_LONGPOLL_SECONDS = 5
+    settings.WALLET_STREAM_SECONDS = 0.3
+    settings.WALLET_STREAM_POLL_SECONDS = 0.01
+    u = get_user_model().objects.create_user(username="asgi-poller")
+    Wallet.objects.filter(user=u).update(balance_tokens=500)
+
+    async def scenario():
+        client = AsyncClient()
+        await client.aforce_login(u)
+        tag = (await client.get("/api/billing/wallet/"))["ETag"]
+
+        async def top_up():
+            await asyncio.sleep(0.05)
+            await sync_to_async(debit.credit)(u.id, 100)
+
+        polled, _ = await asyncio.gather(
+            client.get("/api/billing/wallet/stream/", headers={"If-None-Match": tag}), top_up(),
+        )
+        streamed = await client.get("/api/billing/wallet/stream/", headers={"Accept": "text/event-stream"})
+        frames = [frame async for frame in streamed.streaming_content]
+        return polled, frames
+
+    polled, frames = async_to_sync(scenario)()
+    assert polled.status_code == 200 and polled.json() == {"balance_tokens": 600}
+    assert frames == [b'event: balance\ndata: {"balance_tokens": 600}\n\n']
@@ -0,0 +1,51 @@
+import pytest
+from django.contrib.auth import get_user_model
+from billing import debit
+from billing.models import ModelCatalog, Wallet
+from chat import openai_client
+
+
+@pytest.mark.django_db
+def test_conditional_debit_never_overdraws():
+    u = get_user_model().objects.create_user(username="debit")
+    Wallet.objects.filter(user=u).update(balance_tokens=100)
+    debit.debit(u.id, 60)
+    with pytest.raises(ValueError, match="INSUFFICIENT_WALLET"):
+        debit.debit(u.id, 60)
+    assert Wallet.objects.get(user=u).balance_tokens == 40
+
+
+@pytest.mark.django_db
+def test_empty_wallet_is_rejected_before_upstream_call(client, settings, monkeypatch):
+    settings.WALLET_PREAUTH = "db"
+
+    def upstream_must_not_run(*args, **kwargs):
+        raise AssertionError("upstream called for an empty wallet")
+
+    monkeypatch.setattr(openai_client, "chat_completion", upstream_must_not_run)
+    ModelCatalog.objects.create(alias="robot-d", model_name="m", input_per_million_usd=1, output_per_million_usd=2)
+    u = get_user_model().objects.create_user(username="broke")
+    client.force_login(u)
+
+    res = client.post("/api/chat/send", {"model_alias": "robot-d", "prompt": "hi"}, content_type="application/json")
+    assert res.status_code == 402
+
+
+@pytest.mark.django_db
+def test_settle_after_mirror_expired_does_not_recreate_it(settings, fake_redis):
+    settings.WALLET_PREAUTH = "redis"
+    u = get_user_model().objects.create_user(username="slow")
+    Wallet.objects.filter(user=u).update(balance_tokens=1000)
+    key = debit.AVAIL_KEY.format(u.id)
+
+    hold = debit.preauthorize(u.id, 300)
+    assert int(fake_redis.get(key)) == 700
+    debit.settle(hold, 100)
+    assert int(fake_redis.get(key)) == 900
+
+    hold = debit.preauthorize(u.id, 300)
+    fake_redis.delete(key)  # WALLET_PREAUTH_TTL گذشت
+    debit.settle(hold, 100)
+    assert fake_redis.get(key) is None
+    debit.preauthorize(u.id, 300)  # دوباره از دیتابیس seed می‌شود
+    assert int(fake_redis.get(key)) == 700